@@ -311,7 +311,8 @@ def link_shared_file(job_dir, file):
 	dest_path = Path(f"{job_dir}/{INPUT_DIR}").resolve()
 	file_path = Path(file).resolve()
 	link_name = dest_path / file_path.name
-	if not link_name.exists(): link_name.symlink_to(file_path)
+	# the link may already exist while its target does not (ie. an mzML file that is still being converted)
+	if not link_name.exists() and not link_name.is_symlink(): link_name.symlink_to(file_path)
 
 def link_shared_files(job_dir, app_name, settings):
 	logger.info("Linking data to the job directory")
@@ -0,0 +1,288 @@
+# Copyright or © or Copr. Alexandre BUREL for LSMBO / IPHC UMR7178 / CNRS (2025)
+# 
+# [a.burel@unistra.fr]
+# 
+# This software is the server for Cumulus, a client-server to operate jobs on a Cloud.
+# 
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use, 
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info". 
+# 
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability. 
+# 
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or 
+# data to be ensured and,  more generally, to use and operate it in the 
+# same conditions as regards security. 
+# 
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+from abc import ABC, abstractmethod
+import logging
+import threading
+import time
+
+import libs.cumulus_config as config
+import libs.cumulus_database as db
+
+logger = logging.getLogger(__name__)
+
+class JobBackend(ABC):
+	"""
+	The operations on the jobs that a storage backend must provide: creation, reading and update of the jobs,
+	the lists of jobs per status, the resolution of the workflows and the search.
+	The jobs are always returned as db.JobRecord objects, whatever the backend.
+	"""
+
+	@abstractmethod
+	def create_job(self, form):
+		"""
+		Creates a new PENDING job, see db.create_job for the content of the form.
+
+		Returns:
+			tuple: The ID of the new job and the name of its directory.
+		"""
+
+	@abstractmethod
+	def get_job(self, job_id):
+		"""
+		Returns the job with the given ID, or None if it does not exist.
+		"""
+
+	@abstractmethod
+	def get_jobs(self, job_ids):
+		"""
+		Returns the jobs with the given IDs that exist, ordered by ID.
+		"""
+
+	@abstractmethod
+	def get_value(self, job_id, field):
+		"""
+		Returns the value of a field of a job, or an empty string if the job does not exist.
+		"""
+
+	@abstractmethod
+	def set_value(self, job_id, field, value):
+		"""
+		Changes the value of a field of a job.
+		"""
+
+	def set_status(self, job_id, status): self.set_value(job_id, "status", status)
+	def get_status(self, job_id): return self.get_value(job_id, "status")
+
+	@abstractmethod
+	def get_job_records(self, statuses):
+		"""
+		Returns the jobs with one of the given statuses, oldest ones first.
+		"""
+
+	@abstractmethod
+	def get_jobs_per_status(self, status):
+		"""
+		Returns the IDs of the jobs with the given status, in ascending order.
+		"""
+
+	@abstractmethod
+	def get_associated_jobs(self, job_id):
+		"""
+		Returns the IDs of the jobs of the workflow of the given job, from the first one, or only the given ID if it's not part of a workflow.
+		"""
+
+	@abstractmethod
+	def delete_job(self, job_id):
+		"""
+		Deletes a job, and the other jobs of its workflow.
+		"""
+
+	@abstractmethod
+	def search(self, text = "", owner = "", app_name = "", statuses = [], number = 100):
+		"""
+		Searches the jobs, newest ones first.
+
+		Args:
+			text (str, optional): Words that must all be found in the description, the owner or the app name of the jobs. Defaults to "".
+			owner (str, optional): Text that must be found in the owner of the jobs. Defaults to "".
+			app_name (str, optional): Text that must be found in the app name of the jobs. Defaults to "".
+			statuses (list, optional): The statuses of the jobs to return ("ARCHIVED" for every archived status), all the live jobs if empty. Defaults to [].
+			number (int, optional): The maximum number of jobs to return. Defaults to 100.
+
+		Returns:
+			list[int]: The IDs of the jobs found.
+		"""
+
+class SQLiteBackend(JobBackend):
+	"""
+	The backend used by the server, every operation is done by the functions of cumulus_database.
+	"""
+
+	def create_job(self, form): return db.create_job(form)
+	def get_job(self, job_id): return db.get_job(job_id)
+	def get_jobs(self, job_ids): return db.get_jobs(job_ids)
+	def get_value(self, job_id, field): return db.get_value(job_id, field)
+	def set_value(self, job_id, field, value): db.set_value(job_id, field, value)
+	def get_job_records(self, statuses): return db.get_job_records(statuses)
+	def get_jobs_per_status(self, status): return db.get_jobs_per_status(status)
+	def get_associated_jobs(self, job_id): return db.get_associated_jobs(job_id)
+	def delete_job(self, job_id): db.delete_job(job_id)
+
+	def search(self, text = "", owner = "", app_name = "", statuses = [], number = 100):
+		# build the same form as the search page of the client
+		form = {"current_job_id": 0, "owner": owner, "app": app_name, "description": "", "number": str(number), "date": "creation_date", "from": "", "to": "", "file": "", "text": text}
+		for status in statuses: form[status.lower()] = "on"
+		return [job["id"] for job in db.search_jobs(form)]
+
+class MemoryBackend(JobBackend):
+	"""
+	A backend that keeps the jobs in memory, it's meant for the tests, the simulations of the scheduler,
+	and to measure the time spent in the database apart from the rest of the daemon.
+	The jobs are lost when the process stops.
+
+	Notes:
+		- Every operation holds the same lock, so the backend can be shared by the daemons and the API threads.
+		- The jobs are indexed by status and by previous job, so the daemons never go through all the jobs.
+		- The records returned are copies, they can be modified by the caller.
+	"""
+
+	def __init__(self):
+		# the columns of each job, as they would be stored in the jobs table
+		self.jobs = {}
+		# the IDs of the jobs for each status
+		self.statuses = {}
+		# the IDs of the jobs that start after each job (the next jobs of a workflow)
+		self.next_jobs = {}
+		self.last_id = 0
+		self.lock = threading.RLock()
+
+	def get_record(self, job_id):
+		# build a new record from the stored columns (the settings are parsed here, as they are for the SQLite backend)
+		row = self.jobs[job_id]
+		return db.JobRecord(tuple(row[field] for field in db.JobRecord.__slots__))
+
+	def create_job(self, form):
+		creation_date = int(time.time())
+		start_after_id = int(form["start_after_id"]) if "start_after_id" in form and form["start_after_id"] is not None else None
+		with self.lock:
+			self.last_id += 1
+			job_id = self.last_id
+			job_dir_name = f"Job_{job_id}_{form['username']}_{form['app_name']}_{str(creation_date)}"
+			self.jobs[job_id] = {"id": job_id, "owner": form["username"], "app_name": form["app_name"], "strategy": form["strategy"], "description": form["description"], "settings": form["settings"],
+				"status": "PENDING", "host": "", "creation_date": creation_date, "start_date": None, "end_date": None, "stdout": "", "stderr": "", "job_dir": f"{config.JOB_DIR}/{job_dir_name}",
+				"start_after_id": start_after_id, "workflow_name": form["workflow_name"] if "workflow_name" in form else None, "last_modified": 0}
+			self.statuses.setdefault("PENDING", set()).add(job_id)
+			if start_after_id is not None: self.next_jobs.setdefault(start_after_id, []).append(job_id)
+		return job_id, job_dir_name
+
+	def get_job(self, job_id):
+		with self.lock:
+			return self.get_record(job_id) if job_id in self.jobs else None
+
+	def get_jobs(self, job_ids):
+		with self.lock:
+			return [self.get_record(job_id) for job_id in sorted(set(job_ids)) if job_id in self.jobs]
+
+	def get_value(self, job_id, field):
+		with self.lock:
+			return self.jobs[job_id][field] if job_id in self.jobs else ""
+
+	def set_value(self, job_id, field, value):
+		with self.lock:
+			if job_id not in self.jobs: return
+			row = self.jobs[job_id]
+			# keep the indexes up to date
+			if field == "status":
+				self.statuses[row["status"]].discard(job_id)
+				self.statuses.setdefault(value, set()).add(job_id)
+			elif field == "start_after_id":
+				if row["start_after_id"] is not None: self.next_jobs[row["start_after_id"]].remove(job_id)
+				if value is not None: self.next_jobs.setdefault(value, []).append(job_id)
+			row[field] = value
+
+	def get_job_records(self, statuses):
+		with self.lock:
+			return [self.get_record(job_id) for job_id in sorted(set().union(*[self.statuses.get(status, set()) for status in statuses]))]
+
+	def get_jobs_per_status(self, status):
+		with self.lock:
+			return sorted(self.statuses.get(status, set()))
+
+	def get_associated_jobs(self, job_id):
+		with self.lock:
+			if job_id not in self.jobs: return [job_id]
+			# go back to the first job of the workflow (the depth is limited, as it is in SQL_WORKFLOW)
+			first_id = job_id
+			for _ in range(1000):
+				previous_id = self.jobs[first_id]["start_after_id"]
+				if previous_id is None or previous_id not in self.jobs: break
+				first_id = previous_id
+			# then follow the next jobs, level by level
+			ids = []
+			level = [first_id]
+			while len(level) > 0 and len(ids) < 1000:
+				ids.extend(level)
+				level = sorted([next_id for id in level for next_id in self.next_jobs.get(id, [])])
+			return ids
+
+	def delete_job(self, job_id):
+		with self.lock:
+			for id in self.get_associated_jobs(job_id):
+				if id not in self.jobs: continue
+				row = self.jobs.pop(id)
+				self.statuses[row["status"]].discard(id)
+				if row["start_after_id"] in self.next_jobs: self.next_jobs[row["start_after_id"]].remove(id)
+				self.next_jobs.pop(id, None)
+
+	def search(self, text = "", owner = "", app_name = "", statuses = [], number = 100):
+		words = text.lower().split()
+		with self.lock:
+			# read the jobs of the requested statuses only, the archived jobs are only returned if they are requested
+			if len(statuses) == 0: ids = set(self.jobs).difference(*[ids for status, ids in self.statuses.items() if status.startswith("ARCHIVED")])
+			else: ids = set().union(*[ids for status, ids in self.statuses.items() if status in statuses or (status.startswith("ARCHIVED") and "ARCHIVED" in statuses)])
+			results = []
+			for job_id in sorted(ids, reverse = True):
+				row = self.jobs[job_id]
+				if owner.lower() not in row["owner"].lower() or app_name.lower() not in row["app_name"].lower(): continue
+				fields = [row["description"].lower(), row["owner"].lower(), row["app_name"].lower()]
+				# the words must all be found, each one in any of the fields
+				if any(not any(word in field for field in fields) for word in words): continue
+				results.append(job_id)
+				if len(results) == number: break
+			return results
+
+# the available backends, by name
+BACKENDS = {
+	"sqlite": SQLiteBackend,
+	"memory": MemoryBackend
+}
+
+def get_backend(name = "sqlite"):
+	"""
+	Creates a storage backend for the jobs.
+
+	Args:
+		name (str, optional): The name of the backend, a key of BACKENDS. Defaults to "sqlite".
+
+	Returns:
+		JobBackend: A new instance of the backend.
+
+	Raises:
+		ValueError: If there is no backend with this name.
+	"""
+	if name not in BACKENDS: raise ValueError(f"Unknown storage backend '{name}', it should be one of: {', '.join(BACKENDS)}")
+	return BACKENDS[name]()
+
+# the backend of the server, the API and the daemons read and change the jobs through it
+# the other tables (ie. the flavor ledger, the warm workers) are only stored in SQLite, so the server always uses the SQLite backend
+STORAGE = get_backend("sqlite")
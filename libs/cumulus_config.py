@@ -128,7 +128,7 @@ def load(config_file_path):
 	# load the flavors
 	load_flavors()
 
-def get(key): 
+def get(key, default = None): 
 	"""
 	Retrieve the value associated with the given key from the configuration.
 
@@ -137,14 +137,16 @@ def get(key):
 
 	Args:
 		key (str): The key whose value should be retrieved from the configuration.
+		default (str, optional): The value to return if the key is not in the configuration (for the optional keys). Defaults to None.
 
 	Returns:
 		Any: The value associated with the specified key.
 
 	Raises:
-		KeyError: If the key is not found in the configuration.
+		KeyError: If the key is not found in the configuration and there is no default value.
 	"""
 	if len(CONFIG) == 0: load(CONFIG_FILE_PATH)
+	if default is not None and key not in CONFIG: return default
 	return CONFIG[key]
 
 def init(create_dirs = True):
@@ -30,21 +30,40 @@
 # The fact that you are presently reading this means that you have had
 # knowledge of the CeCILL license and that you accept its terms.
 
+from concurrent.futures import ThreadPoolExecutor
 import logging
 import os
-import threading
 import time
 
 import libs.cumulus_config as config
+import libs.cumulus_backends as backends
 import libs.cumulus_utils as utils
 import libs.cumulus_database as db
 import libs.cumulus_apps as apps
+import libs.cumulus_readiness as readiness
+import libs.cumulus_scheduler as scheduler
+import libs.cumulus_tasks as tasks
+import libs.cumulus_warmpool as warmpool
+import libs.cumulus_watcher as watcher
 
 logger = logging.getLogger(__name__)
 
 REFRESH_RATE = int(config.get("refresh.rate.in.seconds"))
+# the last time the alive file of each running job has been seen changing (monotonic clock of the daemon)
+ALIVE_SEEN = {}
+# the jobs loaded at the beginning of the last check of the daemon, the conversion daemon reads them too
+SNAPSHOT = None
+# the running jobs are checked in parallel, the checks mostly wait for the shared storage
+LIVENESS_POOL = ThreadPoolExecutor(max_workers = int(config.get("liveness.check.threads", "8")), thread_name_prefix = "cumulus-liveness")
+# the jobs whose worker is created before their files are all there (see scheduler.speculate), with the date they became PREPARING (monotonic clock of the daemon)
+# they stay PREPARING until start_job has seen all their files
+SPECULATIVE = {}
+# the jobs whose files have not arrived in time, their worker will only be created once their files are there
+SPECULATION_EXPIRED = set()
+# a job whose worker has been created in advance goes back to PENDING if its files are not all there after this time (in seconds)
+SPECULATION_MAX_WAIT = int(config.get("speculative.max.wait.in.minutes", "60")) * 60
 
-def is_process_running(job_id):
+def is_process_running(job_id, snapshot = None):
 	"""
 	Check if a process associated with a given job ID is currently running.
 
@@ -54,6 +73,7 @@ def is_process_running(job_id):
 
 	Args:
 		job_id (int): The unique identifier for the job whose process status is to be checked.
+		snapshot (db.JobSnapshot, optional): The jobs loaded for the current check. They are loaded from the database otherwise.
 
 	Returns:
 		bool: True if the process is running, False otherwise.
@@ -62,22 +82,26 @@ def is_process_running(job_id):
 	# host_name = db.get_host(job_id)
 	is_alive = False
 	# get all the jobs that are associated to this job_id (could be several if the job is part of a workflow)
-	for id in db.get_associated_jobs(job_id):
-		logger.debug(f"Checking if the process for job {id} is still running")
+	if snapshot is None: snapshot = db.get_snapshot()
+	for job in snapshot.get_workflow(job_id):
+		logger.debug(f"Checking if the process for job {job.id} is still running")
 		# two files are used to check if the job is still running:
-		alive_file = db.get_job_dir(id) + "/" + config.JOB_ALIVE_FILE # the alive file is created when the job starts
+		alive_file = job.job_dir + "/" + config.JOB_ALIVE_FILE # the alive file is created when the job starts
 		logger.debug(f"Searching for alive file {alive_file}: exists={os.path.exists(alive_file)}")
-		stop_file = db.get_job_dir(id) + "/" + config.JOB_STOP_FILE # the stop file is created when the job ends
+		stop_file = job.job_dir + "/" + config.JOB_STOP_FILE # the stop file is created when the job ends
 		logger.debug(f"Searching for stop file {stop_file}: exists={os.path.exists(stop_file)}")
 		# if the alive file exists, it must have been updated recently (less than 3 minutes ago) to consider that the job is still running
 		# if os.path.exists(alive_file): is_alive = time.time() - os.path.getmtime(alive_file) < 180
 		if os.path.exists(alive_file): 
 			# is_alive = time.time() - os.path.getmtime(alive_file) < 180
-			previous_time = int(db.get_last_modified(id))
+			previous_time = int(job.last_modified)
 			current_time = int(os.path.getmtime(alive_file))
 			logger.debug(f"Alive file {alive_file} was last modified at {previous_time}, current modification time is {current_time}")
-			is_alive = current_time > previous_time
-			if is_alive: db.set_last_modified(id, current_time)
+			if current_time > previous_time or job.id not in ALIVE_SEEN: ALIVE_SEEN[job.id] = time.monotonic()
+			if current_time > previous_time: db.set_last_modified(job.id, current_time)
+			# the jobs may be checked more often than their alive file is updated (ie. when a file of another job has changed),
+			# so a job is only considered dead if its alive file has not changed for a whole refresh period
+			is_alive = time.monotonic() - ALIVE_SEEN[job.id] < REFRESH_RATE
 		# if the alive file does not exist, check if the stop file exists, in this case, the job has stopped
 		elif os.path.exists(stop_file): is_alive = False
 		# there should always be an alive file or a stop file, but if none of them exist, we consider that the job is not running
@@ -88,7 +112,28 @@ def is_process_running(job_id):
 	# return the status directly
 	return is_alive
 
-def check_running_jobs():
+def check_running_job(job, snapshot):
+	"""
+	Checks if the process of a RUNNING job is still active and, if it's not, whether the job has succeeded.
+	This function is run by the liveness pool, it does not change the status of the job.
+
+	Args:
+		job (db.JobRecord): The job to check.
+		snapshot (db.JobSnapshot): The jobs loaded for the current check.
+
+	Returns:
+		str: None if the job is still running, "DONE" or "FAILED" otherwise.
+	"""
+	try:
+		if is_process_running(job.id, snapshot): return None
+		# ask the proper app module if the job is finished or failed
+		return "DONE" if apps.is_finished(job.id, job.app_name) else "FAILED"
+	except Exception as e:
+		# the job will be checked again at the next refresh
+		logger.error(f"Cannot check if job {job.id} is still running: {e}")
+		return None
+
+def check_running_jobs(snapshot = None):
 	"""
 	Checks all jobs with status "RUNNING" to determine if their associated processes are still active.
 
@@ -101,69 +146,93 @@ def check_running_jobs():
 		- Logs the outcome (success or failure) with job details.
 
 	This function relies on external modules for database access, process checking, and application-specific job status evaluation.
+	The running jobs are checked in parallel (see LIVENESS_POOL), and all the changes of status are committed at once.
+
+	Args:
+		snapshot (db.JobSnapshot, optional): The jobs loaded for the current check. They are loaded from the database otherwise.
 	"""
-	for job_id in db.get_jobs_per_status("PREPARING"):
+	if snapshot is None: snapshot = db.get_snapshot()
+	# the changes of status (job_id, status, date field), they are committed in a single transaction
+	transitions = []
+	for job in snapshot.get_jobs(["PREPARING"]):
 		# if the host could not be created, the job has failed
-		job_dir = db.get_job_dir(job_id)
+		job_id = job.id
 		# if the host is not yet created, do nothing and wait for the next check
-		host_file = f"{job_dir}/{config.HOST_FILE}"
+		host_file = f"{job.job_dir}/{config.HOST_FILE}"
 		if not os.path.exists(host_file): continue # TODO what if the file was not yet created?
 		# get the host that was generated
-		host = utils.get_host_from_file(f"{job_dir}/{config.HOST_FILE}")
+		host = utils.get_host_from_file(host_file)
 		# abort if the host could not be created
 		if host is None:
-			db.set_status(job_id, "FAILED")
-			db.set_end_date(job_id)
+			transitions.append((job_id, "FAILED", "end_date"))
+			job.status = "FAILED"
 			logger.error(f"Cannot create the host for job {job_id}, aborting")
 			# if the file is not created yet, it may be because the server was stopped during this phase
 			# in that case, we should recall start_job
 		elif host.error is not None:
-			db.set_status(job_id, "FAILED")
-			db.set_end_date(job_id)
+			transitions.append((job_id, "FAILED", "end_date"))
+			job.status = "FAILED"
 			logger.error(f"Cannot create the host for job {job_id}, error was: {host.error}, aborting")
+		elif job_id in SPECULATIVE:
+			# the worker has been created in advance, the job waits for its files without reserving the weight for too long
+			if time.monotonic() - SPECULATIVE[job_id] < SPECULATION_MAX_WAIT: continue
+			logger.warning(f"The files of job {job_id} have not arrived in time, its worker is released")
+			SPECULATION_EXPIRED.add(job_id)
+			transitions.append((job_id, "PENDING", None))
+			job.status = "PENDING"
+			snapshot.reserved_weight -= snapshot.weights.pop(job_id, 0)
+			# the worker is released once the waiting job is cancelled by readiness.refresh, unless its task has not been run yet
+			for task in tasks.PROVISIONING.cancel(job_id):
+				if task.name == "run_job": release_speculative_worker(job_id, job.job_dir)
+				else: SPECULATIVE.pop(job_id, None)
 		else:
 			# the host has been created, the job can start
-			db.set_status(job_id, "RUNNING")
-			db.set_start_date(job_id)
-	for job_id in db.get_jobs_per_status("RUNNING"):
-		# check that the process still exist
-		if not is_process_running(job_id):
-			# destroy the worker VM in the background
-			threading.Thread(target=utils.destroy_worker, args=(job_id,)).start()
-			# record the end date
-			db.set_end_date(job_id)
-			# ask the proper app module if the job is finished or failed
-			if apps.is_finished(job_id, db.get_app_name(job_id)): 
-				db.set_status(job_id, "DONE")
-				logger.info(f"Correct ending of {db.get_job_to_string(job_id)}")
-			else:
-				db.set_status(job_id, "FAILED")
-				db.set_end_date(job_id)
-				logger.warning(f"Failure of {db.get_job_to_string(job_id)}")
+			transitions.append((job_id, "RUNNING", "start_date"))
+			job.status = "RUNNING"
+	# check that the processes still exist, the jobs that have just started included
+	running_jobs = snapshot.get_jobs(["RUNNING"])
+	for job, status in zip(running_jobs, LIVENESS_POOL.map(lambda job: check_running_job(job, snapshot), running_jobs)):
+		if status is None: continue
+		job_id = job.id
+		ALIVE_SEEN.pop(job_id, None)
+		# record the end date and the final status
+		transitions.append((job_id, status, "end_date"))
+		job.status = status
+		# keep the worker VM for the next job of the owner, or destroy it in the background
+		if not warmpool.hand_over(job, snapshot): tasks.TEARDOWN.submit("destroy_worker", job_id, utils.destroy_worker, job_id)
+		if status == "DONE": logger.info(f"Correct ending of {job}")
+		else: logger.warning(f"Failure of {job}")
+	if len(transitions) > 0: db.apply_transitions(transitions)
 
 def start_job(job_id, job_dir, app_name, settings, flavor, job_details):
 	"""
-	Starts a job on a remote host by generating and executing a script, then updates the job status in the database.
+	Prepares a job on a remote host: links its files, takes or creates its worker and generates its script.
+	The script is started by run_job once all the files of the job are ready, the thread is released in the meantime.
 	Note: This function is intended to be run in a separate thread to avoid blocking the main daemon loop. That's why
 	it takes all the parameters instead of fetching them from the database (otherwise it may get a locked database error).
 
 	Args:
-		job_id (str): Unique identifier for the job.
+		job_id (int): Unique identifier for the job.
 		job_dir (str): Directory where the job files are located.
 		app_name (str): Name of the application to run.
 		settings (dict): Dictionary of settings for the job/application.
-		host (Host): Host object representing the remote machine where the job will run.
+		flavor (str): Name of the flavor of the worker, as reserved when the job became PREPARING.
+		job_details (str): Description of the job, for the logs.
 
 	Side Effects:
+		- Writes the host file of the job, and creates the worker VM unless a warm worker is available.
 		- Generates a script file for the job and writes it to disk.
-		- Executes the script remotely via SSH on the specified host.
-		- Updates the job's host, status, and start date in the database.
-		- Logs information about the job execution process.
+		- Submits run_job to the provisioning pool once all the files of the job are ready.
 	"""
 	# create symbolic links of the raw files into the input folder
 	apps.link_shared_files(job_dir, app_name, settings)
-	# create the worker based on the template worker
-	utils.create_worker(job_id, job_dir, flavor)
+	# use the worker taken over when the job became PREPARING (from the warm pool or from a previous job), or create the worker based on the template worker
+	warm_worker = db.take_warm_worker(job_id)
+	if warm_worker is not None:
+		logger.info(f"Job {job_id} uses the warm worker '{warm_worker['name']}'")
+		utils.add_to_stdalt(job_id, f"The virtual machine for job '{job_id}' was already available")
+		utils.write_host_file(job_dir, warm_worker["name"], warm_worker["address"], config.FLAVORS[flavor]['cpu'], config.FLAVORS[flavor]['ram'], warm_worker["volume"], None)
+	else: utils.create_worker(job_id, job_dir, flavor)
 	# get the host that was generated
 	host = utils.get_host_from_file(f"{job_dir}/{config.HOST_FILE}")
 	# abort if the host could not be created
@@ -171,28 +240,88 @@ def start_job(job_id, job_dir, app_name, settings, flavor, job_details):
 		# create the script to run the job
 		cmd_file, content = apps.generate_script_content(job_id, job_dir, app_name, settings, host.cpu)
 		utils.write_file(cmd_file, content)
-		# wait until all the files are there (mzML conversion may still be running at this point)
-		# FIXME a job was started while the last file was still being converted
-		while not apps.are_all_files_transfered(job_dir, app_name, settings, True):
-			# wait 10 seconds
-			time.sleep(10)
-		# start the remote script to run the job
-		utils.add_to_stdalt(job_id, f"Remotely execute the job {job_id} on the virtual machine")
-		# remote_cmd = f"{config.JOB_START_FILE} {job_id} '{job_dir}'"
-		remote_cmd = f"{config.JOB_START_FILE} '{job_dir}'"
-		utils.remote_script(host, remote_cmd)
-		# log the command owner, app_name, status, strategy
-		# logger.info(f"Starting {db.get_job_to_string(job_id)}")
-		logger.info(f"Starting {job_details}")
-
-def start_pending_jobs():
+		# start the job once all the files are there (mzML conversion may still be running at this point)
+		# the converter and the daemon signal the files when they are ready, an mzML file is not ready until it has been moved in place
+		files = [f"{job_dir}/{apps.FINAL_FILE}"] + apps.get_files(job_dir, app_name, settings, True)
+		# the job starts before the workers still to be created, they take minutes
+		readiness.watch(job_id, files,
+			lambda: tasks.PROVISIONING.submit("run_job", job_id, run_job, job_id, job_dir, job_details, priority = -1),
+			lambda: release_speculative_worker(job_id, job_dir))
+	else: SPECULATIVE.pop(job_id, None)
+
+def run_job(job_id, job_dir, job_details):
+	"""
+	Executes the script of a job on its worker, once all the files of the job are ready (see start_job).
+
+	Args:
+		job_id (int): Unique identifier for the job.
+		job_dir (str): Directory where the job files are located.
+		job_details (str): Description of the job, for the logs.
+	"""
+	# the job can become RUNNING
+	SPECULATIVE.pop(job_id, None)
+	host = utils.get_host_from_file(f"{job_dir}/{config.HOST_FILE}")
+	# start the remote script to run the job
+	utils.add_to_stdalt(job_id, f"Remotely execute the job {job_id} on the virtual machine")
+	# remote_cmd = f"{config.JOB_START_FILE} {job_id} '{job_dir}'"
+	remote_cmd = f"{config.JOB_START_FILE} '{job_dir}'"
+	utils.remote_script(host, remote_cmd)
+	# log the command owner, app_name, status, strategy
+	# logger.info(f"Starting {db.get_job_to_string(job_id)}")
+	logger.info(f"Starting {job_details}")
+
+def release_speculative_worker(job_id, job_dir):
+	"""
+	Destroys the worker created in advance for a job that has stopped before all its files were ready (ie. the job
+	has been cancelled or its files have not arrived in time). The worker of the other jobs is destroyed when they end.
+	The host file is removed first, so that the job is not considered RUNNING on this worker if it is started again.
+
+	Args:
+		job_id (int): Unique identifier for the job.
+		job_dir (str): Directory where the job files are located.
+	"""
+	logger.info(f"Job {job_id} has stopped before all its files were ready")
+	if job_id not in SPECULATIVE: return
+	host_file = f"{job_dir}/{config.HOST_FILE}"
+	host = utils.get_host_from_file(host_file)
+	if os.path.exists(host_file): os.remove(host_file)
+	# the job can be scheduled again once the host file is gone
+	SPECULATIVE.pop(job_id, None)
+	if host is not None: tasks.TEARDOWN.submit("destroy_worker", job_id, utils.destroy_host, host)
+
+def prepare_job(job, flavor, weight, snapshot, priority = 0):
+	"""
+	Moves a job to the PREPARING status and reserves the weight of its flavor, then creates its host and starts it in the provisioning pool.
+	The status will remain PREPARING until the host is created and the job started.
+
+	Args:
+		job (db.JobRecord): The job to prepare.
+		flavor (str): Name of the flavor chosen by the scheduler.
+		weight (int): Weight of the flavor, it is reserved for the job.
+		snapshot (db.JobSnapshot): The jobs loaded for the current check, the reserved weight is updated in place.
+		priority (int, optional): Priority of the task in the provisioning pool (lowest first). Defaults to 0.
+
+	Returns:
+		bool: True if the job is PREPARING, False if the capacity has been taken in the meantime.
+	"""
+	# set the status to PREPARING and reserve the weight of the flavor at once, to avoid exceeding the maximum weight
+	if not db.reserve_flavor(job.id, flavor, weight, config.FLAVORS_MAX_WEIGHT): return False
+	job.status = "PREPARING"
+	snapshot.reserved_weight += weight
+	snapshot.weights[job.id] = weight
+	# create the new VM with this flavor, and call start_job once the host is created
+	tasks.PROVISIONING.submit("start_job", job.id, start_job, job.id, job.job_dir, job.app_name, job.settings, flavor, str(job), priority = priority)
+	return True
+
+def start_pending_jobs(snapshot = None):
 	"""
 	Starts all pending jobs that are ready to run.
 
 	This function iterates through all jobs with a "PENDING" status, checks if all required files have been transferred,
-	and if so, attempts to find an available host according to the job's strategy. If a suitable host is found, the job
-	is started and its status is updated to "RUNNING". If not all files are present or no host is available, the job
-	remains pending and appropriate log messages are generated.
+	and then lets the scheduler decide which of these jobs can start now, according to the weight of their flavors and to
+	the scheduling policy (see cumulus_scheduler). The jobs that start become "PREPARING" and their host is created in the
+	provisioning pool, the other ones remain pending and the reason is logged.
+	If the speculative provisioning is enabled, the weight left is used to create the workers of the jobs still uploading their files.
 
 	Logging:
 		- Logs debug information for each job's status.
@@ -200,45 +329,66 @@ def start_pending_jobs():
 		- Logs a warning if no host is available for a ready job.
 		- Logs debug information if a job is not ready to start yet.
 
+	Args:
+		snapshot (db.JobSnapshot, optional): The jobs loaded for the current check. They are loaded from the database otherwise.
+
 	Dependencies:
-		- Relies on external modules/functions: db, apps, find_host, start_job, and logger.
+		- Relies on external modules/functions: db, apps, scheduler, start_job, and logger.
 	"""
+	if snapshot is None: snapshot = db.get_snapshot()
 	# get all the PENDING jobs, oldest ones first
-	for job_id in db.get_jobs_per_status("PENDING"):
-		logger.debug(f"Job {job_id} is PENDING")
-		job_dir = db.get_job_dir(job_id)
-		app_name = db.get_app_name(job_id)
-		settings = db.get_settings(job_id)
+	ready_jobs = []
+	uploading_jobs = []
+	for job in snapshot.get_jobs(["PENDING"]):
+		logger.debug(f"Job {job.id} is PENDING")
+		# the worker created in advance for this job is still being released
+		if job.id in SPECULATIVE: continue
 		# check that all the files are present
-		if apps.are_all_files_transfered(job_dir, app_name, settings):
-			logger.info(f"Job {job_id} is ready to start")
-			# the strategy of the job must tell us which flavor to use
-			flavor = utils.check_flavor(job_id)
-			if flavor is None:
-				logger.warning(f"No host available for job {job_id} with flavor '{flavor}' at this moment")
-			else:
-				# directly set the host and the status to RUNNING in the database to avoid starting another job on the same host
-				db.set_status(job_id, "PREPARING")
-				# create the new VM with this flavor
-				# run this in a thread, and call start_job once the host is created
-				# the status will remain PENDING until the host is created and the job started
-				threading.Thread(target=start_job, args=(job_id, job_dir, app_name, settings, flavor, db.get_job_to_string(job_id))).start()
+		if apps.are_all_files_transfered(job.job_dir, job.app_name, job.settings):
+			logger.info(f"Job {job.id} is ready to start")
+			ready_jobs.append(job)
 		else:
-			logger.debug(f"Job {job_id} is NOT ready to start YET")
+			logger.debug(f"Job {job.id} is NOT ready to start YET")
+			if job.id not in SPECULATION_EXPIRED: uploading_jobs.append(job)
+	# the strategy of each job tells which flavor to use, the scheduler decides which jobs start now
+	warm_workers = db.get_warm_workers() if len(ready_jobs) > 0 or (len(uploading_jobs) > 0 and scheduler.is_speculative()) else []
+	decisions = scheduler.schedule(ready_jobs, snapshot, warm_workers = warm_workers)
+	for decision in decisions:
+		job_id, flavor, weight = decision.job_id, decision.flavor, decision.weight
+		if not decision.start:
+			logger.warning(f"No host available for job {job_id} with flavor '{flavor}' at this moment: {decision.reason}")
+		elif not prepare_job(snapshot.jobs[job_id], flavor, weight, snapshot):
+			logger.warning(f"No host available for job {job_id} with flavor '{flavor}' at this moment")
+		else: SPECULATION_EXPIRED.discard(job_id)
+	# the boot of the workers overlaps the transfer of the files, the jobs still wait for their files before running (see start_job)
+	for decision in scheduler.speculate(uploading_jobs, snapshot, decisions, warm_workers):
+		job = snapshot.jobs[decision.job_id]
+		SPECULATIVE[job.id] = time.monotonic()
+		# the jobs ready to run are provisioned first
+		if prepare_job(job, decision.flavor, decision.weight, snapshot, 1): logger.info(f"The worker of job {job.id} is created while its files are uploaded")
+		else: SPECULATIVE.pop(job.id, None)
 
-def restart_paused_jobs():
+def restart_paused_jobs(snapshot = None):
 	# Special case for PAUSED jobs, only happen when restarting the server
 	# The PAUSED status should only exist between a shutdown and a restart
-	for job_id in db.get_jobs_per_status("PAUSED"):
+	if snapshot is None: snapshot = db.get_snapshot()
+	for job in snapshot.get_jobs(["PAUSED"]):
 		# restarting this job immediately
-		logger.info(f"Resume job {job_id}")
-		db.set_status(job_id, "PREPARING")
+		logger.info(f"Resume job {job.id}")
+		# the job has kept the flavor it had reserved before the shutdown
+		flavor = db.get_reserved_flavor(job.id)
+		if flavor is None:
+			# without reservation, the job will be started again like a pending job
+			logger.warning(f"Job {job.id} has no reserved flavor, it will wait for an available host")
+			backends.STORAGE.set_status(job.id, "PENDING")
+			job.status = "PENDING"
+			continue
+		backends.STORAGE.set_status(job.id, "PREPARING")
+		job.status = "PREPARING"
+		# the worker may have been created before the files were all there
+		if not apps.are_all_files_transfered(job.job_dir, job.app_name, job.settings): SPECULATIVE[job.id] = time.monotonic()
 		# in this case, we consider that everything is already prepared
-		job_dir = db.get_job_dir(job_id)
-		app_name = db.get_app_name(job_id)
-		settings = db.get_settings(job_id)
-		flavor = utils.check_flavor(job_id)
-		threading.Thread(target=start_job, args=(job_id, job_dir, app_name, settings, flavor, db.get_job_to_string(job_id))).start()
+		tasks.PROVISIONING.submit("start_job", job.id, start_job, job.id, job.job_dir, job.app_name, job.settings, flavor, str(job))
 
 def run():
 	"""
@@ -249,7 +399,7 @@ def run():
 		- Reload the application list if updates are detected.
 		- Check the status of running jobs and update their states.
 		- Start any pending jobs, prioritizing the oldest ones.
-		- Sleep for a defined refresh rate before repeating the process.
+		- Wait until a file of an active job changes (the stop file, the host file or the final file), or for a defined refresh rate, before repeating the process.
 
 	Possible job statuses include: PENDING, PREPARING, RUNNING, DONE, FAILED, CANCELLED, ARCHIVED_DONE, ARCHIVED_FAILED, ARCHIVED_CANCELLED.
 	"""
@@ -257,25 +407,42 @@ def run():
 	config.init()
 	# wait a little before starting the daemon
 	time.sleep(10)
+	# the jobs are checked as soon as one of their files changes
+	watcher.start()
+	global SNAPSHOT
 	# possible statuses: PENDING, PREPARING, RUNNING, DONE, FAILED, CANCELLED, ARCHIVED_DONE, ARCHIVED_FAILED, ARCHIVED_CANCELLED
 	while True:
+		start = time.monotonic()
 		# reload the app list if needed (allows to update the app list without restarting the daemon)
 		if apps.is_there_app_update(): apps.get_app_list()
+		# load all the jobs that are not over yet at once, every phase of the check uses them
+		snapshot = db.get_snapshot()
+		SNAPSHOT = snapshot
 		# check the running jobs to see if they are finished
-		check_running_jobs()
+		check_running_jobs(snapshot)
 		# get all the PENDING jobs, oldest ones first
-		start_pending_jobs()
-		# sleep for 30 seconds before checking the jobs again
-		time.sleep(REFRESH_RATE)
+		start_pending_jobs(snapshot)
+		# the checks must be shorter than the refresh rate, otherwise the jobs are handled late
+		duration = time.monotonic() - start
+		logger.debug(f"{len(snapshot.jobs)} active jobs have been checked in {duration:.3f} seconds")
+		if duration > REFRESH_RATE: logger.warning(f"Checking the jobs took {duration:.1f} seconds, it's longer than the refresh rate ({REFRESH_RATE} seconds)")
+		# the jobs waiting for their files are woken up if the files have arrived, or if they have stopped
+		readiness.refresh([job.id for job in snapshot.get_jobs(["PREPARING", "RUNNING"])])
+		# watch the directories of the active jobs until the next check
+		watcher.watch([job.job_dir for job in snapshot.get_jobs(["PENDING", "PREPARING", "RUNNING"])])
+		# the jobs are still checked every 30 seconds, in case an event is missed (ie. on NFS)
+		watcher.wait(REFRESH_RATE)
 
 def clean():
 	"""
 	Periodically cleans up old and unused files and directories related to jobs.
 
 	This function performs the following maintenance tasks in an infinite loop, running once every 24 hours after an initial 60-second delay:
-	- Archives and deletes job folders for jobs that have ended and are older than the configured maximum age.
+	- Archives and deletes job folders for jobs that have ended and are older than the configured maximum age, the archived jobs are moved to the archive table.
 	- Deletes job directories that are not linked to any existing job ("zombie" job folders).
 	- Deletes shared files that are old and unused.
+	- Removes the old events from the job journal.
+	- Runs the maintenance of the database (vacuum, statistics, checkpoint).
 
 	All deletions and archival actions are logged with warnings.
 
@@ -288,10 +455,15 @@ def clean():
 	while True:
 		# list the jobs older than the max age in seconds
 		max_age_in_seconds = int(config.get("data.max.age.in.days")) * 86400
+		archived_ids = set()
 		for job_id, status, job_dir in db.get_ended_jobs_older_than(max_age_in_seconds):
-			db.set_status(job_id, "ARCHIVED_" + status)
-			utils.delete_job_folder(job_dir, False, True)
-			logger.warning(f"Job {job_id} has been archived and its content has been deleted")
+			# the whole workflow is archived at once, it may have been done already
+			if job_id in archived_ids: continue
+			# db.set_status(job_id, "ARCHIVED_" + status)
+			for id in db.archive_workflow(job_id):
+				archived_ids.add(id)
+				utils.delete_job_folder(id, False, True)
+				logger.warning(f"Job {id} has been archived and its content has been deleted")
 		# list the folders in the job directory that are not linked to any job
 		for job_dir in utils.get_zombie_jobs():
 			logger.warning(f"Job folder {job_dir} is not linked to any real job and will be deleted")
@@ -300,24 +472,56 @@ def clean():
 		for file in utils.get_unused_shared_files_older_than(max_age_in_seconds):
 			utils.delete_raw_file(file)
 			logger.warning(f"File {os.path.basename(file)} has been deleted due to old age")
+		# the clients that have not asked for the changes for a long time will reload the whole job list
+		nb_events = db.delete_events_older_than()
+		if nb_events > 0: logger.info(f"{nb_events} old events have been removed from the job journal")
+		# give the freed space back, update the statistics of the query planner and truncate the write-ahead log
+		db.maintain_database()
 		# wait 24 hours between each cleaning
 		time.sleep(86400)
 
+def convert_file(job_id, job_dir, file):
+	"""
+	Converts a raw file to mzML and links the result into the input folder of the job, this function is run by the conversion pool.
+	The other jobs sharing the same file get their link when they start (see apps.link_shared_files).
+
+	Args:
+		job_id (int): The job that has requested the conversion first.
+		job_dir (str): The directory of this job.
+		file (str): The path of the shared file to convert.
+
+	Returns:
+		int: The exit status of the converter, or None if the file cannot be converted.
+	"""
+	mzml_file = utils.get_mzml_file_path(file)
+	# the jobs waiting for this file must not start while it's being moved in place
+	readiness.set_busy(mzml_file)
+	try:
+		status = utils.convert_to_mzml(job_id, file)
+		if os.path.exists(mzml_file): apps.link_shared_file(job_dir, mzml_file)
+	finally:
+		readiness.set_ready(mzml_file)
+	return status
+
 def convert_raw_to_mzml():
 	# """
 	# Daemon to convert raw data to mzML format for pending jobs.
-	# This function checks for pending jobs and converts their associated raw data files to mzML format if they haven't been converted yet.
-	# It ensures that only one conversion process runs at a time using a global flag.
+	# This function checks for pending jobs and sends their raw data files that haven't been converted yet to the conversion pool.
+	# A file shared by several jobs is converted once, and the files of the oldest jobs are converted first.
 	# """
 	while True:
-		# get the list of jobs that may need mzML conversion
-		for job_id in db.get_jobs_per_status("PENDING") + db.get_jobs_per_status("PREPARING"):
-			# get job information
-			job_dir = db.get_job_dir(job_id)
-			app_name = db.get_app_name(job_id)
-			settings = db.get_settings(job_id)
+		# get the list of jobs that may need mzML conversion, from the last check of the main daemon if it's recent enough
+		snapshot = SNAPSHOT
+		if snapshot is None or time.monotonic() - snapshot.date > 10: snapshot = db.get_snapshot()
+		for job in snapshot.get_jobs(["PENDING", "PREPARING"]):
 			# get the list of raw files that need to be converted to mzML
-			for file in apps.get_files(job_dir, app_name, settings, False, True):
+			for file in apps.get_files(job.job_dir, job.app_name, job.settings, False, True):
+				# the conversions are identified by their source file, whatever the job that needs them
+				key = ("convert_to_mzml", file)
+				# if the file is already being converted, an older job may only move it forward in the queue
+				if tasks.CONVERSION.is_active(key):
+					tasks.CONVERSION.submit("convert_to_mzml", job.id, convert_file, job.id, job.job_dir, file, key = key, priority = job.creation_date)
+					continue
 				# define output file and temp file
 				mzml_file = utils.get_mzml_file_path(file)
 				temp_file = utils.get_mzml_file_path(file, True)
@@ -325,7 +529,6 @@ def convert_raw_to_mzml():
 				if os.path.exists(temp_file): os.remove(temp_file)
 				# convert the file if it has been transferred, but not yet been converted
 				if os.path.exists(file) and not os.path.exists(mzml_file): 
-					utils.convert_to_mzml(job_id, file)
-					apps.link_shared_file(job_dir, mzml_file)
+					tasks.CONVERSION.submit("convert_to_mzml", job.id, convert_file, job.id, job.job_dir, file, key = key, priority = job.creation_date)
 		# sleep a little but not too much
 		time.sleep(10)
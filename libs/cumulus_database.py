@@ -30,9 +30,14 @@
 # The fact that you are presently reading this means that you have had
 # knowledge of the CeCILL license and that you accept its terms.
 
+import base64
+from concurrent.futures import Future
 import json
 import logging
+import os
+import queue
 import sqlite3
+import threading
 import time
 from datetime import datetime
 
@@ -41,43 +46,316 @@ import libs.cumulus_apps as apps
 
 logger = logging.getLogger(__name__)
 
+# one long-lived connection per thread (daemon threads, Waitress workers, start_job threads)
+POOL = threading.local()
+# every pooled connection, indexed by the thread that owns it, so they can all be closed at shutdown
+POOL_CONNECTIONS = {}
+POOL_LOCK = threading.Lock()
+
+# every mutation is executed by a single writer thread, which commits them in batches (see write)
+WRITE_QUEUE = queue.Queue()
+WRITE_BATCH_SIZE = 200
+WRITER = None
+WRITER_LOCK = threading.Lock()
+
+# the resolved workflows, as lists of job ids indexed by the id of their first job (see get_associated_jobs)
+WORKFLOWS = {}
+# the id of the first job of the workflow, for each job in WORKFLOWS
+WORKFLOW_ROOTS = {}
+# incremented every time the cache is invalidated, so that a workflow resolved before the invalidation is not cached
+WORKFLOW_GENERATION = 0
+WORKFLOW_LOCK = threading.Lock()
+
+# the events older than this are removed from the journal by the cleaning daemon (in seconds)
+EVENTS_MAX_AGE = 7 * 86400
+
+# the thread applying the backfills required by the migrations, and the number of jobs it processes in each transaction
+BACKFILLER = None
+BACKFILL_CHUNK_SIZE = 500
+
+# True if the full-text index over the jobs is available
+FTS_ENABLED = False
+
+# the report of the last maintenance of the database (see maintain_database)
+LAST_MAINTENANCE = None
+
+# the highest possible job ID in SQLite, used as the start of the job list
+MAX_JOB_ID = 9223372036854775807
+
+# all the columns of the jobs table, in the same order as in the archive table
+ARCHIVE_COLUMNS = "id, owner, app_name, strategy, description, settings, status, host, creation_date, start_date, end_date, stdout, stderr, job_dir, start_after_id, workflow_name, last_modified"
+
+# the secondary indexes of the jobs table, they are created at startup if they do not exist
+INDEXES = {
+	"jobs_status": "status",
+	"jobs_start_after_id": "start_after_id",
+	"jobs_creation_date": "creation_date"
+}
+
+# the queries that are run every few seconds by the daemons, none of them should scan the whole jobs table (see get_query_plan)
+SQL_JOBS_PER_STATUS = "SELECT id from jobs WHERE status = ? ORDER BY id ASC"
+# go up the start_after_id links to find the first job of the workflow, then go down to list all its jobs
+SQL_WORKFLOW = """
+	WITH RECURSIVE
+		parents(id, start_after_id, depth) AS (
+			SELECT id, start_after_id, 0 FROM jobs WHERE id = ?
+			UNION ALL
+			SELECT jobs.id, jobs.start_after_id, parents.depth + 1 FROM jobs JOIN parents ON jobs.id = parents.start_after_id WHERE parents.depth < 1000
+		),
+		workflow(id, depth) AS (
+			SELECT * FROM (SELECT id, 0 FROM parents ORDER BY depth DESC LIMIT 1)
+			UNION ALL
+			SELECT jobs.id, workflow.depth + 1 FROM jobs JOIN workflow ON jobs.start_after_id = workflow.id WHERE workflow.depth < 1000
+		)
+	SELECT id FROM workflow ORDER BY depth ASC, id ASC
+"""
+SQL_ENDED_JOBS_OLDER_THAN = "SELECT id, status, job_dir FROM jobs WHERE creation_date < unixepoch() - ? AND status NOT LIKE 'ARCHIVE_%' AND status NOT IN ('PENDING', 'PREPARING', 'RUNNING')"
+SQL_FILE_IN_USE = "SELECT 1 FROM job_inputs JOIN jobs ON jobs.id = job_inputs.job_id WHERE job_inputs.basename = ? AND job_inputs.is_source = 0 AND jobs.status IN ('RUNNING', 'PREPARING', 'PENDING') LIMIT 1"
+SQL_EVENTS_SINCE = "SELECT DISTINCT job_id FROM job_events WHERE seq > ?"
+SQL_ARCHIVED_WORKFLOW = SQL_WORKFLOW.replace("jobs", "jobs_archive")
+SQL_LIST_JOBS = "SELECT id, owner, app_name, status, strategy, description, host, creation_date, start_date, end_date, job_dir, start_after_id, workflow_name FROM {table} WHERE id < ? AND owner LIKE ? AND app_name LIKE ? AND description LIKE ? {filters} ORDER BY id DESC LIMIT ?"
+SQL_RUNNING_STRATEGIES = "SELECT strategy from jobs WHERE status IN ('RUNNING', 'PREPARING') ORDER BY id ASC"
+SQL_SNAPSHOT = "SELECT jobs.id, owner, app_name, strategy, description, settings, status, host, creation_date, start_date, end_date, job_dir, start_after_id, workflow_name, last_modified, flavor_ledger.weight FROM jobs LEFT JOIN flavor_ledger ON flavor_ledger.job_id = jobs.id WHERE jobs.status IN ('PENDING', 'PREPARING', 'RUNNING', 'PAUSED') ORDER BY jobs.id ASC"
+# the idle warm workers reserve their weight too, until a job takes them over
+SQL_RESERVED_WEIGHT = "SELECT (SELECT COALESCE(SUM(weight), 0) FROM flavor_ledger WHERE job_id != ?) + (SELECT COALESCE(SUM(weight), 0) FROM warm_workers WHERE job_id IS NULL)"
+# the workers handed over by a job are kept for its owner, and preferably for the next job of its workflow, then for the same app
+SQL_IDLE_WARM_WORKER = """
+	SELECT name, weight FROM warm_workers JOIN jobs ON jobs.id = ?
+	WHERE flavor = ? AND warm_workers.status = 'READY' AND job_id IS NULL AND (warm_workers.owner IS NULL OR warm_workers.owner = jobs.owner)
+	ORDER BY warm_workers.owner IS NULL, previous_job_id IS NOT jobs.start_after_id, warm_workers.app_name IS NOT jobs.app_name, ready_at ASC LIMIT 1
+"""
+SQL_WARM_WORKERS = "SELECT name, flavor, weight, status, address, volume, created_at, ready_at, job_id, owner, app_name, previous_job_id FROM warm_workers ORDER BY created_at ASC"
+SQL_JOBS_ENDED_BETWEEN = "SELECT owner, strategy, start_date, end_date FROM jobs WHERE end_date >= ? AND end_date < ? AND start_date IS NOT NULL"
+SQL_RUNTIME_ESTIMATES = "SELECT app_name, AVG(end_date - start_date) FROM jobs WHERE status = 'DONE' AND start_date IS NOT NULL AND end_date >= start_date GROUP BY app_name"
+
+def open_connection():
+	"""
+	Opens a new connection to the SQLite database specified in the configuration.
+	The database file is created if it does not exist yet.
+
+	Returns:
+		sqlite3.Connection: A new connection to the database, in autocommit mode.
+	"""
+	cnx = sqlite3.connect(config.get("database.file.path"), isolation_level = None, timeout = 30, check_same_thread = False)
+	# in WAL mode, NORMAL is safe and avoids a fsync on every commit
+	cnx.execute("PRAGMA synchronous = NORMAL")
+	return cnx
+
+def is_connection_healthy(cnx, db_path):
+	"""
+	Checks that a pooled connection can still be used by its thread.
+
+	Args:
+		cnx (sqlite3.Connection): The pooled connection to check.
+		db_path (str): The path of the database file the connection was opened on.
+
+	Returns:
+		bool: False if the connection has been closed or if the configured database has changed, True otherwise.
+
+	Notes:
+		This is called for every query, so the file itself is not checked. Whoever deletes or replaces the database file
+		must call close_connections() first, the threads will then open new connections.
+	"""
+	if db_path != config.get("database.file.path"): return False
+	try:
+		# a previous caller may have failed in the middle of a transaction, do not let it leak to the next one
+		# (the transaction of the writer thread is managed by commit_batch, the tasks may call other functions of this module)
+		if cnx.in_transaction and threading.current_thread() is not WRITER: cnx.rollback()
+		return True
+	except sqlite3.ProgrammingError:
+		# the connection has been closed
+		return False
+
+def prune_connections():
+	"""
+	Closes the pooled connections whose thread has ended (start_job threads are short-lived).
+	"""
+	with POOL_LOCK:
+		for thread in [thread for thread in POOL_CONNECTIONS if not thread.is_alive()]:
+			POOL_CONNECTIONS.pop(thread).close()
+
+def discard_connection():
+	"""
+	Closes the connection of the current thread and removes it from the pool, the next call to connect() opens a new one.
+	"""
+	cnx = getattr(POOL, "cnx", None)
+	POOL.cnx = None
+	if cnx is None: return
+	with POOL_LOCK:
+		if POOL_CONNECTIONS.get(threading.current_thread()) is cnx: POOL_CONNECTIONS.pop(threading.current_thread())
+	try:
+		cnx.close()
+	except sqlite3.Error as e:
+		logger.warning(f"Cannot close a database connection: {e}")
+
 def connect():
 	"""
-	Establishes a connection to the SQLite database specified in the configuration.
-	This function does not check if the database file exists; it simply attempts to connect
- 	to the database file specified in the configuration. The database must have been 
-	initialized at the start of the execution.
+	Returns the connection to the SQLite database that belongs to the current thread, and a new cursor.
+	The connection is opened on the first call in each thread, and then kept open and reused for every 
+	following call from the same thread. It is checked before being returned, and replaced if it's not usable anymore.
+	The database must have been initialized at the start of the execution.
 
 	Returns:
 		tuple: A tuple containing the SQLite connection object and the cursor object.
+
+	Notes:
+		The connection must not be closed by the caller, it will be closed by close_connections() at shutdown.
 	"""
-	# connect to the database, create it if it does not exist yet
-	cnx = sqlite3.connect(config.get("database.file.path"), isolation_level = None, timeout = 30, check_same_thread = False)
-	cursor = cnx.cursor()
-	return cnx, cursor
+	cnx = getattr(POOL, "cnx", None)
+	if cnx is None or not is_connection_healthy(cnx, POOL.db_path):
+		if cnx is not None: discard_connection()
+		# close the connections left by the threads that have ended before opening a new one
+		prune_connections()
+		cnx = open_connection()
+		POOL.cnx = cnx
+		POOL.db_path = config.get("database.file.path")
+		with POOL_LOCK: POOL_CONNECTIONS[threading.current_thread()] = cnx
+	return cnx, cnx.cursor()
+
+def close_connections():
+	"""
+	Closes every pooled connection, this function is called when the main process is stopped.
+	The other threads open a new connection if they are still running (see is_connection_healthy).
+	"""
+	discard_connection()
+	with POOL_LOCK:
+		for cnx in POOL_CONNECTIONS.values():
+			try:
+				cnx.close()
+			except sqlite3.Error as e:
+				logger.warning(f"Cannot close a database connection: {e}")
+		POOL_CONNECTIONS.clear()
+	logger.info("Database connections have been closed.")
 
-def add_column(cnx, cursor, column_name, column_type):
+def start_writer():
+	"""
+	Starts the writer thread if it is not running yet. It is called automatically by the first write.
+	"""
+	global WRITER
+	with WRITER_LOCK:
+		if WRITER is None or not WRITER.is_alive():
+			WRITER = threading.Thread(target=run_writer, name="cumulus-db-writer", daemon=True)
+			WRITER.start()
+
+def run_writer():
+	"""
+	Main loop of the writer thread.
+	It waits for a mutation, then takes every other mutation already in the queue and commits them all in one transaction.
+	"""
+	while True:
+		batch = [WRITE_QUEUE.get()]
+		while len(batch) < WRITE_BATCH_SIZE:
+			try:
+				batch.append(WRITE_QUEUE.get_nowait())
+			except queue.Empty:
+				break
+		# commit_batch answers every future, but the writer must survive anything
+		try:
+			# the tasks that cannot be run in a transaction (ie. VACUUM) are run alone, between the transactions of the other tasks
+			transaction = []
+			for task, future, in_transaction in batch:
+				if in_transaction:
+					transaction.append((task, future))
+					continue
+				if len(transaction) > 0: commit_batch(transaction)
+				transaction = []
+				run_outside_transaction(task, future)
+			if len(transaction) > 0: commit_batch(transaction)
+		except Exception as e:
+			logger.error(f"Database writer has failed: {e}")
+			for _, future, _ in batch:
+				if not future.done(): future.set_exception(e)
+
+def commit_batch(batch):
+	"""
+	Executes a batch of mutations in a single transaction and sets the result of each of them.
+	If one mutation fails, the transaction is rolled back and the mutations are replayed one by one,
+	so that only the faulty one gets an error.
+
+	Args:
+		batch (list): A list of tuples (task, future), where task is a function taking a cursor.
+	"""
+	cnx = None
+	try:
+		cnx, cursor = connect()
+		cursor.execute("BEGIN IMMEDIATE")
+		results = [task(cursor) for task, _ in batch]
+		cursor.execute("COMMIT")
+		for (_, future), result in zip(batch, results): future.set_result(result)
+	except Exception as e:
+		try:
+			if cnx is not None and cnx.in_transaction: cnx.rollback()
+		except Exception as rollback_error:
+			# the connection cannot be trusted anymore, it will be replaced at the next call to connect()
+			logger.error(f"Database rollback has failed: {rollback_error}")
+			discard_connection()
+		# every caller must get an answer, otherwise they would wait forever
+		if len(batch) == 1 or cnx is None:
+			logger.error(f"Database write has failed: {e}")
+			for _, future in batch:
+				if not future.done(): future.set_exception(e)
+		else:
+			for item in batch: commit_batch([item])
+
+def run_outside_transaction(task, future):
+	"""
+	Executes a mutation in autocommit mode, for the statements that SQLite refuses to run in a transaction.
+
+	Args:
+		task (function): A function taking a cursor as its only argument.
+		future (Future): The future receiving the result of the task, or its error.
+	"""
+	try:
+		cnx, cursor = connect()
+		future.set_result(task(cursor))
+	except Exception as e:
+		logger.error(f"Database write has failed: {e}")
+		future.set_exception(e)
+
+def write(task, wait = True, in_transaction = True):
+	"""
+	Sends a mutation to the writer thread. The writer is the only thread writing in the database,
+	so the API and the daemons never wait for each other's locks, and the reads are not blocked (WAL mode).
+
+	Args:
+		task (function): A function taking a cursor as its only argument, its return value is the result of the write.
+		wait (bool, optional): If True, waits until the mutation has been committed and returns its result. 
+			If False, returns immediately (write-behind). Defaults to True.
+		in_transaction (bool, optional): If False, the task is run alone in autocommit mode (ie. for VACUUM). Defaults to True.
+
+	Returns:
+		Any: The value returned by the task if wait is True, None otherwise.
+
+	Raises:
+		Exception: Any exception raised by the task, if wait is True.
+	"""
+	# the writer thread cannot wait for itself
+	if threading.current_thread() is WRITER:
+		return task(connect()[1])
+	start_writer()
+	future = Future()
+	WRITE_QUEUE.put((task, future, in_transaction))
+	if wait: return future.result()
+
+def flush():
+	"""
+	Waits until every mutation sent before this call has been committed.
+	"""
+	write(lambda cursor: None)
+
+def add_column(cursor, column_name, column_type):
 	# the database may already exist, but we want to ensure that the following columns are present
 	cursor.execute(f"SELECT COUNT(*) FROM pragma_table_info('jobs') WHERE name = '{column_name}'")
 	response = cursor.fetchone()
 	if response[0] == 0:
 		# add the start_after_id column if it does not exist
 		cursor.execute(f"ALTER TABLE jobs ADD COLUMN {column_name} {column_type}")
-		cnx.commit()
 		logger.info(f"Column '{column_name}' has been added to the database.")
 
-def initialize_database():
+def migrate_jobs_table(cursor):
 	"""
-	Initializes the database by connecting to it and ensuring the 'jobs' table exists.
-	This function is typically called at the start of the application to set up the
-	database environment. If the database file does not exist, it will be created. 
-	Also ensures that the 'jobs' table exists in the database, creating it if necessary.
-
-	Returns:
-	None
+	Migration 1: creates the main table, and the table of the backfills that the next migrations may need.
 	"""
-	# connect to the database, create it if it does not exist yet
-	cnx, cursor = connect()
 	# create the main table if it does not exist
 	cursor.execute("""
 		CREATE TABLE IF NOT EXISTS jobs(
@@ -99,15 +377,310 @@ def initialize_database():
 			workflow_name TEXT,
 			last_modified INTEGER)
 	""")
-	cnx.commit()
-	# the database may already exist, but we want to ensure that the following columns are present
-	add_column(cnx, cursor, "start_after_id", "INTEGER")
-	add_column(cnx, cursor, "workflow_name", "TEXT")
-	add_column(cnx, cursor, "last_modified", "INTEGER")
-	# close the connection
-	cnx.close()
+	# the databases created before the migrations existed may not have the following columns
+	add_column(cursor, "start_after_id", "INTEGER")
+	add_column(cursor, "workflow_name", "TEXT")
+	add_column(cursor, "last_modified", "INTEGER")
+	# the backfills still to do, each one goes through the jobs by chunks of ids, up to the last job that existed when it was added
+	cursor.execute("CREATE TABLE IF NOT EXISTS backfills(name TEXT PRIMARY KEY, last_id INTEGER NOT NULL, max_id INTEGER NOT NULL)")
+
+def migrate_jobs_indexes(cursor):
+	"""
+	Migration 2: creates the indexes used by the daemons and the searches.
+	"""
+	for index_name, column_name in INDEXES.items():
+		cursor.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON jobs({column_name})")
+
+def migrate_job_inputs(cursor):
+	"""
+	Migration 3: creates the table of the input files of each job, to know which shared files are still needed without parsing the settings again.
+	The input files of the existing jobs are recorded in the background.
+	"""
+	cursor.execute("CREATE TABLE IF NOT EXISTS job_inputs(job_id INTEGER NOT NULL, basename TEXT NOT NULL, path TEXT NOT NULL, PRIMARY KEY (job_id, path))")
+	cursor.execute("CREATE INDEX IF NOT EXISTS job_inputs_basename ON job_inputs(basename)")
+	add_backfill(cursor, "job_inputs")
+
+def migrate_fulltext_index(cursor):
+	"""
+	Migration 4: creates the FTS5 index over the description, owner and app name of the jobs, and the triggers keeping it in sync with the jobs table.
+	The trigram tokenizer is used, so that any part of a word can be searched, as it was with LIKE '%...%'.
+
+	Notes:
+		- The index is filled with the existing jobs in the same transaction, it cannot be done by chunks because the triggers expect every job to be indexed.
+		- If SQLite has been compiled without FTS5, the migration does nothing and the full-text searches fall back to LIKE.
+	"""
+	try:
+		# the index does not store the texts, they are read from the jobs table
+		cursor.execute("DROP TABLE IF EXISTS jobs_fts")
+		cursor.execute("CREATE VIRTUAL TABLE jobs_fts USING fts5(description, owner, app_name, content = 'jobs', content_rowid = 'id', tokenize = 'trigram')")
+	except sqlite3.OperationalError as e:
+		logger.warning(f"Full-text search is not available, searches will be slower: {e}")
+		return
+	cursor.execute("CREATE TRIGGER IF NOT EXISTS jobs_fts_insert AFTER INSERT ON jobs BEGIN INSERT INTO jobs_fts(rowid, description, owner, app_name) VALUES (new.id, new.description, new.owner, new.app_name); END")
+	cursor.execute("CREATE TRIGGER IF NOT EXISTS jobs_fts_delete AFTER DELETE ON jobs BEGIN INSERT INTO jobs_fts(jobs_fts, rowid, description, owner, app_name) VALUES ('delete', old.id, old.description, old.owner, old.app_name); END")
+	cursor.execute("CREATE TRIGGER IF NOT EXISTS jobs_fts_update AFTER UPDATE OF description, owner, app_name ON jobs BEGIN INSERT INTO jobs_fts(jobs_fts, rowid, description, owner, app_name) VALUES ('delete', old.id, old.description, old.owner, old.app_name); INSERT INTO jobs_fts(rowid, description, owner, app_name) VALUES (new.id, new.description, new.owner, new.app_name); END")
+	# index the jobs that already exist
+	cursor.execute("INSERT INTO jobs_fts(jobs_fts) VALUES ('rebuild')")
+
+def migrate_job_events(cursor):
+	"""
+	Migration 5: creates the journal of the job transitions, so that the clients only ask for what has changed.
+	"""
+	cursor.execute("CREATE TABLE IF NOT EXISTS job_events(seq INTEGER PRIMARY KEY AUTOINCREMENT, job_id INTEGER NOT NULL, event TEXT NOT NULL, status TEXT, date INTEGER NOT NULL)")
+	cursor.execute("CREATE TRIGGER IF NOT EXISTS job_events_insert AFTER INSERT ON jobs BEGIN INSERT INTO job_events(job_id, event, status, date) VALUES (new.id, 'CREATED', new.status, unixepoch()); END")
+	cursor.execute("CREATE TRIGGER IF NOT EXISTS job_events_update AFTER UPDATE OF status, start_date, end_date ON jobs WHEN old.status IS NOT new.status OR old.start_date IS NOT new.start_date OR old.end_date IS NOT new.end_date BEGIN INSERT INTO job_events(job_id, event, status, date) VALUES (new.id, 'UPDATED', new.status, unixepoch()); END")
+	cursor.execute("CREATE TRIGGER IF NOT EXISTS job_events_delete AFTER DELETE ON jobs BEGIN INSERT INTO job_events(job_id, event, status, date) VALUES (old.id, 'DELETED', old.status, unixepoch()); END")
+
+def migrate_jobs_archive(cursor):
+	"""
+	Migration 6: creates the archive table, so that the daemons and the searches only read the recent jobs.
+	The jobs that have been archived before this table existed are moved there in the background.
+	"""
+	cursor.execute("""
+		CREATE TABLE IF NOT EXISTS jobs_archive(
+			id INTEGER PRIMARY KEY,
+			owner TEXT NOT NULL,
+			app_name TEXT NOT NULL,
+			strategy TEXT NOT NULL,
+			description TEXT NOT NULL,
+			settings TEXT NOT NULL,
+			status TEXT NOT NULL,
+			host TEXT,
+			creation_date INTEGER,
+			start_date INTEGER,
+			end_date INTEGER,
+			stdout TEXT,
+			stderr TEXT,
+			job_dir TEXT,
+			start_after_id INTEGER,
+			workflow_name TEXT,
+			last_modified INTEGER)
+	""")
+	cursor.execute("CREATE INDEX IF NOT EXISTS jobs_archive_start_after_id ON jobs_archive(start_after_id)")
+	add_backfill(cursor, "jobs_archive")
+
+def migrate_drop_owner_index(cursor):
+	"""
+	Migration 7: drops the index on the owner, the owner is always searched with LIKE '%...%' and SQLite cannot use an index for that.
+	"""
+	cursor.execute("DROP INDEX IF EXISTS jobs_owner")
+
+def migrate_job_inputs_sources(cursor):
+	"""
+	Migration 8: the raw files converted to mzML are also recorded with their own name, so that the file filter of the searches finds them.
+	The source names of the existing jobs are recorded in the background.
+	"""
+	cursor.execute("ALTER TABLE job_inputs ADD COLUMN is_source INTEGER NOT NULL DEFAULT 0")
+	add_backfill(cursor, "job_inputs")
+
+def migrate_flavor_ledger(cursor):
+	"""
+	Migration 9: creates the ledger of the flavor weights reserved by the active jobs, so that the daemon does not add up the weights of every running job at each check.
+	A reservation is taken with the PREPARING status (see reserve_flavor), it is kept while the job is running or paused, and released by the triggers when the job stops or is deleted.
+	"""
+	cursor.execute("CREATE TABLE IF NOT EXISTS flavor_ledger(job_id INTEGER PRIMARY KEY, flavor TEXT NOT NULL, weight INTEGER NOT NULL, reserved_at INTEGER NOT NULL)")
+	cursor.execute("CREATE TRIGGER IF NOT EXISTS flavor_ledger_release AFTER UPDATE OF status ON jobs WHEN new.status NOT IN ('PREPARING', 'RUNNING', 'PAUSED') BEGIN DELETE FROM flavor_ledger WHERE job_id = new.id; END")
+	cursor.execute("CREATE TRIGGER IF NOT EXISTS flavor_ledger_delete AFTER DELETE ON jobs BEGIN DELETE FROM flavor_ledger WHERE job_id = old.id; END")
+
+def migrate_end_date_index(cursor):
+	"""
+	Migration 10: indexes the end dates, so that the usage of each owner is updated with the jobs that have just ended (see get_jobs_ended_between).
+	"""
+	cursor.execute("CREATE INDEX IF NOT EXISTS jobs_end_date ON jobs(end_date)")
+
+def migrate_warm_workers(cursor):
+	"""
+	Migration 11: creates the table of the warm workers, the virtual machines created in advance for the next jobs (see cumulus_warmpool).
+	A warm worker is BOOTING until it can be reached with SSH, then READY. It reserves the weight of its flavor until a job takes it over (job_id).
+	"""
+	cursor.execute("CREATE TABLE IF NOT EXISTS warm_workers(name TEXT PRIMARY KEY, flavor TEXT NOT NULL, weight INTEGER NOT NULL, status TEXT NOT NULL, address TEXT, volume TEXT, created_at INTEGER NOT NULL, ready_at INTEGER, job_id INTEGER)")
+
+def migrate_worker_leases(cursor):
+	"""
+	Migration 12: the workers are leased to the jobs, a job that ends can hand its worker over to the next job of its owner (see cumulus_warmpool.hand_over).
+	A worker used by a job is LEASED, and the owner, the app and the ID of the last job are kept when it is handed over. The creation date is the start of the lease.
+	"""
+	cursor.execute("ALTER TABLE warm_workers ADD COLUMN owner TEXT")
+	cursor.execute("ALTER TABLE warm_workers ADD COLUMN app_name TEXT")
+	cursor.execute("ALTER TABLE warm_workers ADD COLUMN previous_job_id INTEGER")
+
+# the ordered list of migrations (version, description, function), a migration must never be modified once it has been released
+MIGRATIONS = [
+	(1, "create the jobs table", migrate_jobs_table),
+	(2, "index the jobs table", migrate_jobs_indexes),
+	(3, "record the input files of the jobs", migrate_job_inputs),
+	(4, "create the full-text index", migrate_fulltext_index),
+	(5, "create the journal of the job events", migrate_job_events),
+	(6, "create the archive table", migrate_jobs_archive),
+	(7, "drop the owner index", migrate_drop_owner_index),
+	(8, "record the source names of the converted input files", migrate_job_inputs_sources),
+	(9, "create the ledger of the reserved flavors", migrate_flavor_ledger),
+	(10, "index the end dates of the jobs", migrate_end_date_index),
+	(11, "create the table of the warm workers", migrate_warm_workers),
+	(12, "lease the workers to the jobs", migrate_worker_leases)
+]
+
+def get_schema_version(cursor):
+	"""
+	Returns the version of the database schema, it's the version of the last migration that has been applied (0 for a new database).
+	The version is stored in the header of the database file, so it is read without any query on the tables.
+	"""
+	return cursor.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(cursor):
+	"""
+	Applies the migrations that have not been applied yet, in order.
+	This has to be called from the writer thread, so that every migration is applied in the same transaction as the new schema version.
+
+	Args:
+		cursor (sqlite3.Cursor): The cursor of the writer thread.
+
+	Returns:
+		list: The versions of the migrations that have been applied.
+	"""
+	version = get_schema_version(cursor)
+	applied = []
+	for migration_version, description, migration in MIGRATIONS:
+		if migration_version <= version: continue
+		migration(cursor)
+		logger.info(f"Database migration {migration_version} has been applied: {description}")
+		applied.append(migration_version)
+	# the version is written in the same transaction, so a failed migration will be applied again at the next start
+	if len(applied) > 0: cursor.execute(f"PRAGMA user_version = {applied[-1]}")
+	return applied
+
+def initialize_database():
+	"""
+	Initializes the database by connecting to it and ensuring the 'jobs' table exists.
+	This function is typically called at the start of the application to set up the
+	database environment. If the database file does not exist, it will be created. 
+	The schema is upgraded by applying the migrations that are more recent than its version,
+	and the backfills that these migrations require are started in the background.
+
+	Returns:
+	None
+	"""
+	global FTS_ENABLED
+	# connect to the database, create it if it does not exist yet
+	cnx, cursor = connect()
+	# readers are never blocked by the writer in WAL mode (this setting is persistent)
+	cursor.execute("PRAGMA journal_mode = WAL").fetchone()
+	# the database may have been replaced, do not keep workflows that may not exist anymore
+	forget_workflows()
+	# upgrade the schema in one transaction, nothing is done if it's already up to date
+	write(migrate)
+	# the jobs may have changed while the server was stopped (or before the ledger existed)
+	write(reconcile_flavor_ledger)
+	# the full-text index is optional, it depends on how SQLite has been compiled
+	FTS_ENABLED = cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'jobs_fts'").fetchone()[0] > 0
+	# the long data updates are done by chunks, so the server can start immediately
+	start_backfills()
 	logger.info("Database initialized successfully.")
 
+def add_backfill(cursor, name):
+	"""
+	Registers a backfill, it will go through every job that exists at this moment, by chunks, in the background.
+	This is called by the migrations, in their transaction.
+
+	Args:
+		cursor (sqlite3.Cursor): The cursor of the writer thread.
+		name (str): The name of the backfill, it must be a key of BACKFILLS.
+	"""
+	cursor.execute("INSERT OR REPLACE INTO backfills VALUES (?, 0, (SELECT COALESCE(MAX(id), 0) FROM jobs))", (name,))
+
+def run_backfill_chunk(cursor, name):
+	"""
+	Applies a backfill on the next chunk of jobs, and saves its progress in the same transaction.
+	This has to be called from the writer thread.
+
+	Args:
+		cursor (sqlite3.Cursor): The cursor of the writer thread.
+		name (str): The name of the backfill.
+
+	Returns:
+		bool: True if there are more jobs to process, False if the backfill is over (it is then removed).
+	"""
+	last_id, max_id = cursor.execute("SELECT last_id, max_id FROM backfills WHERE name = ?", (name,)).fetchone()
+	job_ids = [id for id, in cursor.execute("SELECT id FROM jobs WHERE id > ? AND id <= ? ORDER BY id LIMIT ?", (last_id, max_id, BACKFILL_CHUNK_SIZE))]
+	if len(job_ids) > 0: BACKFILLS[name](cursor, job_ids)
+	if len(job_ids) < BACKFILL_CHUNK_SIZE:
+		cursor.execute("DELETE FROM backfills WHERE name = ?", (name,))
+		return False
+	cursor.execute("UPDATE backfills SET last_id = ? WHERE name = ?", (job_ids[-1], name))
+	return True
+
+def run_backfills():
+	"""
+	Main loop of the backfill thread, it applies every pending backfill by chunks until they are all over.
+	Each chunk is a separate transaction, so the other writes are never blocked for long, 
+	and an interrupted backfill continues where it stopped at the next start.
+	"""
+	cnx, cursor = connect()
+	for name, in cursor.execute("SELECT name FROM backfills ORDER BY name").fetchall():
+		start_time = time.time()
+		while write(lambda cursor: run_backfill_chunk(cursor, name)): pass
+		logger.info(f"Backfill '{name}' is over after {int(time.time() - start_time)} seconds")
+
+def start_backfills():
+	"""
+	Starts the backfill thread if some backfills are pending.
+	"""
+	global BACKFILLER
+	cnx, cursor = connect()
+	if cursor.execute("SELECT COUNT(*) FROM backfills").fetchone()[0] == 0: return
+	BACKFILLER = threading.Thread(target=run_backfills, name="cumulus-db-backfill", daemon=True)
+	BACKFILLER.start()
+
+def get_fulltext_query(text):
+	"""
+	Converts the text typed by the user into a FTS5 query, where every word has to be found.
+
+	Args:
+		text (str): The words to search for, separated by spaces.
+
+	Returns:
+		tuple: A tuple containing:
+			- str: The FTS5 query for the words of three characters or more, or "" if there is none.
+			- list: The shorter words, that the trigram index cannot search.
+	"""
+	words = text.split()
+	# every word is quoted, so that the FTS5 syntax is not interpreted
+	query = " AND ".join('"' + word.replace('"', '""') + '"' for word in words if len(word) >= 3)
+	return query, [word for word in words if len(word) < 3]
+
+def add_job_inputs(cursor, job_id, job_dir, app_name, settings):
+	"""
+	Records the input files of a job in the job_inputs table.
+	This has to be called from the writer thread, with the cursor it gives.
+
+	Args:
+		cursor (sqlite3.Cursor): The cursor of the writer thread.
+		job_id (int): The ID of the job.
+		job_dir (str): The directory of the job.
+		app_name (str): The name of the application, the input files are defined in its XML file.
+		settings (dict): The settings of the job.
+
+	Notes:
+		- The files are stored as they will be read by the job, so raw files to convert are stored with their mzML name.
+		- The raw files to convert are also stored with their own name, flagged as source files, so that the users can search for the files they have sent.
+		- Nothing is recorded if the application is unknown.
+	"""
+	files = set(apps.get_files(job_dir, app_name, settings, True))
+	source_files = set(apps.get_files(job_dir, app_name, settings, False)) - files
+	cursor.executemany("INSERT OR IGNORE INTO job_inputs(job_id, basename, path, is_source) VALUES (?, ?, ?, ?)", [(job_id, os.path.basename(file), file, 0) for file in files] + [(job_id, os.path.basename(file), file, 1) for file in source_files])
+
+def backfill_job_inputs(cursor, job_ids):
+	"""
+	Records the input files of the given jobs in the job_inputs table, for the jobs created before the table existed.
+	This is a backfill, it's called from the writer thread for each chunk of jobs.
+
+	Args:
+		cursor (sqlite3.Cursor): The cursor of the writer thread.
+		job_ids (list): The IDs of the jobs of the chunk.
+	"""
+	for id, app_name, settings, job_dir in cursor.execute(f"SELECT id, app_name, settings, job_dir FROM jobs WHERE id IN ({', '.join('?' * len(job_ids))})", job_ids).fetchall():
+		add_job_inputs(cursor, id, job_dir, app_name, json.loads(settings))
+
 def create_job(form):
 	"""
 	Creates a new job entry in the database with the provided form data.
@@ -135,8 +708,6 @@ def create_job(form):
 		- The job is created with status "PENDING".
 		- The job directory is named using the job ID, owner, app name, and creation timestamp.
 	"""
-	# connect to the database
-	cnx, cursor = connect()
 	# status should be PENDING when created, RUNNING when it's started, DONE if it's finished successfully, FAILED if it's finished in error, CANCELLED if user chose to cancel it, ARCHIVED if the job has been cleaned due to old age
 	# host should be the ip address of the vm where it's going to be executed, it could be null if the first available vm is to be picked
 	owner = form["username"]
@@ -144,18 +715,22 @@ def create_job(form):
 	workflow_name = form["workflow_name"] if "workflow_name" in form else None
 	creation_date = int(time.time())
 	start_after_id = form["start_after_id"] if "start_after_id" in form else None
-	# settings are already passed as a stringified json
-	cursor.execute(f"INSERT INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", (None, owner, app_name, form["strategy"], form["description"], form["settings"], "PENDING", "", creation_date, None, None, "", "", "", start_after_id, workflow_name, 0))
-	# return the id of the job
-	job_id = cursor.lastrowid
-	# define the job directory "job_<num>_<user>_<app>_<timestamp>"
-	job_dir_name = f"Job_{job_id}_{owner}_{app_name}_{str(creation_date)}"
-	job_dir = f"{config.JOB_DIR}/{job_dir_name}"
-	cursor.execute(f"UPDATE jobs SET job_dir = ? WHERE id = ?", (job_dir, job_id))
-	cnx.commit()
-	# disconnect
-	cnx.close()
-	# return the job_id and the name of its directory
+	def insert(cursor):
+		# settings are already passed as a stringified json
+		cursor.execute(f"INSERT INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", (None, owner, app_name, form["strategy"], form["description"], form["settings"], "PENDING", "", creation_date, None, None, "", "", "", start_after_id, workflow_name, 0))
+		# return the id of the job
+		job_id = cursor.lastrowid
+		# define the job directory "job_<num>_<user>_<app>_<timestamp>"
+		job_dir_name = f"Job_{job_id}_{owner}_{app_name}_{str(creation_date)}"
+		job_dir = f"{config.JOB_DIR}/{job_dir_name}"
+		cursor.execute(f"UPDATE jobs SET job_dir = ? WHERE id = ?", (job_dir, job_id))
+		# record the input files in the same transaction
+		add_job_inputs(cursor, job_id, job_dir, app_name, json.loads(form["settings"]))
+		return job_id, job_dir_name
+	# the insertion is done by the writer thread, the job_id and the name of its directory are returned once it's committed
+	job_id, job_dir_name = write(insert)
+	# the workflow of the previous job now has a new job
+	if start_after_id is not None: forget_workflows([int(start_after_id)])
 	return job_id, job_dir_name
 
 def get_value(job_id, field):
@@ -180,12 +755,12 @@ def get_value(job_id, field):
 	value = ""
 	if cursor.arraysize > 0:
 		response = cursor.fetchone()
+		# the job may have been archived
+		if response is None: response = cursor.execute(f"SELECT {field} FROM jobs_archive WHERE id = ?", (job_id,)).fetchone()
 		if response is not None: value = response[0]
-	# disconnect and return the value
-	cnx.close()
 	return value
 
-def set_value(job_id, field, value):
+def set_value(job_id, field, value, wait = True):
 	"""
 	Updates the specified field of a job record in the 'jobs' table with a new value.
 
@@ -193,22 +768,30 @@ def set_value(job_id, field, value):
 		job_id (int): The ID of the job to update.
 		field (str): The name of the field/column to update.
 		value (Any): The new value to set for the specified field.
+		wait (bool, optional): If False, the update is committed later by the writer thread. Defaults to True.
 
 	Raises:
 		Exception: If the database operation fails.
 
 	Note:
-		Calls the function 'connect' from sqlite3 that returns a tuple (connection, cursor).
+		The update is executed by the writer thread (see write).
 		The function uses parameterized queries for the value and job_id, but the field name is interpolated directly into the SQL statement.
 		Ensure that the 'field' parameter is validated to prevent SQL injection.
 	"""
-	# connect to the database
-	cnx, cursor = connect()
-	logger.debug(f"UPDATE jobs SET {field} = {value} WHERE id = {job_id}")
-	cursor.execute(f"UPDATE jobs SET {field} = ? WHERE id = ?", (value, job_id))
-	cnx.commit()
-	# disconnect
-	cnx.close()
+	set_values([job_id], field, value, wait)
+
+def set_values(job_ids, field, value, wait = True):
+	"""
+	Updates the specified field of several job records with the same value, in a single transaction.
+
+	Args:
+		job_ids (list[int]): The IDs of the jobs to update.
+		field (str): The name of the field/column to update.
+		value (Any): The new value to set for the specified field.
+		wait (bool, optional): If False, the update is committed later by the writer thread. Defaults to True.
+	"""
+	logger.debug(f"UPDATE jobs SET {field} = {value} WHERE id IN {job_ids}")
+	write(lambda cursor: cursor.executemany(f"UPDATE jobs SET {field} = ? WHERE id = ?", [(value, job_id) for job_id in job_ids]), wait)
 
 def get_workflow_parent_id(job_id):
 	"""
@@ -221,20 +804,8 @@ def get_workflow_parent_id(job_id):
 	Returns:
 		int: The first job id for which there is no start_after_id.
 	"""
-	# start with the given job_id, it's possible that this id is the parent
-	parent_job_id = job_id
-	# connect to the database
-	cnx, cursor = connect()
-	while True:
-		# search the job that corresponds to the id
-		cursor.execute("SELECT start_after_id FROM jobs WHERE id = ?", (parent_job_id,))
-		if cursor.arraysize == 0: break # the job should exist, but if it does not, we stop here
-		results = cursor.fetchone()
-		if results == None or results[0] == None: break # if the job has no parent, we stop here (real stop condition)
-		if results == "" or results[0] == "": break # if the job has no parent, we stop here (real stop condition)
-		parent_job_id = results[0]
-	cnx.close()
-	return parent_job_id
+	# the workflow is resolved (or read from the cache) at once, the parent is the first job
+	return get_associated_jobs(job_id)[0]
 
 def get_associated_jobs(job_id):
 	"""
@@ -243,29 +814,50 @@ def get_associated_jobs(job_id):
 	representing the sequence of jobs in that workflow, starting from the parent job and
 	following the chain of jobs linked by the `start_after_id` field. If the job is not
 	part of a workflow, the returned list contains only the given job ID.
+	The whole workflow is resolved with a single recursive query, and the result is cached
+	until a job of the workflow is inserted or deleted.
 	Args:
 		job_id (int): The ID of the job for which to retrieve associated jobs.
 	Returns:
 		list[int]: A list of job IDs in the workflow, or a list containing only the given job ID
 		if it is not part of a workflow.
 	"""
-	# if the job has no start_after_id, it is not part of a workflow or it's the first job in a workflow
-	parent_job_id = get_workflow_parent_id(job_id)
-	# prepare the list of ids
-	ids = [parent_job_id]
+	# search the workflow in the cache first
+	with WORKFLOW_LOCK:
+		if job_id in WORKFLOW_ROOTS: return list(WORKFLOWS[WORKFLOW_ROOTS[job_id]])
+		generation = WORKFLOW_GENERATION
 	# connect to the database
 	cnx, cursor = connect()
-	next_id = parent_job_id
-	while True:
-		# search the job that corresponds to the id
-		cursor.execute("SELECT id FROM jobs WHERE start_after_id = ?", (next_id,))
-		if cursor.arraysize == 0: break # if no job is found, we stop here (real stop condition)
-		results = cursor.fetchone()
-		if results == None: break
-		next_id = results[0]
-		ids.append(next_id)
-	cnx.close()
-	return ids
+	ids = [id for id, in cursor.execute(SQL_WORKFLOW, (job_id,))]
+	if len(ids) == 0:
+		# the job may have been archived, archived workflows are not cached
+		ids = [id for id, in cursor.execute(SQL_ARCHIVED_WORKFLOW, (job_id,))]
+		# the job should exist, but if it does not, it's not part of a workflow (and it's not cached, it may be created later)
+		return ids if len(ids) > 0 else [job_id]
+	with WORKFLOW_LOCK:
+		# do not cache the workflow if a job has been inserted or deleted in the meantime
+		if generation == WORKFLOW_GENERATION:
+			WORKFLOWS[ids[0]] = ids
+			for id in ids: WORKFLOW_ROOTS[id] = ids[0]
+	return list(ids)
+
+def forget_workflows(job_ids = None):
+	"""
+	Removes workflows from the cache, so that they are resolved again at the next call of get_associated_jobs.
+	This function is called every time a job is inserted in a workflow, or deleted.
+
+	Args:
+		job_ids (list[int], optional): The IDs of jobs whose workflow must be forgotten. If None, the whole cache is cleared.
+	"""
+	global WORKFLOW_GENERATION
+	with WORKFLOW_LOCK:
+		WORKFLOW_GENERATION += 1
+		if job_ids is None:
+			WORKFLOWS.clear()
+			WORKFLOW_ROOTS.clear()
+		for job_id in job_ids or []:
+			if job_id in WORKFLOW_ROOTS:
+				for id in WORKFLOWS.pop(WORKFLOW_ROOTS[job_id]): WORKFLOW_ROOTS.pop(id, None)
 
 def set_status(job_id, status): set_value(job_id, "status", status)
 def get_status(job_id): return get_value(job_id, "status")
@@ -273,94 +865,387 @@ def set_start_date(job_id): set_value(job_id, "start_date", int(time.time()))
 def set_end_date(job_id):
 	# if the job represents a workflow, set the host to all other jobs
 	# this allows to clean all the jobs in a workflow at once in the cleaning daemon
-	end = int(time.time())
-	for id in get_associated_jobs(job_id): set_value(id, "end_date", end)
+	set_values(get_associated_jobs(job_id), "end_date", int(time.time()))
 def get_settings(job_id): return json.loads(get_value(job_id, "settings"))
 def get_app_name(job_id): return get_value(job_id, "app_name")
 def get_strategy(job_id): return get_value(job_id, "strategy")
 def set_strategy(job_id, strategy):
 	# if the job represents a workflow, set the strategy to all other jobs
 	# for id in get_associated_jobs(job_id): set_value(job_id, "strategy", strategy)
-	for id in get_associated_jobs(job_id): set_value(id, "strategy", strategy)
+	set_values(get_associated_jobs(job_id), "strategy", strategy)
 def is_owner(job_id, owner): return get_value(job_id, "owner") == owner
 def get_job_dir(job_id): return get_value(job_id, "job_dir")
 def set_job_dir(job_id, job_dir): set_value(job_id, "job_dir", job_dir)
 def get_last_modified(job_id): return get_value(job_id, "last_modified")
-def set_last_modified(job_id, timestamp): set_value(job_id, "last_modified", timestamp)
+# the heartbeat is only compared at the next check, it does not need to wait for the commit
+def set_last_modified(job_id, timestamp): set_value(job_id, "last_modified", timestamp, False)
+
+def apply_transitions(transitions):
+	"""
+	Changes the status of several jobs in a single transaction, and records the date of each change.
+
+	Args:
+		transitions (list): Tuples (job_id, status, date_field), where date_field is "start_date", "end_date" or None (no date is recorded).
+			As with set_end_date, the end date is set to every job of the workflow.
+	"""
+	now = int(time.time())
+	updates = []
+	for job_id, status, date_field in transitions:
+		job_ids = get_associated_jobs(job_id) if date_field == "end_date" else [job_id]
+		updates.append((job_id, status, date_field, job_ids))
+	def apply(cursor):
+		for job_id, status, date_field, job_ids in updates:
+			cursor.execute("UPDATE jobs SET status = ? WHERE id = ?", (status, job_id))
+			if date_field is not None: cursor.executemany(f"UPDATE jobs SET {date_field} = ? WHERE id = ?", [(now, id) for id in job_ids])
+	write(apply)
+
+class JobRecord:
+	"""
+	Represents a job as it is stored in the 'jobs' table, loaded with a single query.
+	The settings are parsed once when the record is loaded. The stdout and stderr columns are not loaded,
+	they are only kept for old jobs.
+
+	Attributes:
+		id (int): The ID of the job.
+		owner (str): The owner of the job.
+		app_name (str): The name of the application to run.
+		strategy (str): The flavor requested for the job.
+		description (str): The description of the job.
+		settings (dict): The settings of the job.
+		status (str): The status of the job.
+		host (str): The host of the job (not used anymore).
+		creation_date (int): The creation date, as a Unix timestamp.
+		start_date (int): The start date, as a Unix timestamp (None if the job has not started).
+		end_date (int): The end date, as a Unix timestamp (None if the job has not ended).
+		job_dir (str): The directory of the job.
+		start_after_id (int): The ID of the previous job in the workflow (None if the job is not part of a workflow, or if it's the first one).
+		workflow_name (str): The name of the workflow (None if the job is not part of a workflow).
+		last_modified (int): The last modification time of the alive file of the job.
+	"""
+	__slots__ = ("id", "owner", "app_name", "strategy", "description", "settings", "status", "host", "creation_date", "start_date", "end_date", "job_dir", "start_after_id", "workflow_name", "last_modified")
+	# the columns to select to build a record, in the same order as the slots
+	COLUMNS = ", ".join(__slots__)
+
+	def __init__(self, row):
+		"""
+		Initializes a record from a row of the 'jobs' table, selected with JobRecord.COLUMNS.
+
+		Args:
+			row (tuple): The values of the columns, in the same order as the slots.
+		"""
+		for field, value in zip(self.__slots__, row): setattr(self, field, value)
+		self.settings = json.loads(self.settings)
+
+	def __str__(self):
+		"""
+		Returns the same description of the job as get_job_to_string.
+		"""
+		# differentiate between a job and a workflow job
+		tag = "Job" if len(get_associated_jobs(self.id)) == 1 else "Workflow job"
+		return f"{tag} {self.id}, owner:{self.owner}, app:{self.app_name}, status:{self.status}, strategy:{self.strategy}"
+
+def get_job(job_id):
+	"""
+	Retrieves a whole job from the database, in a single query.
+
+	Args:
+		job_id (int): The ID of the job to retrieve.
+
+	Returns:
+		JobRecord: The job corresponding to the given ID, or None if the job does not exist.
+	"""
+	# connect to the database
+	cnx, cursor = connect()
+	# search the job that corresponds to the id
+	cursor.execute(f"SELECT {JobRecord.COLUMNS} FROM jobs WHERE id = ?", (job_id,))
+	row = cursor.fetchone()
+	# the job may have been archived
+	if row is None: row = cursor.execute(f"SELECT {JobRecord.COLUMNS} FROM jobs_archive WHERE id = ?", (job_id,)).fetchone()
+	return None if row is None else JobRecord(row)
+
+def get_jobs(job_ids):
+	"""
+	Retrieves several jobs from the database, in a single query.
+
+	Args:
+		job_ids (list[int]): The IDs of the jobs to retrieve.
+
+	Returns:
+		list[JobRecord]: The jobs that exist, ordered by ID.
+	"""
+	# connect to the database
+	cnx, cursor = connect()
+	results = cursor.execute(f"SELECT {JobRecord.COLUMNS} FROM jobs WHERE id IN ({", ".join(["?"] * len(job_ids))}) ORDER BY id ASC", job_ids)
+	return [JobRecord(row) for row in results]
+
+def get_job_records(statuses):
+	"""
+	Retrieves all the jobs with one of the given statuses, in a single query.
+	This function is used by the daemons, that need every information about the PENDING jobs, the RUNNING jobs, etc.
+
+	Args:
+		statuses (list[str]): The statuses to filter jobs by.
+
+	Returns:
+		list[JobRecord]: The jobs that have one of the given statuses, oldest ones first.
+	"""
+	# connect to the database
+	cnx, cursor = connect()
+	results = cursor.execute(f"SELECT {JobRecord.COLUMNS} FROM jobs WHERE status IN ({", ".join(["?"] * len(statuses))}) ORDER BY id ASC", statuses)
+	return [JobRecord(row) for row in results]
+
+class JobSnapshot:
+	"""
+	The jobs that are not over yet (PENDING, PREPARING, RUNNING and PAUSED), loaded with a single query at the beginning of each check of the daemon.
+	The phases of the check share it, so they do not query the database for each job. They update the status of the records when they change it,
+	so that the next phases see the change.
+
+	Attributes:
+		jobs (dict): The records of the jobs, by ID. The jobs of the workflows that are read later are added.
+		reserved_weight (int): The cumulated weight of the flavors reserved by the jobs (see reserve_flavor).
+		weights (dict): The weight reserved by each job, by ID (the jobs without reservation are not in it).
+		date (float): The time when the snapshot has been loaded (monotonic clock).
+	"""
+
+	def __init__(self, jobs, reserved_weight, weights = None):
+		"""
+		Args:
+			jobs (list[JobRecord]): The records of the jobs.
+			reserved_weight (int): The cumulated weight of the flavors reserved by the jobs.
+			weights (dict, optional): The weight reserved by each job, by ID. Defaults to None (no detail).
+		"""
+		self.jobs = {job.id: job for job in jobs}
+		self.reserved_weight = reserved_weight
+		self.weights = weights if weights is not None else {}
+		self.date = time.monotonic()
+		# the snapshot is also read by the conversion daemon
+		self.lock = threading.Lock()
+
+	def get_jobs(self, statuses):
+		"""
+		Returns the jobs of the snapshot with one of the given statuses, oldest ones first.
+		"""
+		with self.lock: return [job for job_id, job in sorted(self.jobs.items()) if job.status in statuses]
+
+	def get_workflow(self, job_id):
+		"""
+		Returns the jobs of the workflow of a job, from the first one. The jobs of the workflow that are already over are loaded once, with a single query.
+		"""
+		job_ids = get_associated_jobs(job_id)
+		missing_ids = [id for id in job_ids if id not in self.jobs]
+		missing_jobs = get_jobs(missing_ids) if len(missing_ids) > 0 else []
+		with self.lock:
+			for job in missing_jobs: self.jobs[job.id] = job
+			return [self.jobs[id] for id in job_ids if id in self.jobs]
+
+def get_snapshot():
+	"""
+	Loads every job that is not over yet, with the weight of the flavor it has reserved, in a single query.
+
+	Returns:
+		JobSnapshot: The jobs with status PENDING, PREPARING, RUNNING or PAUSED.
+	"""
+	# connect to the database
+	cnx, cursor = connect()
+	jobs = []
+	weights = {}
+	# the ledger only contains active jobs, so their reservations add up to the total reserved weight
+	for row in cursor.execute(SQL_SNAPSHOT):
+		jobs.append(JobRecord(row[:-1]))
+		if row[-1] is not None: weights[row[0]] = row[-1]
+	return JobSnapshot(jobs, sum(weights.values()), weights)
+
+def check_job_existency(job_id):
+	"""
+	Checks if a job with the specified job_id exists in the 'jobs' table of the database, or in the archive table.
+
+	Args:
+		job_id (int): The ID of the job to check for existence.
+
+	Returns:
+		bool: True if a job with the given job_id exists, False otherwise.
+	"""
+	# connect to the database
+	cnx, cursor = connect()
+	# search the job that corresponds to the id
+	cursor.execute("SELECT (SELECT COUNT(*) from jobs WHERE id = ?) + (SELECT COUNT(*) from jobs_archive WHERE id = ?)", (job_id, job_id))
+	# return true if there is a match
+	response = cursor.fetchone()
+	return response[0] > 0
+
+def get_job_to_string(job_id):
+	"""
+	Retrieve a string representation of a job from the database by its ID.
+
+	Args:
+		job_id (int): The unique identifier of the job to retrieve.
+
+	Returns:
+		str: A formatted string containing the job's ID, owner, application name, status, and host.
+			 Returns an empty string if no job is found with the given ID.
+	"""
+	job = get_job(job_id)
+	return "" if job is None else str(job)
+
+def get_merged_settings(job_id):
+	"""
+	Searches for the settings of all the jobs related to the given job
+	This is useful for workflows, we need to return the settings of the entire workflow, and not just one job
+	
+	Args:
+		job_id (int): The job ID to use as a reference for searching and retrieving related jobs.
+	
+	Returns:
+		list: a dictionary with the job_ids and the corresponding settings
+	
+	Notes:
+		if job_id does not corresponds to a workflow, the dictionary will only contain one entry
+	"""
+	# prepare the map
+	settings_set = {}
+	# get all the ids to search for
+	job_ids = get_associated_jobs(job_id)
+	# connect to the database
+	cnx, cursor = connect()
+	# search for all the settings
+	results = cursor.execute(f"SELECT id, settings from jobs WHERE id IN ({", ".join(["?"] * len(job_ids))}) ORDER BY id ASC", (job_ids))
+	for id, settings in results:
+		settings_set[id] = json.loads(settings)
+	return settings_set
+
+def encode_cursor(before_id):
+	"""
+	Converts a position in the job list into the opaque token returned to the clients.
+
+	Args:
+		before_id (int): The ID of the last job that has been read, the next page will start right after it.
+
+	Returns:
+		str: The cursor token, or None if there is no next page.
+	"""
+	if before_id is None: return None
+	return base64.urlsafe_b64encode(f"before:{before_id}".encode("utf-8")).decode("utf-8")
+
+def check_page_size(page_size):
+	"""
+	Converts the page size given by a client into a number of jobs.
+
+	Args:
+		page_size (str or int): The page size given by the client.
+
+	Returns:
+		int: The page size, at least 1.
+
+	Raises:
+		ValueError: If the page size is not a positive integer.
+	"""
+	try:
+		number = int(page_size)
+	except (TypeError, ValueError):
+		raise ValueError(f"Invalid page size '{page_size}'")
+	if number < 1: raise ValueError(f"Invalid page size '{page_size}', it should be at least 1")
+	return number
+
+def decode_cursor(cursor_token):
+	"""
+	Converts a cursor token returned by encode_cursor back into a job ID.
+
+	Args:
+		cursor_token (str): The token given by the client.
+
+	Returns:
+		int: The ID of the last job that has been read.
+
+	Raises:
+		ValueError: If the token is not a valid cursor.
+	"""
+	try:
+		prefix, before_id = base64.urlsafe_b64decode(cursor_token.encode("utf-8")).decode("utf-8").split(":")
+		if prefix == "before": return int(before_id)
+	except Exception:
+		pass
+	raise ValueError(f"Invalid cursor '{cursor_token}'")
 
-def check_job_existency(job_id):
+# the columns read to display a list of jobs
+JOB_LIST_COLUMNS = "id, owner, app_name, status, strategy, description, host, creation_date, start_date, end_date, job_dir, start_after_id, workflow_name"
+# the live and the archived jobs together, named "jobs" so that the requests do not change
+JOBS_AND_ARCHIVE = f"(SELECT {JOB_LIST_COLUMNS} FROM jobs UNION ALL SELECT {JOB_LIST_COLUMNS} FROM jobs_archive) AS jobs"
+
+def get_jobs_table(statuses):
 	"""
-	Checks if a job with the specified job_id exists in the 'jobs' table of the database.
+	Returns the table to read for a job list, the archived jobs are only read if they are requested.
 
 	Args:
-		job_id (int): The ID of the job to check for existence.
+		statuses (list): List of status conditions to filter jobs, as given to get_filter_clauses.
 
 	Returns:
-		bool: True if a job with the given job_id exists, False otherwise.
+		str: The table, or the union of the two tables, always named "jobs" so that the rest of the request does not change.
 	"""
-	# connect to the database
-	cnx, cursor = connect()
-	# search the job that corresponds to the id
-	cursor.execute("SELECT COUNT(*) from jobs WHERE id = ?", (job_id,))
-	# return true if there is a match
-	response = cursor.fetchone()
-	# disconnect
-	cnx.close()
-	return response[0] > 0
+	is_archived = any("ARCHIVED" in status for status in statuses)
+	if not is_archived: return "jobs"
+	# only the archived jobs are requested
+	if len(statuses) == 1: return "jobs_archive AS jobs"
+	return JOBS_AND_ARCHIVE
 
-def get_job_to_string(job_id):
+def get_filter_clauses(statuses, date_field, date_from, date_to, file):
 	"""
-	Retrieve a string representation of a job from the database by its ID.
+	Prepares the parts of the SQL request that filter the job list by status, date and input file.
 
 	Args:
-		job_id (int): The unique identifier of the job to retrieve.
+		statuses (list): List of status conditions to filter jobs. If empty or contains 6 elements, no status filtering is applied.
+		date_field (str): The name of the date field to filter on (e.g., "creation_date").
+		date_from (int): The start of the date range (as a Unix timestamp), None or "" for no start.
+		date_to (int): The end of the date range (as a Unix timestamp), None or "" for no end.
+		file (str): Only keep the jobs using an input file whose name contains this text, "" for no filter.
 
 	Returns:
-		str: A formatted string containing the job's ID, owner, application name, status, and host.
-			 Returns an empty string if no job is found with the given ID.
+		tuple: A tuple containing:
+			- str: The SQL conditions, each one starting with AND.
+			- list: The parameters to give to these conditions.
 	"""
-	# differentiate between a job and a workflow job
-	job_ids = get_associated_jobs(job_id)
-	tag = "Job" if len(job_ids) == 1 else "Workflow job"
-	# connect to the database
-	cnx, cursor = connect()
-	# search the job that corresponds to the id
-	cursor.execute("SELECT owner, app_name, status, strategy FROM jobs WHERE id = ?", (job_id,))
-	job = ""
-	if cursor.arraysize > 0:
-		owner, app_name, status, strategy = cursor.fetchone()
-		job = f"{tag} {job_id}, owner:{owner}, app:{app_name}, status:{status}, strategy:{strategy}"
-	# disconnect and return the string
-	cnx.close()
-	return job
+	request_status = "" if len(statuses) == 0 or len(statuses) == 6 else "AND (" + " OR ".join(statuses) + ")"
+	# request_date = f"AND {date_field} BETWEEN {date_from} AND {date_to}"
+	request_date = ""
+	if date_from is not None and date_from != "": request_date += f" AND {date_field} >= {date_from}"
+	if date_to is not None and date_to != "": request_date += f" AND {date_field} <= {date_to}"
+	# the file filter uses the input files recorded when the job was created
+	request_file = "" if file == "" else "AND EXISTS (SELECT 1 FROM job_inputs WHERE job_inputs.job_id = jobs.id AND instr(job_inputs.basename, ?) > 0)"
+	return f"{request_status} {request_date} {request_file}", [] if file == "" else [file]
 
-def get_merged_settings(job_id):
+def get_job_list(records, current_job_id):
 	"""
-	Searches for the settings of all the jobs related to the given job
-	This is useful for workflows, we need to return the settings of the entire workflow, and not just one job
-	
+	Converts the rows read with JOB_LIST_COLUMNS into the job list sent to the clients.
+
 	Args:
-		job_id (int): The job ID to use as a reference for searching and retrieving related jobs.
-	
+		records (list): The rows of the jobs to return, in the order they should be returned.
+		current_job_id (int): The ID of the job to detail, the other jobs are summarized.
+
 	Returns:
-		list: a dictionary with the job_ids and the corresponding settings
-	
-	Notes:
-		if job_id does not corresponds to a workflow, the dictionary will only contain one entry
+		list: A list of dictionaries, each representing a job with its details.
 	"""
-	# prepare the map
-	settings_set = {}
-	# get all the ids to search for
-	job_ids = get_associated_jobs(job_id)
-	# connect to the database
-	cnx, cursor = connect()
-	# search for all the settings
-	results = cursor.execute(f"SELECT id, settings from jobs WHERE id IN ({", ".join(["?"] * len(job_ids))}) ORDER BY id ASC", (job_ids))
-	for id, settings in results:
-		settings_set[id] = json.loads(settings)
-	# close the connection
-	cnx.close()
-	return settings_set
+	jobs = []
+	# prepare a variable to hold the position of the job with id job_id
+	job_index = None
+	# for id, owner, app_name, status, strategy, description, settings, host, creation_date, start_date, end_date, stdout, stderr, job_dir, start_after_id, workflow_name in records:
+	for id, owner, app_name, status, strategy, description, host, creation_date, start_date, end_date, job_dir, start_after_id, workflow_name in records:
+		# the current job should be more detailed
+		if id == current_job_id:
+			# store the index of the job, we will add the settings later
+			job_index = len(jobs)
+			# stdout and stderr for old jobs used to be kept in the database
+			# if stdout == "": stdout = apps.get_stdout_content(id)
+			# if stderr == "": stderr = apps.get_stderr_content(id)
+			log = apps.get_log_file_content(id)
+			# store as many information as possible, except for the settings
+			# jobs.append({"id": id, "owner": owner, "app_name": app_name, "status": status, "strategy": strategy, "description": description, "settings": "", "host": host, "creation_date": creation_date, "start_date": start_date, "end_date": end_date, "stdout": stdout, "stderr": stderr, "start_after_id": start_after_id, "workflow_name": workflow_name, "files": apps.get_file_list(job_dir)})
+			# jobs.append({"id": id, "owner": owner, "app_name": app_name, "status": status, "strategy": strategy, "description": description, "settings": "", "host": host, "creation_date": creation_date, "start_date": start_date, "end_date": end_date, "log": log, "start_after_id": start_after_id, "workflow_name": workflow_name, "files": apps.get_file_list(job_dir)})
+			jobs.append({"id": id, "owner": owner, "app_name": app_name, "status": status, "strategy": strategy, "description": description, "settings": "", "host": host, "creation_date": creation_date, "start_date": start_date, "end_date": end_date, "log": log, "start_after_id": start_after_id, "workflow_name": workflow_name, "files": apps.get_output_file_list(job_dir)})
+		# for other jobs, return what is required for the sidebar
+		else:
+			jobs.append({"id": id, "owner": owner, "app_name": app_name, "status": status, "host": host, "creation_date": creation_date, "end_date": end_date, "start_after_id": start_after_id, "workflow_name": workflow_name})
+	# search for the complete settings of the current job, it should be a map of [job_id, settings]
+	if job_index is not None: jobs[job_index]["settings"] = get_merged_settings(current_job_id)
+	return jobs
 
 # def list_jobs(current_job_id, number = 100, owner = "%", app_name = "%", description = "%", statuses = [], date_field = "creation_date", date_from = 0, date_to = int(time.time()), file = ""):
 def list_jobs(current_job_id, number = 100, owner = "%", app_name = "%", description = "%", statuses = [], date_field = "creation_date", date_from = None, date_to = None, file = ""):
@@ -377,67 +1262,61 @@ def list_jobs(current_job_id, number = 100, owner = "%", app_name = "%", descrip
 		date_field (str, optional): The name of the date field to filter on (e.g., "creation_date"). Defaults to "creation_date".
 		date_from (int, optional): The start of the date range (as a Unix timestamp). Defaults to 0.
 		date_to (int, optional): The end of the date range (as a Unix timestamp). Defaults to the current time.
-		file (str, optional): File filter (not used in SQL filtering). Defaults to "".
+		file (str, optional): Only return the jobs using an input file whose name contains this text. Defaults to "".
 
 	Returns:
 		list: A list of dictionaries, each representing a job with its details.
 
+	Notes:
+		- This is the first page of list_jobs_page.
+	"""
+	jobs, _ = list_jobs_page(current_job_id, number, owner, app_name, description, statuses, date_field, date_from, date_to, file)
+	return jobs
+
+def list_jobs_page(current_job_id, number = 100, owner = "%", app_name = "%", description = "%", statuses = [], date_field = "creation_date", date_from = None, date_to = None, file = "", before_id = None):
+	"""
+	Search for one page of jobs in the database based on various filtering criteria, newest jobs first.
+	The pagination uses the job IDs (keyset pagination), so the cost of a page does not depend on its position in the list.
+
+	Args:
+		job_id (int): The job ID to use as a reference for searching and retrieving related jobs.
+		number (int, optional): The maximum number of jobs to retrieve. Defaults to 100.
+		owner (str, optional): The owner of the job(s) to search for. Supports SQL LIKE patterns. Defaults to "%".
+		app_name (str, optional): The application name associated with the job(s). Supports SQL LIKE patterns. Defaults to "%".
+		description (str, optional): The description of the job(s). Supports SQL LIKE patterns. Defaults to "%".
+		statuses (list, optional): List of status conditions to filter jobs. If empty or contains 6 elements, no status filtering is applied. Defaults to [].
+		date_field (str, optional): The name of the date field to filter on (e.g., "creation_date"). Defaults to "creation_date".
+		date_from (int, optional): The start of the date range (as a Unix timestamp). Defaults to 0.
+		date_to (int, optional): The end of the date range (as a Unix timestamp). Defaults to the current time.
+		file (str, optional): Only return the jobs using an input file whose name contains this text. Defaults to "".
+		before_id (int, optional): Only return the jobs with an ID lower than this one (None for the first page). Defaults to None.
+
+	Returns:
+		tuple: A tuple containing:
+			- list: A list of dictionaries, each representing a job with its details.
+			- int: The ID to give as before_id to get the next page, or None if there is no next page.
+
 	Notes:
 		- The function retrieves jobs matching the specified filters, handling workflows and job dependencies.
-		- If filtering by files, additional post-processing is performed since file filtering is not handled in SQL.
+		- The file filter relies on the job_inputs table, filled when the jobs are created.
+		- The archived jobs are in their own table, it is only read if the archived jobs are requested.
 		- The function ensures that the job with the specified current_job_id has full details.
 	"""
+	# an empty page has no next page
+	if number < 1: return [], None
 	# prepare parts of the SQL request
-	request_status = "" if len(statuses) == 0 or len(statuses) == 6 else "AND (" + " OR ".join(statuses) + ")"
-	# request_date = f"AND {date_field} BETWEEN {date_from} AND {date_to}"
-	request_date = ""
-	if date_from is not None and date_from != "": request_date += f" AND {date_field} >= {date_from}"
-	if date_to is not None and date_to != "": request_date += f" AND {date_field} <= {date_to}"
+	request_filters, filter_params = get_filter_clauses(statuses, date_field, date_from, date_to, file)
+	# start after the given id, or from the newest job, and read one more job than requested to know if there is a next page
+	params = [MAX_JOB_ID if before_id is None else before_id, owner, app_name, description] + filter_params + [number + 1]
 	# connect to the database
 	cnx, cursor = connect()
-	# prepare the list of jobs to return
-	jobs = []
-	# prepare a variable to hold the position of the job with id job_id
-	job_index = None
-	# make the search
 	# cursor.execute(f"SELECT id, owner, app_name, status, strategy, description, settings, host, creation_date, start_date, end_date, stdout, stderr, job_dir, start_after_id, workflow_name FROM jobs WHERE owner LIKE ? AND app_name LIKE ? AND description LIKE ? {request_status} {request_date} ORDER BY id DESC LIMIT ?", (owner, app_name, description, number))
-	cursor.execute(f"SELECT id, owner, app_name, status, strategy, description, settings, host, creation_date, start_date, end_date, job_dir, start_after_id, workflow_name FROM jobs WHERE owner LIKE ? AND app_name LIKE ? AND description LIKE ? {request_status} {request_date} ORDER BY id DESC LIMIT ?", (owner, app_name, description, number))
-	# loop until we have the expected amount of jobs in the array
-	nb_jobs = 0
-	while len(jobs) < number:
-		records = cursor.fetchmany(number)
-		if len(records) == 0: break
-		# for id, owner, app_name, status, strategy, description, settings, host, creation_date, start_date, end_date, stdout, stderr, job_dir, start_after_id, workflow_name in records:
-		for id, owner, app_name, status, strategy, description, settings, host, creation_date, start_date, end_date, job_dir, start_after_id, workflow_name in records:
-			# convert the settings from string to json
-			settings = json.loads(settings)
-			# filter by file here, so we can use a specific function for each app
-			if file == "" or apps.is_in_required_files(job_dir, app_name, settings, file):
-				# the current job should be more detailed
-				if id == current_job_id:
-					# store the index of the job, we will add the settings later
-					job_index = len(jobs)
-					# stdout and stderr for old jobs used to be kept in the database
-					# if stdout == "": stdout = apps.get_stdout_content(id)
-					# if stderr == "": stderr = apps.get_stderr_content(id)
-					log = apps.get_log_file_content(id)
-					# store as many information as possible, except for the settings
-					# jobs.append({"id": id, "owner": owner, "app_name": app_name, "status": status, "strategy": strategy, "description": description, "settings": "", "host": host, "creation_date": creation_date, "start_date": start_date, "end_date": end_date, "stdout": stdout, "stderr": stderr, "start_after_id": start_after_id, "workflow_name": workflow_name, "files": apps.get_file_list(job_dir)})
-					# jobs.append({"id": id, "owner": owner, "app_name": app_name, "status": status, "strategy": strategy, "description": description, "settings": "", "host": host, "creation_date": creation_date, "start_date": start_date, "end_date": end_date, "log": log, "start_after_id": start_after_id, "workflow_name": workflow_name, "files": apps.get_file_list(job_dir)})
-					jobs.append({"id": id, "owner": owner, "app_name": app_name, "status": status, "strategy": strategy, "description": description, "settings": "", "host": host, "creation_date": creation_date, "start_date": start_date, "end_date": end_date, "log": log, "start_after_id": start_after_id, "workflow_name": workflow_name, "files": apps.get_output_file_list(job_dir)})
-				# for other jobs, return what is required for the sidebar
-				else:
-					jobs.append({"id": id, "owner": owner, "app_name": app_name, "status": status, "host": host, "creation_date": creation_date, "end_date": end_date, "start_after_id": start_after_id, "workflow_name": workflow_name})
-			# do not continue if we have enough results
-			if len(jobs) == number: break
-			# do not continue if no new jobs have been added (to avoid infinite loops)
-			if len(jobs) == nb_jobs: break
-			nb_jobs = len(jobs)
-	cnx.close()
-	# search for the complete settings of the current job, it should be a map of [job_id, settings]
-	if job_index is not None: jobs[job_index]["settings"] = get_merged_settings(current_job_id)
-	# return the final list of jobs
-	return jobs
+	records = cursor.execute(SQL_LIST_JOBS.format(table = get_jobs_table(statuses), filters = request_filters), params).fetchall()
+	is_last_page = len(records) <= number
+	# prepare the list of jobs to return
+	jobs = get_job_list(records[:number], current_job_id)
+	# return the final list of jobs, and where the next page should start
+	return jobs, None if is_last_page else records[number - 1][0]
 
 def get_last_jobs(job_id, number = 100):
 	"""
@@ -452,6 +1331,115 @@ def get_last_jobs(job_id, number = 100):
 	"""
 	return list_jobs(job_id, number)
 
+def get_jobs_page(job_id, page_size = 100, cursor_token = None):
+	"""
+	Retrieve one page of the most recent jobs, with the cursor to get the next page.
+
+	Args:
+		job_id (int): The identifier of the job to detail, if it is in the page.
+		page_size (int, optional): The maximum number of jobs in the page. Defaults to 100.
+		cursor_token (str, optional): The cursor returned with the previous page, None for the first page. Defaults to None.
+
+	Returns:
+		dict: A dictionary with the jobs of the page ("jobs") and the cursor of the next page ("cursor", None on the last page).
+
+	Raises:
+		ValueError: If the cursor or the page size are not valid.
+	"""
+	page_size = check_page_size(page_size)
+	before_id = None if cursor_token is None or cursor_token == "" else decode_cursor(cursor_token)
+	jobs, next_id = list_jobs_page(job_id, page_size, before_id = before_id)
+	return {"jobs": jobs, "cursor": encode_cursor(next_id)}
+
+def list_jobs_fulltext(current_job_id, text, number = 100, owner = "%", app_name = "%", desc = "%", statuses = [], date_field = "creation_date", date_from = None, date_to = None, file = ""):
+	"""
+	Search for jobs whose description, owner or app name contain all the given words, best matches first.
+
+	Args:
+		current_job_id (int): The ID of the job to detail, if it is in the list.
+		text (str): The words to search for, separated by spaces.
+		number (int, optional): The maximum number of jobs to retrieve. Defaults to 100.
+		owner (str, optional): SQL LIKE pattern for the job owner. Defaults to "%".
+		app_name (str, optional): SQL LIKE pattern for the application name. Defaults to "%".
+		desc (str, optional): SQL LIKE pattern for the job description. Defaults to "%".
+		statuses (list, optional): List of status conditions to filter jobs. If empty or contains 6 elements, no status filtering is applied. Defaults to [].
+		date_field (str, optional): The name of the date field to filter on (e.g., "creation_date"). Defaults to "creation_date".
+		date_from (int, optional): The start of the date range (as a Unix timestamp). Defaults to None.
+		date_to (int, optional): The end of the date range (as a Unix timestamp). Defaults to None.
+		file (str, optional): Only return the jobs using an input file whose name contains this text. Defaults to "".
+
+	Returns:
+		list: A list of dictionaries, each representing a job with its details.
+
+	Notes:
+		- The jobs are sorted by relevance (BM25), then by ID for the jobs with the same relevance.
+		- The words shorter than three characters, or all the words if the index is not available or if archived jobs are requested, are searched with LIKE.
+	"""
+	request_filters, filter_params = get_filter_clauses(statuses, date_field, date_from, date_to, file)
+	query, short_words = get_fulltext_query(text)
+	# the archived jobs are not in the index
+	if not FTS_ENABLED or get_jobs_table(statuses) != "jobs": query, short_words = "", text.split()
+	# the words that the index cannot search must be found in one of the three fields
+	# the owner, app and description fields of the form still apply to the free text search
+	request_words = " AND owner LIKE ? AND app_name LIKE ? AND description LIKE ?"
+	words_params = [owner, app_name, desc]
+	for word in short_words:
+		request_words += " AND (description LIKE ? OR owner LIKE ? OR app_name LIKE ?)"
+		words_params += [f"%{word}%"] * 3
+	cnx, cursor = connect()
+	if query != "":
+		records = cursor.execute(f"SELECT {JOB_LIST_COLUMNS} FROM (SELECT rowid, rank FROM jobs_fts WHERE jobs_fts MATCH ?) AS matches JOIN jobs ON jobs.id = matches.rowid WHERE 1 {request_words} {request_filters} ORDER BY matches.rank, id DESC LIMIT ?", [query] + words_params + filter_params + [number]).fetchall()
+	else:
+		records = cursor.execute(f"SELECT {JOB_LIST_COLUMNS} FROM {get_jobs_table(statuses)} WHERE 1 {request_words} {request_filters} ORDER BY id DESC LIMIT ?", words_params + filter_params + [number]).fetchall()
+	return get_job_list(records, current_job_id)
+
+def get_changes(since, current_job_id = None):
+	"""
+	Retrieve the jobs that have been created, updated or deleted since a given position in the journal of events.
+	The clients can call this function repeatedly with the returned sequence number, it costs almost nothing when nothing has changed.
+
+	Args:
+		since (int): The sequence number returned by the previous call, 0 to get every change still in the journal.
+		current_job_id (int, optional): The ID of the job to detail, if it has changed. Defaults to None.
+
+	Returns:
+		dict: A dictionary containing:
+			- "seq" (int): The sequence number to give to the next call.
+			- "jobs" (list): The jobs that have changed, in the same format as the job list.
+			- "deleted" (list): The IDs of the jobs that have been deleted.
+			- "reset" (bool): True if some events after the given sequence number have been removed from the journal, the client should then reload the whole job list.
+	"""
+	# connect to the database
+	cnx, cursor = connect()
+	# read the journal boundaries, the last sequence number is kept by SQLite even if the events have been removed
+	last_seq = cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'job_events'").fetchone()
+	last_seq = 0 if last_seq is None else last_seq[0]
+	first_seq = cursor.execute("SELECT min(seq) FROM job_events").fetchone()[0]
+	if first_seq is None: first_seq = last_seq + 1
+	# the events that the client has not seen may have been removed, or the client comes from another database
+	if since < first_seq - 1 or since > last_seq: return {"seq": last_seq, "jobs": [], "deleted": [], "reset": True}
+	# nothing has changed
+	if since == last_seq: return {"seq": last_seq, "jobs": [], "deleted": [], "reset": False}
+	# get the jobs that have changed, the deleted jobs are the ones that cannot be found anymore
+	job_ids = [job_id for job_id, in cursor.execute(SQL_EVENTS_SINCE, (since,)).fetchall()]
+	# the jobs may have been archived in the meantime
+	records = cursor.execute(f"SELECT {JOB_LIST_COLUMNS} FROM {JOBS_AND_ARCHIVE} WHERE id IN ({', '.join('?' * len(job_ids))}) ORDER BY id DESC", job_ids).fetchall()
+	jobs = get_job_list(records, current_job_id)
+	found = set(job["id"] for job in jobs)
+	return {"seq": last_seq, "jobs": jobs, "deleted": [job_id for job_id in job_ids if job_id not in found], "reset": False}
+
+def delete_events_older_than(max_age_in_seconds = EVENTS_MAX_AGE):
+	"""
+	Removes the old events from the journal, the clients that have not polled since then will have to reload the job list.
+
+	Args:
+		max_age_in_seconds (int, optional): The maximum age of the events to keep. Defaults to EVENTS_MAX_AGE.
+
+	Returns:
+		int: The number of events that have been removed.
+	"""
+	return write(lambda cursor: cursor.execute("DELETE FROM job_events WHERE date < unixepoch() - ?", (max_age_in_seconds,)).rowcount)
+
 def search_jobs(form):
 	# get the user search parameters
 	current_job_id = int(form["current_job_id"])
@@ -473,6 +1461,21 @@ def search_jobs(form):
 	date_field = form["date"]
 	date_from = 0 if form["from"] == "" else time.mktime(datetime.strptime(form["from"], "%Y-%m-%d").timetuple())
 	date_to = int(time.time()) if form["to"] == "" else time.mktime(datetime.strptime(form["to"], "%Y-%m-%d").timetuple())
+	# the free text is searched in the description, owner and app name, the best matches are returned first
+	if "text" in form and form["text"].strip() != "":
+		return list_jobs_fulltext(current_job_id, form["text"], number, owner, app_name, desc, statuses, date_field, date_from, date_to, file)
+	# the clients that ask for a page get the jobs and the cursor of the next page
+	if "page_size" in form or "cursor" in form or "before_id" in form:
+		if "page_size" in form and form["page_size"] != "": number = check_page_size(form["page_size"])
+		before_id = None
+		if "before_id" in form and form["before_id"] != "":
+			try:
+				before_id = int(form["before_id"])
+			except ValueError:
+				raise ValueError(f"Invalid before_id '{form['before_id']}'")
+		if "cursor" in form and form["cursor"] != "": before_id = decode_cursor(form["cursor"])
+		jobs, next_id = list_jobs_page(current_job_id, number, owner, app_name, desc, statuses, date_field, date_from, date_to, file, before_id)
+		return {"jobs": jobs, "cursor": encode_cursor(next_id)}
 	# call the list_jobs function to retrieve the jobs
 	return list_jobs(current_job_id, number, owner, app_name, desc, statuses, date_field, date_from, date_to, file)
 
@@ -490,11 +1493,10 @@ def get_jobs_per_status(status):
 	# connect to the database
 	cnx, cursor = connect()
 	# search the jobs that fit the conditions
-	results = cursor.execute("SELECT id from jobs WHERE status = ? ORDER BY id ASC", (status,))
+	results = cursor.execute(SQL_JOBS_PER_STATUS, (status,))
 	# store the ids
 	jobs = []
 	for id, in results: jobs.append(id)
-	cnx.close()
 	# return a list of job ids
 	return jobs
 
@@ -515,15 +1517,63 @@ def delete_job(job_id):
 	"""
 	# get all the jobs in case this is a workflow job
 	job_ids = get_associated_jobs(job_id)
-	# connect to the database
-	cnx, cursor = connect()
-	# delete all the jobs
-	for id in job_ids:
-		# delete the job
-		cursor.execute(f"DELETE FROM jobs WHERE id = ?", (id,))
-		cnx.commit()
-	# disconnect
-	cnx.close()
+	# delete all the jobs in one transaction
+	def delete(cursor):
+		cursor.executemany(f"DELETE FROM jobs WHERE id = ?", [(id,) for id in job_ids])
+		cursor.executemany(f"DELETE FROM jobs_archive WHERE id = ?", [(id,) for id in job_ids])
+		cursor.executemany(f"DELETE FROM job_inputs WHERE job_id = ?", [(id,) for id in job_ids])
+	write(delete)
+	forget_workflows(job_ids)
+
+def archive_workflow(job_id):
+	"""
+	Archives a job, and the other jobs of its workflow, by moving them from the jobs table to the archive table.
+	The status of each job becomes ARCHIVED_<status>.
+
+	Args:
+		job_id (int): The ID of the job to archive.
+
+	Returns:
+		list: The IDs of the jobs that have been archived, empty if a job of the workflow is still active.
+
+	Notes:
+		- A workflow is always archived as a whole, so that it can still be resolved from any of its jobs.
+		- The jobs keep their ID, their input files and their events, and they can still be read with get_job and get_value.
+	"""
+	job_ids = get_associated_jobs(job_id)
+	ids = ", ".join("?" * len(job_ids))
+	def archive(cursor):
+		# do not archive a workflow that is not over
+		if cursor.execute(f"SELECT COUNT(*) FROM jobs WHERE id IN ({ids}) AND status IN ('PENDING', 'PREPARING', 'RUNNING')", job_ids).fetchone()[0] > 0: return []
+		cursor.execute(f"UPDATE jobs SET status = 'ARCHIVED_' || status WHERE id IN ({ids}) AND status NOT LIKE 'ARCHIVED%'", job_ids)
+		cursor.execute(f"INSERT INTO jobs_archive ({ARCHIVE_COLUMNS}) SELECT {ARCHIVE_COLUMNS} FROM jobs WHERE id IN ({ids})", job_ids)
+		archived_ids = [id for id, in cursor.execute(f"SELECT id FROM jobs WHERE id IN ({ids}) ORDER BY id", job_ids)]
+		cursor.execute(f"DELETE FROM jobs WHERE id IN ({ids})", job_ids)
+		return archived_ids
+	# the jobs are moved in one transaction
+	archived_ids = write(archive)
+	forget_workflows(job_ids)
+	return archived_ids
+
+def backfill_jobs_archive(cursor, job_ids):
+	"""
+	Moves the jobs that have been archived in the jobs table to the archive table, with their workflow.
+	Before the archive table existed, the archived jobs were kept in the jobs table with an ARCHIVED_* status.
+	This is a backfill, it's called from the writer thread for each chunk of jobs.
+
+	Args:
+		cursor (sqlite3.Cursor): The cursor of the writer thread.
+		job_ids (list): The IDs of the jobs of the chunk.
+	"""
+	for job_id, in cursor.execute(f"SELECT id FROM jobs WHERE id IN ({', '.join('?' * len(job_ids))}) AND status LIKE 'ARCHIVED%'", job_ids).fetchall():
+		# the job may have been moved with a previous job of its workflow
+		if check_job_existency(job_id): archive_workflow(job_id)
+
+# the backfills that the migrations can register, each one is called with a cursor and a chunk of job IDs
+BACKFILLS = {
+	"job_inputs": backfill_job_inputs,
+	"jobs_archive": backfill_jobs_archive
+}
 
 def set_fake_creation_date(job_id, seconds_to_add = -86400):
 	"""
@@ -539,20 +1589,10 @@ def set_fake_creation_date(job_id, seconds_to_add = -86400):
 		Exception: If database connection or update fails.
 
 	Note:
-		This function connects to the database, updates the 'creation_date' field for the specified job,
-		and commits the change.
+		The 'creation_date' field for the specified job is updated by the writer thread.
 	"""
-	# connect to the database
-	cnx, cursor = connect()
-	# get the current creation date for the job
-	creation_date = int(get_value(job_id, "creation_date"))
-	# change the date
-	creation_date = creation_date + seconds_to_add
-	# set the new creation date
-	cursor.execute(f"UPDATE jobs SET creation_date = ? WHERE id = ?", (creation_date, job_id))
-	cnx.commit()
-	# disconnect
-	cnx.close()
+	# change the date directly in the database
+	write(lambda cursor: cursor.execute(f"UPDATE jobs SET creation_date = creation_date + ? WHERE id = ?", (seconds_to_add, job_id)))
 
 def get_ended_jobs_older_than(max_age_seconds):
 	"""
@@ -571,12 +1611,13 @@ def get_ended_jobs_older_than(max_age_seconds):
 	cnx, cursor = connect()
 	# search the jobs that fit the conditions
 	# results = cursor.execute("SELECT id, status, job_dir FROM jobs WHERE unixepoch() - creation_date > ? AND status NOT LIKE 'ARCHIVE_%' AND status != 'PENDING' AND status != 'RUNNING'", (max_age_seconds,))
-	results = cursor.execute("SELECT id, status, job_dir FROM jobs WHERE unixepoch() - creation_date > ? AND status NOT LIKE 'ARCHIVE_%' AND status != 'PENDING' AND status != 'PREPARING' AND status != 'RUNNING'", (max_age_seconds,))
+	# results = cursor.execute("SELECT id, status, job_dir FROM jobs WHERE unixepoch() - creation_date > ? AND status NOT LIKE 'ARCHIVE_%' AND status != 'PENDING' AND status != 'PREPARING' AND status != 'RUNNING'", (max_age_seconds,))
+	# the creation date is kept alone on one side of the comparison, so that its index can be used
+	results = cursor.execute(SQL_ENDED_JOBS_OLDER_THAN, (max_age_seconds,))
 	# store the ids
 	jobs = []
 	# for job_id, job_dir in results: jobs.append({"job_id": job_id, "job_dir": job_dir})
 	for job_id, status, job_dir in results: jobs.append((job_id, status, job_dir))
-	cnx.close()
 	# return a list of job ids and job directories
 	return jobs
 
@@ -597,16 +1638,8 @@ def is_file_in_use(file):
 	cnx, cursor = connect()
 	# search the jobs that are RUNNING or PENDING
 	# results = cursor.execute("SELECT app_name, settings, job_dir from jobs WHERE status = 'RUNNING' or status = 'PENDING'")
-	results = cursor.execute("SELECT app_name, settings, job_dir from jobs WHERE status = 'RUNNING' or status = 'PREPARING' or status = 'PENDING'")
-	# parse the results
-	is_used = False
-	for app_name, settings, job_dir in results:
-		if apps.is_file_required(job_dir, app_name, json.loads(settings), file):
-			is_used = True
-			break
-	# disconnect
-	cnx.close()
-	return is_used
+	# the input files of the jobs are recorded when they are created, only their names are compared
+	return cursor.execute(SQL_FILE_IN_USE, (os.path.basename(file),)).fetchone() is not None
 
 def get_currently_running_strategies():
 	"""
@@ -619,24 +1652,308 @@ def get_currently_running_strategies():
 	cnx, cursor = connect()
 	# search the jobs that fit the conditions
 	# results = cursor.execute("SELECT strategy from jobs WHERE status = 'RUNNING' ORDER BY id ASC")
-	results = cursor.execute("SELECT strategy from jobs WHERE status = 'RUNNING' OR status = 'PREPARING' ORDER BY id ASC")
+	results = cursor.execute(SQL_RUNNING_STRATEGIES)
 	# store the ids
 	strategies = []
 	for strategy, in results: strategies.append(strategy)
-	cnx.close()
 	# return a list of strategies
 	return strategies
 
+def get_jobs_ended_between(start, end):
+	"""
+	Returns the jobs that have ended in the given period and that have really started, to add them to the usage of their owner.
+
+	Args:
+		start (int): The beginning of the period, as a Unix timestamp (included).
+		end (int): The end of the period, as a Unix timestamp (excluded).
+
+	Returns:
+		list[tuple]: The owner, the strategy, the start date and the end date of each job.
+	"""
+	cnx, cursor = connect()
+	return cursor.execute(SQL_JOBS_ENDED_BETWEEN, (start, end)).fetchall()
+
+def get_runtime_estimates():
+	"""
+	Estimates the duration of the jobs of each app, from the jobs that have succeeded and are not archived yet.
+
+	Returns:
+		dict: The average duration of the successful jobs in seconds, by app name (the apps without any successful job are not in it).
+	"""
+	cnx, cursor = connect()
+	return {app_name: int(duration) for app_name, duration in cursor.execute(SQL_RUNTIME_ESTIMATES)}
+
+def reconcile_flavor_ledger(cursor):
+	"""
+	Rebuilds the ledger of the reserved flavors from the jobs, this is called from the writer thread when the database is initialized.
+	The reservations of the jobs that are not active anymore are released, and the active jobs without reservation reserve the weight of their flavor.
+
+	Args:
+		cursor (sqlite3.Cursor): The cursor of the writer thread.
+	"""
+	cursor.execute("DELETE FROM flavor_ledger WHERE job_id NOT IN (SELECT id FROM jobs WHERE status IN ('PREPARING', 'RUNNING', 'PAUSED'))")
+	for job_id, flavor in cursor.execute("SELECT id, strategy FROM jobs WHERE status IN ('PREPARING', 'RUNNING', 'PAUSED') AND id NOT IN (SELECT job_id FROM flavor_ledger)").fetchall():
+		# the jobs with an unknown flavor have been started with the default one (see utils.check_flavor)
+		if flavor not in config.FLAVORS and len(config.FLAVORS) > 0: flavor = min(config.FLAVORS, key=lambda flavor: config.FLAVORS[flavor]['weight'])
+		weight = config.FLAVORS[flavor]['weight'] if flavor in config.FLAVORS else 0
+		cursor.execute("INSERT INTO flavor_ledger VALUES (?, ?, ?, unixepoch())", (job_id, flavor, weight))
+		logger.info(f"The flavor '{flavor}' has been reserved for the active job {job_id}")
+	# the workers leased by a job that has stopped have not been destroyed with the job (ie. the server was stopped before), the warm pool destroys them (see cumulus_warmpool.destroy_stale_workers)
+	# the ones taken over by a job that has stopped before using them are idle again
+	cursor.execute("UPDATE warm_workers SET status = 'ORPHANED', job_id = NULL WHERE status = 'LEASED' AND job_id NOT IN (SELECT id FROM jobs WHERE status IN ('PREPARING', 'RUNNING', 'PAUSED'))")
+	cursor.execute("UPDATE warm_workers SET job_id = NULL WHERE job_id NOT IN (SELECT id FROM jobs WHERE status IN ('PREPARING', 'RUNNING', 'PAUSED'))")
+
+def reserve_flavor(job_id, flavor, weight, max_weight, from_status = "PENDING"):
+	"""
+	Moves a job to the PREPARING status and reserves the weight of its flavor, in the same transaction.
+	The weight is only reserved if the cumulated weight of all the reservations stays within the maximum.
+	If an idle warm worker has the same flavor, the job takes it over, and the weight it had reserved is given to the job (see take_warm_worker).
+	The workers handed over by another job are only taken over by the jobs of the same owner.
+
+	Args:
+		job_id (int): The ID of the job to start.
+		flavor (str): The flavor of the virtual machine that will be created for the job.
+		weight (int): The weight of this flavor.
+		max_weight (int): The maximum cumulated weight of all the reservations.
+		from_status (str, optional): The status that the job must have. Defaults to "PENDING".
+
+	Returns:
+		bool: True if the job is now PREPARING, False if there is not enough capacity left or if the job is not in the expected status anymore.
+
+	Notes:
+		- The reservations are only written by the writer thread, so two jobs cannot take the same capacity.
+		- The ledger only contains the active jobs, so the check does not depend on the size of the jobs table.
+	"""
+	def reserve(cursor):
+		warm_worker = cursor.execute(SQL_IDLE_WARM_WORKER, (job_id, flavor)).fetchone()
+		# a job that already has a reservation (ie. a paused job) does not count twice, nor does the warm worker it takes over
+		reserved = cursor.execute(SQL_RESERVED_WEIGHT, (job_id,)).fetchone()[0] - (warm_worker[1] if warm_worker is not None else 0)
+		if reserved + weight > max_weight: return False
+		if cursor.execute("UPDATE jobs SET status = 'PREPARING' WHERE id = ? AND status = ?", (job_id, from_status)).rowcount == 0: return False
+		cursor.execute("INSERT OR REPLACE INTO flavor_ledger VALUES (?, ?, ?, unixepoch())", (job_id, flavor, weight))
+		if warm_worker is not None: cursor.execute("UPDATE warm_workers SET job_id = ? WHERE name = ?", (job_id, warm_worker[0]))
+		return True
+	return write(reserve)
+
+def get_reserved_weight():
+	"""
+	Returns the cumulated weight of the flavors reserved by the active jobs and the idle warm workers.
+
+	Returns:
+		int: The sum of the weights in the ledger and of the idle warm workers.
+	"""
+	cnx, cursor = connect()
+	return cursor.execute(SQL_RESERVED_WEIGHT, (0,)).fetchone()[0]
+
+def get_reserved_flavor(job_id):
+	"""
+	Returns the flavor reserved by a job.
+
+	Args:
+		job_id (int): The ID of the job.
+
+	Returns:
+		str: The name of the flavor, or None if the job has no reservation.
+	"""
+	cnx, cursor = connect()
+	response = cursor.execute("SELECT flavor FROM flavor_ledger WHERE job_id = ?", (job_id,)).fetchone()
+	return None if response is None else response[0]
+
+def add_warm_worker(name, flavor, weight, max_weight):
+	"""
+	Records a new warm worker that is going to be created, and reserves the weight of its flavor.
+
+	Args:
+		name (str): The name of the virtual machine.
+		flavor (str): Its flavor.
+		weight (int): The weight of this flavor.
+		max_weight (int): The maximum cumulated weight of all the reservations.
+
+	Returns:
+		bool: True if the worker has been recorded, False if there is not enough capacity left.
+	"""
+	def add(cursor):
+		if cursor.execute(SQL_RESERVED_WEIGHT, (0,)).fetchone()[0] + weight > max_weight: return False
+		cursor.execute("INSERT INTO warm_workers(name, flavor, weight, status, created_at) VALUES (?, ?, ?, 'BOOTING', unixepoch())", (name, flavor, weight))
+		return True
+	return write(add)
+
+def set_warm_worker_ready(name, address, volume):
+	"""
+	Marks a warm worker as READY once it can be reached with SSH, the jobs of its flavor can take it over from now on.
+	"""
+	write(lambda cursor: cursor.execute("UPDATE warm_workers SET status = 'READY', address = ?, volume = ?, ready_at = unixepoch() WHERE name = ?", (address, volume, name)))
+
+def delete_warm_worker(name, only_if_idle = False):
+	"""
+	Removes a warm worker from the table, and releases the weight it had reserved.
+
+	Args:
+		name (str): The name of the virtual machine.
+		only_if_idle (bool, optional): Do not remove it if a job has taken it over in the meantime. Defaults to False.
+
+	Returns:
+		bool: True if the worker has been removed.
+	"""
+	return write(lambda cursor: cursor.execute("DELETE FROM warm_workers WHERE name = ?" + (" AND job_id IS NULL" if only_if_idle else ""), (name,)).rowcount > 0)
+
+def take_warm_worker(job_id):
+	"""
+	Leases the warm worker that a job has taken over when it became PREPARING (see reserve_flavor), the job now uses the virtual machine.
+	The worker stays in the table until it is destroyed (see utils.destroy_worker) or handed over to another job (see release_worker).
+
+	Args:
+		job_id (int): The ID of the job.
+
+	Returns:
+		dict: The name, flavor, address and volume of the worker, or None if the job has not taken over any warm worker.
+	"""
+	def take(cursor):
+		row = cursor.execute("SELECT name, flavor, address, volume FROM warm_workers WHERE job_id = ? AND status = 'READY'", (job_id,)).fetchone()
+		if row is None: return None
+		cursor.execute("UPDATE warm_workers SET status = 'LEASED' WHERE name = ?", (row[0],))
+		return {"name": row[0], "flavor": row[1], "address": row[2], "volume": row[3]}
+	return write(take)
+
+def release_worker(job_id, name, flavor, weight, address, volume, owner, app_name, leased_since, max_lifetime):
+	"""
+	Hands the worker of a job that has ended over to the next jobs of its owner: the worker is idle again, and reserves the weight that the job had reserved.
+	The lease starts when the worker is created, a worker that has been leased for longer than the maximum lifetime is not handed over.
+
+	Args:
+		job_id (int): The ID of the job that has ended.
+		name (str): The name of the virtual machine.
+		flavor (str): Its flavor.
+		weight (int): The weight of this flavor.
+		address (str): The IP address of the virtual machine.
+		volume (str): The name of its volume.
+		owner (str): The owner of the job, only the jobs of this owner can take the worker over.
+		app_name (str): The app of the job.
+		leased_since (int): The start of the lease if the worker has not been recorded yet (ie. it has been created for the job), as a Unix timestamp.
+		max_lifetime (int): The maximum duration of the lease, in seconds.
+
+	Returns:
+		bool: True if the worker has been handed over, False if it has to be destroyed.
+	"""
+	def release(cursor):
+		row = cursor.execute("SELECT created_at FROM warm_workers WHERE name = ?", (name,)).fetchone()
+		created_at = leased_since if row is None else row[0]
+		if created_at + max_lifetime <= time.time(): return False
+		# the weight moves from the job to the worker at once
+		cursor.execute("DELETE FROM flavor_ledger WHERE job_id = ?", (job_id,))
+		cursor.execute("INSERT OR REPLACE INTO warm_workers VALUES (?, ?, ?, 'READY', ?, ?, ?, unixepoch(), NULL, ?, ?, ?)", (name, flavor, weight, address, volume, created_at, owner, app_name, job_id))
+		return True
+	return write(release)
+
+def get_warm_workers():
+	"""
+	Returns every warm worker, oldest first.
+
+	Returns:
+		list[dict]: The name, flavor, weight, status, address, volume, creation date, ready date and the job that has taken it over (None if it's idle) of each worker,
+		and the owner, app and ID of the job that has handed it over (None if it has never been used).
+	"""
+	cnx, cursor = connect()
+	columns = ["name", "flavor", "weight", "status", "address", "volume", "created_at", "ready_at", "job_id", "owner", "app_name", "previous_job_id"]
+	return [dict(zip(columns, row)) for row in cursor.execute(SQL_WARM_WORKERS)]
+
 def pause_preparing_jobs():
 	"""
 	This function is called only when the main process is stopped.
 	The jobs that are currently running should be safe, but the jobs who are in PREPARING status will be impacted.
 	To avoid that, we put them in PAUSED status, so we can restart them automatically at the next start of the main process.
+	The paused jobs keep the flavor they have reserved.
+	"""
+	logger.debug(f"UPDATE jobs SET status = 'PAUSED' WHERE status = 'PREPARING'")
+	write(lambda cursor: cursor.execute(f"UPDATE jobs SET status = 'PAUSED' WHERE status = 'PREPARING'"))
+	# make sure that nothing remains in the queue before the process stops
+	flush()
+
+def get_database_size():
+	"""
+	Returns the size of the database on the disk, including its write-ahead log.
+
+	Returns:
+		tuple: The size of the database file and the size of the WAL file, in bytes.
+	"""
+	db_path = config.get("database.file.path")
+	wal_path = db_path + "-wal"
+	return os.path.getsize(db_path) if os.path.isfile(db_path) else 0, os.path.getsize(wal_path) if os.path.isfile(wal_path) else 0
+
+def maintain_database():
+	"""
+	Runs the maintenance of the database, this function is called once a day by the cleaning daemon.
+	- The pages freed by the deleted and archived jobs are returned to the file system (incremental vacuum).
+	- The statistics of the query planner are updated (ANALYZE the first time, then PRAGMA optimize).
+	- The write-ahead log is written back into the database and truncated.
+
+	Returns:
+		dict: The report of the maintenance, with its date, its duration in seconds, the sizes before and after in bytes, 
+			the number of bytes freed, and the result of the checkpoint (busy flag, pages in the log, pages written back).
+
+	Notes:
+		- The first maintenance of a database created without incremental vacuum rebuilds it entirely, it is only done once.
+		- The maintenance is run by the writer thread, the other mutations wait until it is over.
+	"""
+	global LAST_MAINTENANCE
+	start = time.time()
+	db_size, wal_size = get_database_size()
+	def maintain(cursor):
+		report = {}
+		# the database must be rebuilt once to allow the incremental vacuum (the setting is persistent)
+		if cursor.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+			cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+			cursor.execute("VACUUM")
+			logger.info("The database has been rebuilt to allow the incremental vacuum")
+		else:
+			report["freed_pages"] = cursor.execute("PRAGMA freelist_count").fetchone()[0]
+			cursor.execute("PRAGMA incremental_vacuum").fetchall()
+		# without statistics, the query planner can only guess which index is the best
+		if cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone()[0] == 0: cursor.execute("ANALYZE")
+		else: cursor.execute("PRAGMA optimize")
+		# the log is only truncated if no reader is using it, otherwise it will be at the next maintenance
+		report["checkpoint"] = list(cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone())
+		return report
+	# VACUUM and the checkpoint cannot be run in a transaction
+	report = write(maintain, True, False)
+	db_size_after, wal_size_after = get_database_size()
+	report.update({"date": int(start), "duration": round(time.time() - start, 3), "size_before": db_size + wal_size, "size_after": db_size_after + wal_size_after})
+	report["freed_bytes"] = report["size_before"] - report["size_after"]
+	LAST_MAINTENANCE = report
+	logger.info(f"Database maintenance done in {report['duration']} seconds, {report['freed_bytes']} bytes have been freed")
+	return report
+
+def get_database_status():
+	"""
+	Returns the current state of the database, and the report of its last maintenance.
+
+	Returns:
+		dict: The schema version, the size of the database and of its log in bytes, the number of free pages, 
+			and the report of the last maintenance (None if there was no maintenance since the server has started).
+	"""
+	cnx, cursor = connect()
+	db_size, wal_size = get_database_size()
+	return {
+		"schema_version": get_schema_version(cursor),
+		"size": db_size,
+		"wal_size": wal_size,
+		"free_pages": cursor.execute("PRAGMA freelist_count").fetchone()[0],
+		"last_maintenance": LAST_MAINTENANCE
+	}
+
+def get_query_plan(sql, params = ()):
+	"""
+	Returns the plan chosen by SQLite to execute a query, without executing it.
+	This is useful to check that a query uses an index instead of scanning a whole table.
+
+	Args:
+		sql (str): The query to explain.
+		params (tuple, optional): The parameters of the query. Defaults to ().
+
+	Returns:
+		list[str]: The description of each step of the plan (ie. "SEARCH jobs USING INDEX jobs_status (status=?)").
 	"""
 	# connect to the database
 	cnx, cursor = connect()
-	logger.debug(f"UPDATE jobs SET status = 'PAUSED' WHERE status = 'PREPARING'")
-	cursor.execute(f"UPDATE jobs SET status = 'PAUSED' WHERE status = 'PREPARING'")
-	cnx.commit()
-	# disconnect
-	cnx.close()
+	results = cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+	return [detail for _, _, _, detail in results]
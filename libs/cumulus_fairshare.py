@@ -0,0 +1,190 @@
+# Copyright or © or Copr. Alexandre BUREL for LSMBO / IPHC UMR7178 / CNRS (2025)
+# 
+# [a.burel@unistra.fr]
+# 
+# This software is the server for Cumulus, a client-server to operate jobs on a Cloud.
+# 
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use, 
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info". 
+# 
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability. 
+# 
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or 
+# data to be ensured and,  more generally, to use and operate it in the 
+# same conditions as regards security. 
+# 
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+import heapq
+import logging
+import threading
+import time
+
+import libs.cumulus_config as config
+import libs.cumulus_database as db
+import libs.cumulus_utils as utils
+
+logger = logging.getLogger(__name__)
+
+# the usage of an owner is divided by two after this time (in seconds)
+HALF_LIFE = float(config.get("fairshare.half.life.in.hours", "24")) * 3600
+# the jobs are counted once they have ended for this time, so that an end date committed late is not missed (in seconds)
+COUNT_DELAY = 60
+# the usage of the jobs that have ended (weight x duration), by owner, decayed up to USAGE_DATE
+USAGE = {}
+USAGE_DATE = None
+LOCK = threading.Lock()
+
+def is_enabled():
+	"""
+	Returns True if the jobs ready to run are ordered by the usage of their owners instead of their age.
+	"""
+	return config.get("fairshare.enabled", "false").lower() == "true"
+
+def get_decay(seconds):
+	"""
+	Returns the factor to apply to a usage that is the given number of seconds old.
+	"""
+	return 0.5 ** (max(0, seconds) / HALF_LIFE)
+
+def get_weight(strategy):
+	return config.FLAVORS[utils.get_flavor(strategy)]['weight']
+
+def get_cap(owner):
+	"""
+	Returns the maximum weight that the jobs of an owner may reserve at the same time, 0 if there is no limit.
+	The limit is "fairshare.max.weight.<owner>" in the configuration, or "fairshare.max.weight" for every owner.
+	"""
+	return int(config.get(f"fairshare.max.weight.{owner}", config.get("fairshare.max.weight", "0")))
+
+def update_usage(now = None):
+	"""
+	Adds the jobs that have ended since the last update to the usage of their owners, after decaying the previous usage.
+	The first update reads the jobs that have ended in the last ten half-lives, the older ones do not count anymore.
+
+	Args:
+		now (int, optional): The current date, as a Unix timestamp. Defaults to now.
+	"""
+	global USAGE, USAGE_DATE
+	if now is None: now = int(time.time())
+	until = now - COUNT_DELAY
+	with LOCK:
+		if USAGE_DATE is None:
+			USAGE = {}
+			since = until - int(10 * HALF_LIFE)
+		elif until <= USAGE_DATE: return
+		else:
+			decay = get_decay(until - USAGE_DATE)
+			USAGE = {owner: usage * decay for owner, usage in USAGE.items()}
+			since = USAGE_DATE
+		for owner, strategy, start_date, end_date in db.get_jobs_ended_between(since, until):
+			USAGE[owner] = USAGE.get(owner, 0) + get_weight(strategy) * max(0, end_date - start_date) * get_decay(until - end_date)
+		USAGE_DATE = until
+
+def get_usage(snapshot, now = None):
+	"""
+	Returns the current usage of each owner: the decayed usage of the jobs that have ended, and the usage of the active jobs up to now.
+
+	Args:
+		snapshot (db.JobSnapshot): The active jobs, with the weight they have reserved.
+		now (int, optional): The current date, as a Unix timestamp. Defaults to now.
+
+	Returns:
+		dict: The usage (weight x seconds) by owner.
+	"""
+	if now is None: now = int(time.time())
+	with LOCK:
+		decay = get_decay(now - USAGE_DATE) if USAGE_DATE is not None else 1
+		usage = {owner: value * decay for owner, value in USAGE.items()}
+	for job in snapshot.get_jobs(["PREPARING", "RUNNING", "PAUSED"]):
+		if job.id in snapshot.weights and job.start_date is not None:
+			usage[job.owner] = usage.get(job.owner, 0) + snapshot.weights[job.id] * max(0, now - job.start_date)
+	return usage
+
+def order(jobs, snapshot, get_runtime, now = None):
+	"""
+	Orders the jobs ready to run so that the owners with the lowest usage come first. The jobs of an owner are taken oldest first,
+	and each one adds its expected usage to its owner, so that the jobs of several owners are interleaved.
+
+	Args:
+		jobs (list[db.JobRecord]): The jobs ready to run, oldest ones first.
+		snapshot (db.JobSnapshot): The active jobs, with the weight they have reserved.
+		get_runtime (callable): Returns the expected duration of a job of the given app, in seconds.
+		now (int, optional): The current date, as a Unix timestamp. Defaults to now.
+
+	Returns:
+		list[db.JobRecord]: The same jobs, in the order they should be considered.
+	"""
+	usage = get_usage(snapshot, now)
+	queues = {}
+	for job in jobs: queues.setdefault(job.owner, []).append(job)
+	# the owners are taken by usage, then by the age of their oldest job
+	heap = [(usage.get(owner, 0), owner_jobs[0].id, owner) for owner, owner_jobs in queues.items()]
+	heapq.heapify(heap)
+	ordered = []
+	while len(heap) > 0:
+		owner_usage, _, owner = heapq.heappop(heap)
+		job = queues[owner].pop(0)
+		ordered.append(job)
+		if len(queues[owner]) > 0: heapq.heappush(heap, (owner_usage + get_weight(job.strategy) * get_runtime(job.app_name), queues[owner][0].id, owner))
+	return ordered
+
+def apply_caps(decisions, snapshot):
+	"""
+	Keeps waiting the jobs that would make their owner reserve more weight than allowed (see get_cap).
+	The weight that they leave free is used at the next check.
+
+	Args:
+		decisions (list): The decisions of the scheduler, in the order the jobs start (see cumulus_scheduler.Decision).
+		snapshot (db.JobSnapshot): The active jobs, with the weight they have reserved.
+	"""
+	used = {}
+	for job in snapshot.get_jobs(["PREPARING", "RUNNING", "PAUSED"]):
+		used[job.owner] = used.get(job.owner, 0) + snapshot.weights.get(job.id, 0)
+	for decision in decisions:
+		if not decision.start: continue
+		owner = snapshot.jobs[decision.job_id].owner
+		cap = get_cap(owner)
+		if cap > 0 and used.get(owner, 0) + decision.weight > cap:
+			decision.start = False
+			decision.reason = f"Owner {owner} already reserves {used.get(owner, 0)} of the {cap} weight allowed"
+		else: used[owner] = used.get(owner, 0) + decision.weight
+
+def get_shares(snapshot, now = None):
+	"""
+	Returns the current share of each owner, for the API.
+
+	Args:
+		snapshot (db.JobSnapshot): The active jobs, with the weight they have reserved.
+		now (int, optional): The current date, as a Unix timestamp. Defaults to now.
+
+	Returns:
+		list[dict]: For each owner with a usage or an active job, highest usage first: the usage, the fraction of the total usage,
+			the weight reserved now, the maximum weight allowed (0 if there is no limit) and the number of pending jobs.
+	"""
+	update_usage(now)
+	usage = get_usage(snapshot, now)
+	total = sum(usage.values())
+	shares = {}
+	for owner, value in usage.items():
+		shares[owner] = {"owner": owner, "usage": round(value), "share": round(value / total, 4) if total > 0 else 0, "weight": 0, "cap": get_cap(owner), "pending": 0}
+	for job in snapshot.get_jobs(["PENDING", "PREPARING", "RUNNING", "PAUSED"]):
+		share = shares.setdefault(job.owner, {"owner": job.owner, "usage": 0, "share": 0, "weight": 0, "cap": get_cap(job.owner), "pending": 0})
+		share["weight"] += snapshot.weights.get(job.id, 0)
+		if job.status == "PENDING": share["pending"] += 1
+	return sorted(shares.values(), key = lambda share: -share["usage"])
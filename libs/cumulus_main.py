@@ -46,10 +46,16 @@ from waitress import serve
 
 # local modules
 import libs.cumulus_apps as apps
+import libs.cumulus_backends as backends
 import libs.cumulus_config as config
 import libs.cumulus_utils as utils
 import libs.cumulus_database as db
 import libs.cumulus_daemon as daemon
+import libs.cumulus_fairshare as fairshare
+import libs.cumulus_readiness as readiness
+import libs.cumulus_scheduler as scheduler
+import libs.cumulus_tasks as tasks
+import libs.cumulus_warmpool as warmpool
 
 IS_DEBUG = False
 if os.getenv("CUMULUS_DEBUG"): IS_DEBUG = True
@@ -73,7 +79,7 @@ def start():
 		Response: A Flask JSON response with the job ID and job directory.
 	"""
 	# create a pending job, it will be started when the files are all available, return the job id
-	job_id, job_dir = db.create_job(request.form)
+	job_id, job_dir = backends.STORAGE.create_job(request.form)
 	utils.create_job_directory(job_dir, request.form)
 	# return the job id and the job directory
 	logger.info(f"Create job {job_id}")
@@ -91,9 +97,35 @@ def job_list(job_id, number):
 	Returns:
 		flask.Response: A JSON response containing the list of recent jobs.
 						The job corresponding to job_id will be detailed, all other jobs will be summarized.
+						If the "cursor" query parameter is given (empty for the first page), the response is the page
+						of jobs with the cursor to request the next page: {"jobs": [...], "cursor": "..."}.
 
 	"""
-	return jsonify(db.get_last_jobs(job_id, number))
+	# the list is returned as is, unless the client asks for pages
+	if "cursor" not in request.args: return jsonify(db.get_last_jobs(job_id, number))
+	try:
+		return jsonify(db.get_jobs_page(job_id, number, request.args.get("cursor")))
+	except ValueError as e:
+		return jsonify({"error": str(e)}), 400
+
+@app.route("/changes")
+def changes():
+	"""
+	Retrieves the jobs that have changed since the last call, so the clients do not have to reload the whole job list.
+
+	The query parameter "since" is the sequence number returned by the previous call (0 for the first call),
+	and the optional "job_id" is the job to detail if it has changed.
+
+	Returns:
+		flask.Response: A JSON response containing the new sequence number, the jobs that have changed, the IDs of the deleted jobs,
+						and a "reset" flag telling the client that it must reload the whole job list.
+	"""
+	try:
+		since = int(request.args.get("since", 0))
+		job_id = int(request.args["job_id"]) if "job_id" in request.args else None
+	except ValueError:
+		return jsonify({"error": '"since" and "job_id" should be integers'}), 400
+	return jsonify(db.get_changes(since, job_id))
 
 @app.route("/search", methods=["POST"])
 def search_jobs():
@@ -105,9 +137,16 @@ def search_jobs():
 	Returns:
 		flask.Response: A JSON response containing the search results. 
 						The job corresponding to job_id will be detailed, all other jobs will be summarized.
+						If the form contains "page_size", "cursor" or "before_id", the response is the page of jobs 
+						with the cursor to request the next page: {"jobs": [...], "cursor": "..."}.
+						If the form contains "text", the jobs whose description, owner or app name contain all its words
+						are returned, best matches first.
 	"""
 	logger.info("Search jobs")
-	return jsonify(db.search_jobs(request.form))
+	try:
+		return jsonify(db.search_jobs(request.form))
+	except ValueError as e:
+		return jsonify({"error": str(e)}), 400
 
 # @app.route("/jobusage/<int:job_id>")
 # def job_usage(job_id):
@@ -148,13 +187,18 @@ def cancel(owner, job_id):
 	"""
 	logger.debug(f"Request to cancel job {job_id} by {owner}")
 	# TODO there should be some real security here to avoid cancelling stuff too easily
-	if db.is_owner(job_id, owner):
+	job = backends.STORAGE.get_job(job_id)
+	if job is not None and job.owner == owner:
 		logger.info(f"Cancel job ${job_id}")
 		# read the status file, only cancel if the status is RUNNING
-		status = db.get_status(job_id)
+		status = job.status
 		if status == "PENDING" or status == "PREPARING" or status == "RUNNING": 
+			# the virtual machine will not be created if its creation has not started yet
+			for id in backends.STORAGE.get_associated_jobs(job_id):
+				tasks.PROVISIONING.cancel(id)
+				readiness.cancel(id)
 			utils.cancel_job(job_id)
-			threading.Thread(target=utils.destroy_worker, args=(job_id,)).start()
+			tasks.TEARDOWN.submit("destroy_worker", job_id, utils.destroy_worker, job_id)
 			return f"Job {job_id} has been cancelled"
 		else: return f"Job {job_id} cannot be cancelled, it is already stopped"
 	else: return f"You cannot cancel this job"
@@ -177,10 +221,11 @@ def delete(owner, job_id):
 		- Additional security checks should be implemented to prevent unauthorized deletions.
 	"""
 	# TODO there should be some real security here to avoid cancelling stuff too easily
-	if db.is_owner(job_id, owner):
+	job = backends.STORAGE.get_job(job_id)
+	if job is not None and job.owner == owner:
 		logger.info(f"Delete job ${job_id}")
 		# read the status file, only delete if the status is DONE, FAILED or ARCHIVED
-		status = db.get_status(job_id)
+		status = job.status
 		# if status != "PENDING" and status != "RUNNING":
 		if status != "PENDING" and status != "PREPARING" and status != "RUNNING":
 			utils.delete_job_folder(job_id, True, False)
@@ -219,11 +264,12 @@ def get_results(owner, job_id, file_name):
 	Side Effects:
 		Logs errors to stderr using utils.add_to_stderr if file sending fails.
 	"""
-	# reconstruct file path, including output folder
-	# file = f"{db.get_job_dir(job_id)}/{unquote(file_name)}"
-	file = f"{db.get_job_dir(job_id)}/{config.get("output.folder")}/{unquote(file_name)}"
+	job = backends.STORAGE.get_job(job_id)
 	# check that the user can download the results
-	if db.is_owner(job_id, owner):
+	if job is not None and job.owner == owner:
+		# reconstruct file path, including output folder
+		# file = f"{db.get_job_dir(job_id)}/{unquote(file_name)}"
+		file = f"{job.job_dir}/{config.get("output.folder")}/{unquote(file_name)}"
 		# check that the file exists
 		if os.path.isfile(file):
 			# return the file
@@ -360,6 +406,63 @@ def diskusage():
 	"""
 	return jsonify(utils.get_disk_usage())
 
+@app.route("/dbstatus")
+def dbstatus():
+	"""
+	Returns the size of the database and the report of its last maintenance, as a JSON response.
+
+	Returns:
+		flask.Response: A JSON response containing the schema version, the sizes of the database and of its log, 
+						the number of free pages, and the date, duration and freed size of the last maintenance.
+	"""
+	return jsonify(db.get_database_status())
+
+@app.route("/tasks")
+def task_list():
+	"""
+	Returns the tasks of the provisioning and teardown pools, so that the administrators can see what is waiting for the cloud.
+
+	Returns:
+		flask.Response: A JSON response containing, for each pool, its maximum number of threads, the running tasks,
+						the queued tasks in the order they will be run, and the last finished tasks with their waiting time and duration.
+	"""
+	return jsonify(tasks.get_pools())
+
+@app.route("/scheduler")
+def scheduler_decisions():
+	"""
+	Returns the decisions of the scheduler, so that the administrators can see why a job is still waiting.
+
+	Returns:
+		flask.Response: A JSON response containing the scheduling policy, the last decision for each job ready to run
+						(start or wait, with its reason), and the last changes of decision.
+	"""
+	return jsonify(scheduler.get_decisions())
+
+@app.route("/share")
+def share():
+	"""
+	Returns the share of each owner, computed from the recent usage of their jobs (weight x duration, decayed over time).
+
+	Returns:
+		flask.Response: A JSON response containing, for each owner, the usage, the fraction of the total usage,
+						the weight reserved now, the maximum weight allowed (0 if there is no limit) and the number of pending jobs.
+	"""
+	# the jobs loaded by the last check of the daemon are recent enough
+	snapshot = daemon.SNAPSHOT if daemon.SNAPSHOT is not None else db.get_snapshot()
+	return jsonify(fairshare.get_shares(snapshot))
+
+@app.route("/warmpool")
+def warm_pool():
+	"""
+	Returns the warm workers, the virtual machines created in advance for the next jobs or kept after a job for the next job of its owner.
+
+	Returns:
+		flask.Response: A JSON response containing the name, flavor, weight, status (BOOTING, READY, LEASED or ORPHANED), address, volume,
+						creation date, ready date, the job that has taken it over (None if it's idle) and the owner, app and ID of the job that has handed it over of each worker.
+	"""
+	return jsonify(db.get_warm_workers())
+
 @app.route("/fail", methods=["POST"])
 def fail_job():
 	"""
@@ -433,12 +536,15 @@ def start():
 		)
 	# set the controller name
 	config.set_controller_name(utils.get_local_hostname())
+	# load the apps first, the database needs them to record the input files of the jobs
+	apps.get_app_list()
 	# initialize the database
 	db.initialize_database()
 	# start the daemons once all functions are defined
 	threading.Thread(target=daemon.run, args=(), daemon=True).start()
 	threading.Thread(target=daemon.convert_raw_to_mzml, args=(), daemon=True).start()
 	if not IS_DEBUG: threading.Thread(target=daemon.clean, args=(), daemon=True).start()
+	threading.Thread(target=warmpool.run, args=(), daemon=True).start()
 	# immediately restart the paused jobs, if any
 	daemon.restart_paused_jobs()
 	# start waitress WSGI server
@@ -448,6 +554,8 @@ def handle_shutdown(signum, frame):
 	logger.info(f"Received shutdown signal ({signum})... Cleaning up.")
 	# pause all jobs that are in PREPARING status
 	db.pause_preparing_jobs()
+	# close the database connections of every thread
+	db.close_connections()
 	# exit the program
 	sys.exit(0)
 
@@ -0,0 +1,139 @@
+# Copyright or © or Copr. Alexandre BUREL for LSMBO / IPHC UMR7178 / CNRS (2025)
+# 
+# [a.burel@unistra.fr]
+# 
+# This software is the server for Cumulus, a client-server to operate jobs on a Cloud.
+# 
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use, 
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info". 
+# 
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability. 
+# 
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or 
+# data to be ensured and,  more generally, to use and operate it in the 
+# same conditions as regards security. 
+# 
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# the files that are being written, they are not ready even if they already exist (ie. an mzML file copied from the temp folder)
+BUSY_FILES = set()
+# the files that each waiting job still needs, by job ID
+WAITING = {}
+# the functions to call when the files of each waiting job are ready, or when the job stops waiting (on_ready, on_cancel)
+CALLBACKS = {}
+LOCK = threading.Lock()
+
+def is_ready(file):
+	"""
+	Returns True if the file (or the folder, for Bruker data) exists and is not being written.
+	"""
+	return file not in BUSY_FILES and os.path.exists(file)
+
+def pop_callbacks(cancelled_ids = []):
+	"""
+	Removes the jobs whose files are all ready, and the given jobs, and returns the functions to call for each of them.
+	The lock must be held by the caller, the functions must be called once it has been released (see notify).
+	"""
+	callbacks = []
+	for job_id in [job_id for job_id in WAITING if job_id in cancelled_ids or len(WAITING[job_id]) == 0]:
+		WAITING.pop(job_id)
+		on_ready, on_cancel = CALLBACKS.pop(job_id)
+		callbacks.append(on_cancel if job_id in cancelled_ids else on_ready)
+	return callbacks
+
+def notify(callbacks):
+	for callback in callbacks:
+		try:
+			callback()
+		except Exception as e:
+			logger.error(f"Cannot notify a job waiting for its files: {e}")
+
+def set_busy(file):
+	"""
+	Tells the waiting jobs that a file is being written, it will not be considered ready until set_ready is called.
+	"""
+	with LOCK:
+		BUSY_FILES.add(file)
+
+def set_ready(file):
+	"""
+	Tells the waiting jobs that a file has been written, the jobs that were only waiting for this file are notified.
+	If the file does not exist (ie. the conversion has failed), the jobs keep waiting for it.
+	"""
+	with LOCK:
+		BUSY_FILES.discard(file)
+		if not os.path.exists(file): return
+		for files in WAITING.values(): files.discard(file)
+		callbacks = pop_callbacks()
+	notify(callbacks)
+
+def cancel(job_id):
+	"""
+	Stops the waiting of a job, its on_cancel function is called.
+	"""
+	with LOCK:
+		callbacks = pop_callbacks([job_id])
+	notify(callbacks)
+
+def refresh(active_ids):
+	"""
+	Checks again the files that the waiting jobs still need, this is called by the daemon when a file of a job has changed
+	(ie. the final file written at the end of the transfer), and at each refresh in case a signal has been missed.
+	Only the missing files are checked, not all the inputs of the jobs.
+
+	Args:
+		active_ids (list[int]): The jobs that are still PREPARING or RUNNING, the other waiting jobs are cancelled.
+	"""
+	with LOCK:
+		active_ids = set(active_ids)
+		for job_id, files in WAITING.items():
+			if job_id in active_ids: files.difference_update([file for file in files if is_ready(file)])
+		callbacks = pop_callbacks([job_id for job_id in WAITING if job_id not in active_ids])
+	notify(callbacks)
+
+def get_waiting():
+	"""
+	Returns the files that each waiting job still needs.
+	"""
+	with LOCK:
+		return {job_id: sorted(files) for job_id, files in WAITING.items()}
+
+def watch(job_id, files, on_ready, on_cancel):
+	"""
+	Waits until all the given files are ready, without holding a thread nor checking them over and over on the shared storage:
+	the converter and the daemon signal the files when they are ready (see set_ready and refresh).
+	The functions are called by the thread that signals the files (ie. the daemon, the converter or the API), so they must be short (ie. submit a task).
+
+	Args:
+		job_id (int): The job that needs the files.
+		files (list[str]): The paths of the files.
+		on_ready (function): Called without argument when all the files are ready, immediately if they already are.
+		on_cancel (function): Called without argument instead, if the job is cancelled or stops in the meantime.
+	"""
+	with LOCK:
+		WAITING[job_id] = set([file for file in files if not is_ready(file)])
+		CALLBACKS[job_id] = (on_ready, on_cancel)
+		if len(WAITING[job_id]) > 0: logger.info(f"Job {job_id} is waiting for {len(WAITING[job_id])} files")
+		callbacks = pop_callbacks()
+	notify(callbacks)
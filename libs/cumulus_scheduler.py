@@ -0,0 +1,286 @@
+# Copyright or © or Copr. Alexandre BUREL for LSMBO / IPHC UMR7178 / CNRS (2025)
+# 
+# [a.burel@unistra.fr]
+# 
+# This software is the server for Cumulus, a client-server to operate jobs on a Cloud.
+# 
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use, 
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info". 
+# 
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability. 
+# 
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or 
+# data to be ensured and,  more generally, to use and operate it in the 
+# same conditions as regards security. 
+# 
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+from collections import deque
+import logging
+import threading
+import time
+
+import libs.cumulus_config as config
+import libs.cumulus_database as db
+import libs.cumulus_fairshare as fairshare
+import libs.cumulus_utils as utils
+
+logger = logging.getLogger(__name__)
+
+# the duration of a job when there is no successful job of its app to estimate it (in seconds)
+DEFAULT_RUNTIME = int(config.get("scheduler.default.runtime.in.minutes", "120")) * 60
+# the estimates are computed from the database at most once in this time (in seconds)
+ESTIMATES_MAX_AGE = 600
+ESTIMATES = {}
+ESTIMATES_DATE = None
+# the last decision for each job that is waiting to start, and the last changes of decision
+DECISIONS = {}
+HISTORY = deque(maxlen = 200)
+LOCK = threading.Lock()
+
+class Decision:
+	"""
+	Whether a job ready to run starts now or keeps waiting, with the reason given by the policy.
+	"""
+	__slots__ = ("job_id", "flavor", "weight", "start", "reason", "policy", "date")
+
+	def __init__(self, job_id, flavor, weight, start, reason):
+		self.job_id = job_id
+		self.flavor = flavor
+		self.weight = weight
+		self.start = start
+		self.reason = reason
+		self.policy = None
+		self.date = int(time.time())
+
+	def to_dict(self):
+		return {"job_id": self.job_id, "flavor": self.flavor, "weight": self.weight, "start": self.start, "reason": self.reason, "policy": self.policy, "date": self.date}
+
+def get_runtime_estimate(app_name):
+	"""
+	Returns the expected duration of a job of the given app, in seconds (the average of its successful jobs, see db.get_runtime_estimates).
+	"""
+	global ESTIMATES, ESTIMATES_DATE
+	if ESTIMATES_DATE is None or time.monotonic() - ESTIMATES_DATE > ESTIMATES_MAX_AGE:
+		ESTIMATES = db.get_runtime_estimates()
+		ESTIMATES_DATE = time.monotonic()
+	return ESTIMATES.get(app_name, DEFAULT_RUNTIME)
+
+def get_shadow_time(weight, free_weight, running, now):
+	"""
+	Computes when a job could start if the running jobs end as expected (the "shadow time" of EASY backfilling).
+
+	Args:
+		weight (int): The weight of the job.
+		free_weight (int): The weight that is free now.
+		running (list): Tuples (expected end date, weight) of the jobs holding a reservation.
+		now (int): The current date.
+
+	Returns:
+		tuple: The date when the job could start, and the weight that would still be free at that date once the job has started.
+	"""
+	for end_date, reserved in sorted(running):
+		if free_weight >= weight: break
+		free_weight += reserved
+		now = max(now, end_date)
+	return now, free_weight - weight
+
+def schedule_fifo(candidates, free_weight, running, now):
+	"""
+	Starts the jobs oldest first, each one as long as its weight fits in the free weight (the historical behavior).
+	A large job may wait forever if smaller jobs keep taking the weight freed by the others.
+	"""
+	decisions = []
+	for job, flavor, weight in candidates:
+		if weight <= free_weight:
+			free_weight -= weight
+			decisions.append(Decision(job.id, flavor, weight, True, f"Weight {weight} fits in the free weight"))
+		else: decisions.append(Decision(job.id, flavor, weight, False, f"Weight {weight} is larger than the free weight ({free_weight})"))
+	return decisions
+
+def schedule_easy_backfill(candidates, free_weight, running, now):
+	"""
+	Starts the jobs oldest first until one does not fit. This job gets a reservation at the date when enough running jobs are expected to be over,
+	and the younger jobs only start if they fit now and do not delay it: they are expected to end before this date, or they use the weight it does not need.
+	The durations are estimated from the successful jobs of the same app (see get_runtime_estimate).
+	"""
+	decisions = []
+	running = list(running)
+	# the date of the reservation and the weight that the reserved job leaves free, once a job has been reserved
+	shadow_time = None
+	extra_weight = 0
+	for job, flavor, weight in candidates:
+		end_date = now + get_runtime_estimate(job.app_name)
+		if weight > config.FLAVORS_MAX_WEIGHT:
+			decisions.append(Decision(job.id, flavor, weight, False, f"Weight {weight} is larger than the maximum weight ({config.FLAVORS_MAX_WEIGHT})"))
+		elif shadow_time is None and weight <= free_weight:
+			free_weight -= weight
+			running.append((end_date, weight))
+			decisions.append(Decision(job.id, flavor, weight, True, f"Weight {weight} fits in the free weight"))
+		elif shadow_time is None:
+			# the oldest job that does not fit is started as soon as possible, the next ones must not delay it
+			shadow_time, extra_weight = get_shadow_time(weight, free_weight, running, now)
+			decisions.append(Decision(job.id, flavor, weight, False, f"Weight {weight} is larger than the free weight ({free_weight}), reserved in {shadow_time - now} seconds"))
+		elif weight > free_weight:
+			decisions.append(Decision(job.id, flavor, weight, False, f"Weight {weight} is larger than the free weight ({free_weight})"))
+		elif end_date <= shadow_time:
+			free_weight -= weight
+			decisions.append(Decision(job.id, flavor, weight, True, f"Backfilled, it should end {shadow_time - end_date} seconds before the reserved job starts"))
+		elif weight <= extra_weight:
+			free_weight -= weight
+			extra_weight -= weight
+			decisions.append(Decision(job.id, flavor, weight, True, "Backfilled on the weight that the reserved job does not need"))
+		else: decisions.append(Decision(job.id, flavor, weight, False, "Starting it would delay the reserved job"))
+	return decisions
+
+def schedule_best_fit(candidates, free_weight, running, now):
+	"""
+	Starts the heaviest jobs that fit in the free weight first, the oldest first for the same weight, so that as little weight as possible is left unused.
+	The light jobs may delay the heavy ones, but they do not block them.
+	"""
+	decisions = []
+	for job, flavor, weight in sorted(candidates, key = lambda candidate: -candidate[2]):
+		if weight <= free_weight:
+			free_weight -= weight
+			decisions.append(Decision(job.id, flavor, weight, True, f"Heaviest job that fits, {free_weight} weight left free"))
+		else: decisions.append(Decision(job.id, flavor, weight, False, f"Weight {weight} is larger than the free weight ({free_weight})"))
+	# the jobs are started in the order of the decisions
+	return decisions
+
+# the scheduling policies, by name
+POLICIES = {
+	"fifo": schedule_fifo,
+	"easy": schedule_easy_backfill,
+	"bestfit": schedule_best_fit
+}
+
+def get_policy(name = None):
+	"""
+	Returns the scheduling policy with the given name, or the one defined in the configuration.
+
+	Raises:
+		ValueError: If there is no policy with this name.
+	"""
+	if name is None: name = config.get("scheduler.policy", "fifo")
+	if name not in POLICIES: raise ValueError(f"Unknown scheduling policy '{name}', it should be one of: {', '.join(POLICIES)}")
+	return name, POLICIES[name]
+
+def schedule(jobs, snapshot, policy = None, now = None, warm_workers = []):
+	"""
+	Decides which of the jobs ready to run can start now, according to the weight of their flavors and to the scheduling policy.
+	If the fair share is enabled, the jobs are given to the policy by usage of their owners instead of their age,
+	and the owners cannot reserve more than their maximum weight (see cumulus_fairshare).
+	Each decision is recorded with its reason (see get_decisions).
+
+	Args:
+		jobs (list[db.JobRecord]): The PENDING jobs whose files are all there, oldest ones first.
+		snapshot (db.JobSnapshot): The jobs loaded for the current check, with the weights they have reserved.
+		policy (str, optional): The name of the policy, a key of POLICIES. Defaults to the policy of the configuration.
+		now (int, optional): The current date, as a Unix timestamp. Defaults to now.
+		warm_workers (list[dict], optional): The warm workers (see db.get_warm_workers), their weight is reserved. Defaults to [].
+
+	Returns:
+		list[Decision]: A decision for each job, the jobs to start are in the order they should be started.
+	"""
+	if now is None: now = int(time.time())
+	name, policy = get_policy(policy)
+	if fairshare.is_enabled():
+		fairshare.update_usage(now)
+		jobs = fairshare.order(jobs, snapshot, get_runtime_estimate, now)
+	candidates = []
+	for job in jobs:
+		flavor = utils.get_flavor(job.strategy)
+		candidates.append((job, flavor, config.FLAVORS[flavor]['weight']))
+	# the jobs holding a reservation free it when they are expected to end, the jobs that have not started yet are expected to start now
+	running = []
+	for job in snapshot.get_jobs(["PREPARING", "RUNNING", "PAUSED"]):
+		if job.id not in snapshot.weights: continue
+		start_date = job.start_date if job.start_date is not None else now
+		running.append((max(now, start_date + get_runtime_estimate(job.app_name)), snapshot.weights[job.id]))
+	free_weight = config.FLAVORS_MAX_WEIGHT - snapshot.reserved_weight
+	# the idle warm workers reserve their weight, but a job of the same flavor takes the weight over with the worker (see db.reserve_flavor)
+	# the workers handed over by a job are only taken over by the jobs of the same owner, and before the workers of the pool
+	idle_workers = []
+	for worker in warm_workers:
+		if worker["job_id"] is not None: continue
+		free_weight -= worker["weight"]
+		if worker["status"] == "READY": idle_workers.append(worker)
+	for job, flavor, weight in candidates:
+		matches = [worker for worker in idle_workers if worker["flavor"] == flavor and worker["owner"] in (None, job.owner)]
+		if len(matches) > 0:
+			idle_workers.remove(min(matches, key = lambda worker: worker["owner"] is None))
+			free_weight += weight
+	decisions = policy(candidates, free_weight, running, now)
+	if fairshare.is_enabled(): fairshare.apply_caps(decisions, snapshot)
+	record(decisions, name)
+	return decisions
+
+def is_speculative():
+	"""
+	Returns True if the workers of the jobs still uploading their files can be created in advance (see speculate).
+	"""
+	return config.get("speculative.provisioning", "false").lower() == "true"
+
+def speculate(jobs, snapshot, decisions, warm_workers = []):
+	"""
+	Decides which of the jobs still uploading their files can have their worker created now, so that the boot and the transfer overlap.
+	Only the weight that the jobs ready to run leave free is used: nothing is created in advance while one of them is waiting.
+	The jobs are taken oldest first, within the maximum weight of their owners if the fair share is enabled. The decisions are not recorded.
+
+	Args:
+		jobs (list[db.JobRecord]): The PENDING jobs whose files are not all there yet, oldest ones first.
+		snapshot (db.JobSnapshot): The jobs loaded for the current check, with the weights they have reserved, the jobs that have just started included.
+		decisions (list[Decision]): The decisions taken for the jobs ready to run (see schedule).
+		warm_workers (list[dict], optional): The warm workers (see db.get_warm_workers), their weight is reserved. Defaults to [].
+
+	Returns:
+		list[Decision]: The jobs whose worker can be created now.
+	"""
+	if not is_speculative() or any(not decision.start for decision in decisions): return []
+	free_weight = config.FLAVORS_MAX_WEIGHT - snapshot.reserved_weight - sum([worker["weight"] for worker in warm_workers if worker["job_id"] is None])
+	speculative = []
+	for job in jobs:
+		flavor = utils.get_flavor(job.strategy)
+		weight = config.FLAVORS[flavor]['weight']
+		if weight > free_weight: continue
+		speculative.append(Decision(job.id, flavor, weight, True, "Its worker is created while its files are uploaded"))
+		free_weight -= weight
+	if fairshare.is_enabled(): fairshare.apply_caps(speculative, snapshot)
+	return [decision for decision in speculative if decision.start]
+
+def record(decisions, policy):
+	"""
+	Keeps the decisions of the last check, and adds to the history the ones that differ from the previous decision for the same job.
+	"""
+	global DECISIONS
+	with LOCK:
+		previous = DECISIONS
+		DECISIONS = {}
+		for decision in decisions:
+			decision.policy = policy
+			DECISIONS[decision.job_id] = decision
+			if decision.job_id not in previous or previous[decision.job_id].reason != decision.reason:
+				HISTORY.append(decision)
+				logger.info(f"Job {decision.job_id} {'starts' if decision.start else 'waits'} with flavor '{decision.flavor}' ({policy}): {decision.reason}")
+
+def get_decisions():
+	"""
+	Returns the policy, the last decision for each job ready to run, and the last changes of decision, newest first.
+	"""
+	with LOCK:
+		return {"policy": get_policy()[0], "decisions": [decision.to_dict() for decision in DECISIONS.values()], "history": [decision.to_dict() for decision in reversed(HISTORY)]}
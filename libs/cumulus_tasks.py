@@ -0,0 +1,260 @@
+# Copyright or © or Copr. Alexandre BUREL for LSMBO / IPHC UMR7178 / CNRS (2025)
+# 
+# [a.burel@unistra.fr]
+# 
+# This software is the server for Cumulus, a client-server to operate jobs on a Cloud.
+# 
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use, 
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info". 
+# 
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability. 
+# 
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or 
+# data to be ensured and,  more generally, to use and operate it in the 
+# same conditions as regards security. 
+# 
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+from collections import deque
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+import libs.cumulus_config as config
+
+logger = logging.getLogger(__name__)
+
+# the statuses of a task, in the order they are given
+QUEUED = "QUEUED"
+RUNNING = "RUNNING"
+DONE = "DONE"
+FAILED = "FAILED"
+CANCELLED = "CANCELLED"
+
+def is_stale(entry):
+	"""
+	Returns True if an entry of the queue of a TaskPool must be skipped: its task has been cancelled, or it has been queued again with a lower priority.
+	"""
+	priority, _, task = entry
+	return task.status != QUEUED or priority != task.priority
+
+class Task:
+	"""
+	A function submitted to a TaskPool, with the times it has been submitted, started and ended, and the value it has returned.
+	"""
+	__slots__ = ("id", "name", "job_id", "key", "function", "args", "priority", "status", "submitted", "started", "ended", "result", "error")
+
+	def __init__(self, id, name, job_id, key, function, args, priority):
+		self.id = id
+		self.name = name
+		self.job_id = job_id
+		self.key = key
+		self.function = function
+		self.args = args
+		self.priority = priority
+		self.status = QUEUED
+		self.submitted = time.time()
+		self.started = None
+		self.ended = None
+		self.result = None
+		self.error = None
+
+	def to_dict(self):
+		"""
+		Returns the task as a dict that can be sent to the clients, the times are in seconds since the epoch.
+		The waiting time and the duration are given up to now if the task is not started or not over yet.
+		"""
+		now = time.time()
+		waiting = (self.started if self.started is not None else (self.ended if self.ended is not None else now)) - self.submitted
+		duration = None if self.started is None else (self.ended if self.ended is not None else now) - self.started
+		return {"id": self.id, "name": self.name, "job_id": self.job_id, "status": self.status, "priority": self.priority, "submitted": self.submitted, "started": self.started, "ended": self.ended, "waiting": round(waiting, 3), "duration": None if duration is None else round(duration, 3), "result": self.result, "error": self.error}
+
+class TaskPool:
+	"""
+	Runs the tasks submitted by the daemons in a limited number of threads, so that a burst of jobs does not start
+	dozens of openstack commands at the same time. The other tasks wait in a queue that can be listed and cancelled.
+
+	Notes:
+		- The tasks are run by priority (lowest first), then in the order they have been submitted.
+		- A task is not submitted again while another task with the same key is queued or running (by default, the key is the name and the job ID),
+		  but a queued task takes the priority of the new submission if it's lower.
+		- The worker threads are started on the first submissions, and they are kept waiting for the next tasks.
+		- The last finished tasks are kept, so that their timing can be read once they are over.
+	"""
+
+	def __init__(self, name, max_workers, history_size = 100):
+		self.name = name
+		self.max_workers = max(1, max_workers)
+		# the queued tasks, as a heap of (priority, sequence, task)
+		self.queue = []
+		self.sequence = itertools.count()
+		self.ids = itertools.count(1)
+		# the queued and running tasks, by key
+		self.active = {}
+		self.history = deque(maxlen = history_size)
+		self.workers = []
+		self.idle_workers = 0
+		self.condition = threading.Condition()
+
+	def submit(self, name, job_id, function, *args, key = None, priority = 0):
+		"""
+		Adds a task to the queue, it will be run as soon as a thread is available.
+
+		Args:
+			name (str): The name of the task, ie. the name of the function.
+			job_id (int): The job the task is run for, it's used to cancel the tasks of a job.
+			function (callable): The function to run.
+			*args: The arguments of the function.
+			key (hashable, optional): Identifies the task to avoid running it twice at the same time. Defaults to (name, job_id).
+			priority (int, optional): The tasks with the lowest priority are run first. Defaults to 0.
+
+		Returns:
+			Task: The new task, or the task with the same key that is already queued or running.
+		"""
+		if key is None: key = (name, job_id)
+		with self.condition:
+			if key in self.active:
+				task = self.active[key]
+				# move the queued task forward, its previous entry in the heap is skipped by the workers
+				if task.status == QUEUED and priority < task.priority:
+					task.priority = priority
+					heapq.heappush(self.queue, (priority, next(self.sequence), task))
+				return task
+			task = Task(next(self.ids), name, job_id, key, function, args, priority)
+			self.active[key] = task
+			heapq.heappush(self.queue, (priority, next(self.sequence), task))
+			# start a new thread only if the others are all busy
+			if self.idle_workers == 0 and len(self.workers) < self.max_workers:
+				worker = threading.Thread(target=self.run_worker, name=f"cumulus-{self.name}-{len(self.workers) + 1}", daemon=True)
+				self.workers.append(worker)
+				worker.start()
+			self.condition.notify()
+		return task
+
+	def cancel(self, job_id = None, key = None):
+		"""
+		Cancels the queued tasks of a job, or the queued task with the given key. The running tasks cannot be cancelled.
+
+		Args:
+			job_id (int, optional): The job whose tasks are cancelled. Defaults to None.
+			key (hashable, optional): The key of the task to cancel. Defaults to None.
+
+		Returns:
+			list[Task]: The tasks that have been cancelled.
+		"""
+		cancelled = []
+		with self.condition:
+			for task in list(self.active.values()):
+				if task.status != QUEUED or (job_id is not None and task.job_id != job_id) or (key is not None and task.key != key): continue
+				# the task stays in the heap, the workers skip it
+				task.status = CANCELLED
+				task.ended = time.time()
+				self.finish(task)
+				cancelled.append(task)
+				logger.info(f"Task {task.name} of job {task.job_id} has been cancelled before it started")
+			self.condition.notify_all()
+		return cancelled
+
+	def finish(self, task):
+		# the condition must be held by the caller
+		self.active.pop(task.key, None)
+		self.history.append(task)
+
+	def is_active(self, key):
+		"""
+		Returns True if the task with the given key is queued or running.
+		"""
+		with self.condition:
+			return key in self.active
+
+	def get_queue(self):
+		"""
+		Returns the queued tasks, in the order they will be run.
+		"""
+		with self.condition:
+			return [entry[2] for entry in sorted(self.queue) if not is_stale(entry)]
+
+	def get_tasks(self):
+		"""
+		Returns the running tasks, the queued tasks in the order they will be run, and the last finished tasks, newest first.
+
+		Returns:
+			dict: The name of the pool, its maximum number of threads, and the lists of tasks as dicts (see Task.to_dict).
+		"""
+		with self.condition:
+			running = [task.to_dict() for task in self.active.values() if task.status == RUNNING]
+			queued = [entry[2].to_dict() for entry in sorted(self.queue) if not is_stale(entry)]
+			finished = [task.to_dict() for task in reversed(self.history)]
+		return {"name": self.name, "max_workers": self.max_workers, "running": running, "queued": queued, "finished": finished}
+
+	def wait(self, timeout = None):
+		"""
+		Waits until every task is over.
+
+		Args:
+			timeout (float, optional): The maximum time to wait, in seconds. Defaults to None (no limit).
+
+		Returns:
+			bool: True if every task is over, False if the timeout has expired.
+		"""
+		with self.condition:
+			return self.condition.wait_for(lambda: len(self.active) == 0, timeout)
+
+	def run_worker(self):
+		"""
+		Main loop of the worker threads, they take the next queued task and run it.
+		"""
+		while True:
+			with self.condition:
+				self.idle_workers += 1
+				# skip the tasks that have been cancelled or moved forward while they were queued
+				while len(self.queue) > 0 and is_stale(self.queue[0]): heapq.heappop(self.queue)
+				while len(self.queue) == 0:
+					self.condition.wait()
+					while len(self.queue) > 0 and is_stale(self.queue[0]): heapq.heappop(self.queue)
+				self.idle_workers -= 1
+				task = heapq.heappop(self.queue)[2]
+				task.status = RUNNING
+				task.started = time.time()
+			try:
+				task.result = task.function(*task.args)
+				status = DONE
+			except Exception as e:
+				status = FAILED
+				task.error = str(e)
+				logger.error(f"Task {task.name} of job {task.job_id} has failed: {e}")
+			with self.condition:
+				task.status = status
+				task.ended = time.time()
+				self.finish(task)
+				self.condition.notify_all()
+			logger.debug(f"Task {task.name} of job {task.job_id} took {task.ended - task.started:.1f} seconds, after waiting {task.started - task.submitted:.1f} seconds in the queue")
+
+# creating the virtual machines and destroying them are limited separately, so that the teardowns are never stuck behind a burst of new jobs
+PROVISIONING = TaskPool("provisioning", int(config.get("provisioning.max.threads", "4")))
+TEARDOWN = TaskPool("teardown", int(config.get("teardown.max.threads", "4")))
+# the conversions to mzML run on the controller, each one uses a core
+CONVERSION = TaskPool("conversion", int(config.get("conversion.max.threads", "4")))
+
+def get_pools():
+	"""
+	Returns the state of every task pool, for the API.
+	"""
+	return [PROVISIONING.get_tasks(), TEARDOWN.get_tasks(), CONVERSION.get_tasks()]
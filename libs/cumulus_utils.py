@@ -40,6 +40,7 @@ import shutil
 import subprocess
 import time
 
+import libs.cumulus_backends as backends
 import libs.cumulus_config as config
 import libs.cumulus_database as db
 
@@ -336,7 +337,7 @@ def delete_job_folder(job_id, delete_job_in_database = False, only_delete_conten
 	else:
 		delete_folder(job_dir)
 	# if delete_job_in_database is True, we will also delete the job from the database
-	if delete_job_in_database: db.delete_job(job_id)
+	if delete_job_in_database: backends.STORAGE.delete_job(job_id)
 
 def get_pid_file(job_id): 
 	"""
@@ -384,7 +385,7 @@ def cancel_job(job_id):
 		Exception: If the job cannot be found, the process cannot be killed, or the database update fails.
 	"""
 	# get all the jobs in case this is a workflow job
-	job_ids = db.get_associated_jobs(job_id)
+	job_ids = backends.STORAGE.get_associated_jobs(job_id)
 	# cancel all the corresponding jobs
 	for id in job_ids:
 		# get the pid and the host
@@ -392,7 +393,7 @@ def cancel_job(job_id):
 		# use ssh to kill the pid (may not be needed if the job is still pending)
 		remote_cancel(get_host(job_id), pid)
 		# change the status
-		db.set_status(id, "CANCELLED")
+		backends.STORAGE.set_status(id, "CANCELLED")
 		db.set_end_date(id)
 
 # def get_log_file_path(job_id, is_stdout = True):
@@ -447,6 +448,8 @@ def add_to_stderr(job_id, text):
 	add_to_log(job_id, "STDERR", text)
 
 def add_to_stdalt(job_id, text):
+	# the warm workers are not created for a job, there is no log to write to
+	if job_id is None: return
 	add_to_log(job_id, "SERVER", text, True)
 
 def get_file_age_in_seconds(file):
@@ -556,10 +559,10 @@ def set_job_failed(job_id, error_message):
 		- Logs a warning message indicating the job failure.
 	"""
 	# get all the jobs in case this is a workflow job
-	job_ids = db.get_associated_jobs(job_id)
+	job_ids = backends.STORAGE.get_associated_jobs(job_id)
 	# fail all the jobs in the workflow
 	for id in job_ids:
-		db.set_status(id, "FAILED")
+		backends.STORAGE.set_status(id, "FAILED")
 		db.set_end_date(id)
 		add_to_stderr(id, error_message)
 	logger.warning(f"Failure of {db.get_job_to_string(job_id)}")
@@ -577,7 +580,22 @@ def get_job_current_directory(job_id):
 	# get the job directory from the database
 	return db.get_job_dir(job_id)
 
-def check_flavor(job_id):
+def get_flavor(flavor):
+	"""
+	Returns the given flavor if it is in the list of authorized flavors, or the default flavor (the one with the lowest weight) otherwise.
+
+	Args:
+		flavor (str): The strategy of a job.
+
+	Returns:
+		str: The name of the flavor to use.
+	"""
+	if flavor not in config.FLAVORS:
+		logger.warning(f"The flavor '{flavor}' is not in the list of authorized flavors, using the default flavor instead")
+		flavor = min(config.FLAVORS, key=lambda flavor: config.FLAVORS[flavor]['weight'])
+	return flavor
+
+def check_flavor(job_id, flavor = None, reserved_weight = None):
 	"""
 	Checks if the specified flavor is in the list of authorized flavors.
 	If the flavor is not authorized, it returns the default flavor from the configuration.
@@ -585,33 +603,34 @@ def check_flavor(job_id):
 
 	Args:
 		job_id (int): The id of the job to check.
+		flavor (str, optional): The strategy of the job, if it is already known. It is read from the database otherwise.
+		reserved_weight (int, optional): The weight currently reserved by the active jobs, if it is already known (see db.JobSnapshot). It is read from the database otherwise.
 
 	Returns:
-		str: The name of the flavor, either the given one or the default one.
+		str: The name of the flavor, either the given one or the default one, or None if there is not enough capacity left.
+
+	Note:
+		This is only a hint, the capacity is really taken by db.reserve_flavor when the job becomes PREPARING.
 	"""
-	flavor = db.get_strategy(job_id)
+	if flavor is None: flavor = db.get_strategy(job_id)
 	# check if the flavor is in the list of authorized flavors
-	if flavor not in config.FLAVORS:
-		logger.warning(f"The flavor '{flavor}' is not in the list of authorized flavors, using the default flavor instead")
-		flavor = min(config.FLAVORS, key=lambda flavor: config.FLAVORS[flavor]['weight'])
-	# verify that this flavor can be executed (based on the current cumulated weight of all running jobs)
-	if config.FLAVORS[flavor]['weight'] + get_current_flavor_cumulated_weight() > config.FLAVORS_MAX_WEIGHT:
+	flavor = get_flavor(flavor)
+	# verify that this flavor can be executed (based on the weights currently reserved by the active jobs)
+	if reserved_weight is None: reserved_weight = get_current_flavor_cumulated_weight()
+	if config.FLAVORS[flavor]['weight'] + reserved_weight > config.FLAVORS_MAX_WEIGHT:
 		logger.warning(f"The flavor '{flavor}' cannot be used right now, the maximum cumulated weight of all running jobs would be exceeded")
 		return None
 	return flavor
 
 def get_current_flavor_cumulated_weight():
 	"""
-	Calculates the cumulative weight of all flavors currently in use by running jobs.
+	Calculates the cumulative weight of all flavors currently in use by active jobs.
 
 	Returns:
-		int: The total weight of all flavors used by jobs with status "RUNNING".
+		int: The total weight of all flavors reserved by jobs with status "PREPARING", "RUNNING" or "PAUSED".
 	"""
-	total_weight = 0
-	for flavor in db.get_currently_running_strategies():
-		if flavor in config.FLAVORS:
-			total_weight += config.FLAVORS[flavor]['weight']
-	return total_weight
+	# the weights are reserved and released with the status of the jobs, they do not have to be added up here
+	return db.get_reserved_weight()
 
 def wait_for_volume(volume_name):
 	# wait for the volume to become available
@@ -652,9 +671,10 @@ def get_server_ip_address(server_name):
 		# if the command fails (usually because the server does not exist)
 		return None
 
-def clone_volume(job_id):
+def clone_volume(job_id, volume_name = None):
 	logger.debug(f"Clone volume for job {job_id}")
-	volume_name = f"volume_job_{job_id}"
+	# the volumes of the warm workers are named after the worker, they are not created for a job
+	if volume_name is None: volume_name = f"volume_job_{job_id}"
 	volume_id = get_volume_id(volume_name)
 	if volume_id is None:
 		# create the volume
@@ -702,9 +722,9 @@ def wait_for_server_ssh_access(job_id, ip_address):
 	time.sleep(5)
 	add_to_stdalt(job_id, f"The virtual machine is available")
 
-def create_virtual_machine(job_id, flavor, volume_id):
+def create_virtual_machine(job_id, flavor, volume_id, worker_name = None):
 	logger.debug(f"Create worker for job {job_id}")
-	worker_name = f"worker_job_{job_id}"
+	if worker_name is None: worker_name = f"worker_job_{job_id}"
 	ip_address = get_server_ip_address(worker_name)
 	if ip_address is None:
 		# the worker does not exist yet
@@ -776,6 +796,30 @@ def create_worker(job_id, job_dir, flavor):
 	logger.info(f"Worker VM '{worker_name}' has been created for job {job_id}")
 	write_host_file(job_dir, worker_name, ip_address, cpu, ram, volume_name, None)
 
+def delete_worker(worker_name, volume_name):
+	"""
+	Deletes a virtual machine and its volume.
+
+	Args:
+		worker_name (str): The name of the virtual machine.
+		volume_name (str): The name of its volume.
+	"""
+	# delete the VM
+	subprocess.run([config.OPENSTACK, "server", "delete", "--wait", worker_name])
+	# delete the volume
+	subprocess.run([config.OPENSTACK, "volume", "delete", volume_name])
+
+def destroy_host(host):
+	"""
+	Destroys a worker VM and its volume, and forgets it if it was leased from the warm pool or from a previous job.
+	This is used when the host file of the job has already been removed, otherwise see destroy_worker.
+
+	Args:
+		host (Host): The worker to destroy.
+	"""
+	delete_worker(host.name, host.volume)
+	db.delete_warm_worker(host.name)
+
 def destroy_worker(job_id):
 	"""
 	Destroys the worker VM associated with the given job ID.
@@ -790,17 +834,14 @@ def destroy_worker(job_id):
 	"""
 	logger.info(f"Destroying the virtual machine for job {job_id}")
 	# get all the jobs in case this is a workflow job
-	job_ids = db.get_associated_jobs(job_id)
+	job_ids = backends.STORAGE.get_associated_jobs(job_id)
 	# cancel all the corresponding jobs
 	all_workers_destroyed = False
 	for id in job_ids:
 		host = get_host(job_id)
 		# destroy the session
 		if host is not None:
-			# delete the VM
-			subprocess.run([config.OPENSTACK, "server", "delete", "--wait", host.name])
-			# delete the volume
-			subprocess.run([config.OPENSTACK, "volume", "delete", host.volume])
+			destroy_host(host)
 			logger.info(f"Worker VM '{host.name}' has been destroyed for job {job_id}")
 			all_workers_destroyed = True
 		else:
@@ -846,6 +887,16 @@ def get_command_as_array(command, input_file, output_file):
 	return shlex.split(cmd)
 
 def convert_to_mzml(job_id, file):
+	"""
+	Converts a Thermo raw file or a Bruker folder to mzML, the job fails if the conversion fails.
+
+	Args:
+		job_id (int): The job that needs the file, the output of the converter is written in its log file.
+		file (str): The path of the file to convert.
+
+	Returns:
+		int: The exit status of the converter, or None if the file cannot be converted.
+	"""
 	# prepare the output and temp file names
 	temp_output_file = get_mzml_file_path(file, True)
 	final_output_file = get_mzml_file_path(file, False)
@@ -862,12 +913,12 @@ def convert_to_mzml(job_id, file):
 	else:
 		logger.error(f"Cannot convert file '{file}' to mzML, unknown extension")
 		set_job_failed(job_id, f"Cannot convert file '{file}' to mzML, unknown extension")
-		return
+		return None
 	# execute the command and write the output directly in the job log file
 	command = get_command_as_array(converter, file, temp_output_file)
 	with open(get_log_file_path(job_id), "a") as log_file:
 		logger.debug(command)
-		subprocess.run(command, stdout = log_file, stderr = log_file, text = True)
+		process = subprocess.run(command, stdout = log_file, stderr = log_file, text = True)
 	# move the file to the final location
 	if os.path.isfile(temp_output_file): shutil.move(temp_output_file, final_output_file)
 	# if conversion has failed, the job should fail too
@@ -875,3 +926,4 @@ def convert_to_mzml(job_id, file):
 		logger.error(f"mzML conversion for job {job_id} has failed; command was:")
 		logger.error(command)
 		set_job_failed(job_id, f"File '{file}' could not be converted to mzML")
+	return process.returncode
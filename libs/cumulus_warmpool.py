@@ -0,0 +1,228 @@
+# Copyright or © or Copr. Alexandre BUREL for LSMBO / IPHC UMR7178 / CNRS (2025)
+# 
+# [a.burel@unistra.fr]
+# 
+# This software is the server for Cumulus, a client-server to operate jobs on a Cloud.
+# 
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use, 
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info". 
+# 
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability. 
+# 
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or 
+# data to be ensured and,  more generally, to use and operate it in the 
+# same conditions as regards security. 
+# 
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+import itertools
+import logging
+import time
+
+import libs.cumulus_config as config
+import libs.cumulus_database as db
+import libs.cumulus_scheduler as scheduler
+import libs.cumulus_tasks as tasks
+import libs.cumulus_utils as utils
+
+logger = logging.getLogger(__name__)
+
+# the idle warm workers are destroyed after this time (in seconds)
+TTL = int(config.get("warmpool.ttl.in.minutes", "60")) * 60
+# time between two checks of the warm pool (in seconds)
+CHECK_INTERVAL = 60
+# maximum time a worker can be handed over from one job to the next one (in seconds), the workers are never handed over if it's 0
+LEASE_LIFETIME = int(config.get("lease.max.lifetime.in.minutes", "0")) * 60
+# the workers handed over are destroyed if no job of their owner takes them over within this time (in seconds)
+LEASE_IDLE = int(config.get("lease.idle.in.minutes", "10")) * 60
+# numbers the warm workers, the date alone is not enough to make their names unique
+WORKER_IDS = itertools.count(1)
+
+def get_sizes():
+	"""
+	Returns the number of idle workers to keep for each flavor, from "warmpool.size" in the configuration (ie. "m1.4xlarge:2, m1.8xlarge-16xmem:1").
+
+	Returns:
+		dict: The number of workers by flavor, empty if there is no warm pool.
+	"""
+	sizes = {}
+	for item in config.get("warmpool.size", "").split(","):
+		if ":" not in item: continue
+		flavor, size = [value.strip() for value in item.rsplit(":", 1)]
+		if flavor not in config.FLAVORS: logger.warning(f"The flavor '{flavor}' of the warm pool is not in the list of authorized flavors")
+		elif int(size) > 0: sizes[flavor] = int(size)
+	return sizes
+
+def create_warm_worker(name, flavor):
+	"""
+	Creates a warm worker that has been recorded by add_warm_worker, this function is run by the provisioning pool.
+	The worker is READY once it can be reached with SSH, it's deleted if it cannot be created.
+
+	Args:
+		name (str): The name of the virtual machine.
+		flavor (str): Its flavor.
+
+	Returns:
+		bool: True if the worker is ready.
+	"""
+	logger.info(f"Creating the warm worker '{name}' with flavor '{flavor}'")
+	volume_id, volume_name = utils.clone_volume(None, f"volume_{name}")
+	if volume_id is None:
+		logger.error(f"Cannot create the volume of the warm worker '{name}'")
+		db.delete_warm_worker(name)
+		return False
+	worker_name, ip_address, stdout, stderr = utils.create_virtual_machine(None, flavor, volume_id, name)
+	if ip_address is None:
+		logger.error(f"Cannot create the warm worker '{name}', error was: {stderr}")
+		utils.delete_worker(name, volume_name)
+		db.delete_warm_worker(name)
+		return False
+	db.set_warm_worker_ready(name, ip_address, volume_name)
+	logger.info(f"The warm worker '{name}' is ready")
+	return True
+
+def destroy_warm_worker(name, volume):
+	"""
+	Deletes the virtual machine of a warm worker that has already been removed from the table, this function is run by the teardown pool.
+	"""
+	utils.delete_worker(name, volume if volume is not None else f"volume_{name}")
+	logger.info(f"The warm worker '{name}' has been destroyed")
+
+def evict(name, volume):
+	# the worker is only destroyed if no job has taken it over in the meantime
+	if db.delete_warm_worker(name, True): tasks.TEARDOWN.submit("destroy_warm_worker", None, destroy_warm_worker, name, volume, key = ("destroy_warm_worker", name))
+
+def get_next_job(job, flavor, snapshot):
+	"""
+	Searches the pending job that should take over the worker of a job that has ended.
+	It must have the same owner and the same flavor, the next job of the workflow comes first, then the jobs of the same app, oldest ones first.
+
+	Args:
+		job (db.JobRecord): The job that has ended.
+		flavor (str): The flavor of its worker.
+		snapshot (db.JobSnapshot): The jobs loaded for the current check.
+
+	Returns:
+		db.JobRecord: The next job, or None if no job can use the worker.
+	"""
+	jobs = [other for other in snapshot.get_jobs(["PENDING"]) if other.owner == job.owner and utils.get_flavor(other.strategy) == flavor]
+	if len(jobs) == 0: return None
+	return min(jobs, key = lambda other: (other.start_after_id != job.id, other.app_name != job.app_name, other.id))
+
+def hand_over(job, snapshot):
+	"""
+	Keeps the worker of a job that has ended for the next job of its owner, instead of destroying it (see db.release_worker).
+	The weight moves from the job to the worker in the snapshot too, so that the scheduler does not count it twice.
+	The next job skips the creation of the volume and of the virtual machine. The worker is not handed over if the job has failed,
+	if no pending job can use it, or if its lease is older than "lease.max.lifetime.in.minutes".
+
+	Args:
+		job (db.JobRecord): The job that has ended.
+		snapshot (db.JobSnapshot): The jobs loaded for the current check.
+
+	Returns:
+		bool: True if the worker has been handed over, False if it has to be destroyed.
+	"""
+	if LEASE_LIFETIME <= 0 or job.status != "DONE": return False
+	flavor = db.get_reserved_flavor(job.id)
+	host = utils.get_host_from_file(f"{job.job_dir}/{config.HOST_FILE}")
+	if flavor is None or flavor not in config.FLAVORS or host is None or host.error is not None: return False
+	next_job = get_next_job(job, flavor, snapshot)
+	if next_job is None: return False
+	leased_since = job.start_date if job.start_date is not None else int(time.time())
+	if not db.release_worker(job.id, host.name, flavor, config.FLAVORS[flavor]['weight'], host.address, host.volume, job.owner, job.app_name, leased_since, LEASE_LIFETIME): return False
+	# the weight is not reserved by the job anymore, but by the idle worker (the scheduler reads it from the warm workers)
+	snapshot.reserved_weight -= snapshot.weights.pop(job.id, 0)
+	logger.info(f"The worker '{host.name}' of job {job.id} is kept for job {next_job.id}")
+	return True
+
+def get_waiting_flavors():
+	"""
+	Returns the flavors of the jobs ready to run that the scheduler keeps waiting.
+	"""
+	with scheduler.LOCK: return set([decision.flavor for decision in scheduler.DECISIONS.values() if not decision.start])
+
+def maintain(now = None):
+	"""
+	Keeps the warm pool at the configured size, this is called regularly by run().
+
+	- The idle workers that have not been used for the TTL are destroyed, and so are the workers above the configured size.
+	- The workers handed over by a job are destroyed if they stay idle for "lease.idle.in.minutes", or at the end of their lease,
+	  they are not part of the configured size.
+	- If some jobs ready to run are waiting for capacity, the idle workers of the other flavors are destroyed to give them the weight,
+	  and the pool is not topped up.
+	- Otherwise the missing workers are created in the provisioning pool, as long as there is capacity left.
+
+	Args:
+		now (int, optional): The current date, as a Unix timestamp. Defaults to now.
+	"""
+	if now is None: now = int(time.time())
+	sizes = get_sizes()
+	waiting_flavors = get_waiting_flavors()
+	counts = {}
+	for worker in db.get_warm_workers():
+		# the workers taken over by a job belong to the job
+		if worker["job_id"] is not None: continue
+		flavor = worker["flavor"]
+		if worker["owner"] is not None:
+			if now - worker["ready_at"] > LEASE_IDLE: reason = f"no job of {worker['owner']} has used it for {LEASE_IDLE // 60} minutes"
+			elif now - worker["created_at"] > LEASE_LIFETIME: reason = "its lease has ended"
+			elif len(waiting_flavors) > 0 and flavor not in waiting_flavors: reason = "some jobs are waiting for its weight"
+			else: continue
+			logger.info(f"Evicting the worker '{worker['name']}' because {reason}")
+			evict(worker["name"], worker["volume"])
+			continue
+		counts[flavor] = counts.get(flavor, 0) + 1
+		if worker["status"] != "READY": continue
+		if now - worker["ready_at"] > TTL: reason = f"it has been idle for more than {TTL // 60} minutes"
+		elif counts[flavor] > sizes.get(flavor, 0): reason = "the warm pool is smaller now"
+		elif len(waiting_flavors) > 0 and flavor not in waiting_flavors: reason = "some jobs are waiting for its weight"
+		else: continue
+		logger.info(f"Evicting the warm worker '{worker['name']}' because {reason}")
+		evict(worker["name"], worker["volume"])
+		counts[flavor] -= 1
+	# the jobs are served first
+	if len(waiting_flavors) > 0: return
+	for flavor, size in sizes.items():
+		for _ in range(counts.get(flavor, 0), size):
+			name = f"worker_warm_{now}_{next(WORKER_IDS)}"
+			if not db.add_warm_worker(name, flavor, config.FLAVORS[flavor]['weight'], config.FLAVORS_MAX_WEIGHT): return
+			tasks.PROVISIONING.submit("create_warm_worker", None, create_warm_worker, name, flavor, key = ("create_warm_worker", name))
+
+def destroy_stale_workers():
+	"""
+	Destroys the workers that cannot be trusted when the server starts: the ones that were still booting when the server stopped,
+	and the ones whose job has stopped without destroying them (see db.reconcile_flavor_ledger).
+	"""
+	for worker in db.get_warm_workers():
+		if worker["status"] == "BOOTING": logger.warning(f"The warm worker '{worker['name']}' was not ready when the server stopped, it will be destroyed")
+		elif worker["status"] == "ORPHANED": logger.warning(f"The job that used the worker '{worker['name']}' has stopped, it will be destroyed")
+		else: continue
+		evict(worker["name"], worker["volume"])
+
+def run():
+	"""
+	Main loop of the warm pool daemon. The workers that cannot be trusted are destroyed first (see destroy_stale_workers).
+	"""
+	destroy_stale_workers()
+	while True:
+		try:
+			maintain()
+		except Exception as e:
+			logger.error(f"Cannot maintain the warm pool: {e}")
+		time.sleep(CHECK_INTERVAL)
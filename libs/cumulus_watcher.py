@@ -0,0 +1,225 @@
+# Copyright or © or Copr. Alexandre BUREL for LSMBO / IPHC UMR7178 / CNRS (2025)
+# 
+# [a.burel@unistra.fr]
+# 
+# This software is the server for Cumulus, a client-server to operate jobs on a Cloud.
+# 
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use, 
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info". 
+# 
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability. 
+# 
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or 
+# data to be ensured and,  more generally, to use and operate it in the 
+# same conditions as regards security. 
+# 
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import threading
+import time
+
+import libs.cumulus_config as config
+
+logger = logging.getLogger(__name__)
+
+# the inotify events meaning that a file has been created or written in a job directory
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_ONLYDIR
+# the header of an inotify event: watch descriptor, mask, cookie, length of the name
+EVENT_HEADER = struct.Struct("iIII")
+
+# "inotify" or "polling", None while the watcher is not started
+BACKEND = None
+# set when a watched file has changed, the daemon waits on it between two checks
+EVENT = threading.Event()
+# the watched job directories, with their inotify watch descriptor or the state of their files
+WATCHED = {}
+# the job directories for each inotify watch descriptor
+DIRECTORIES = {}
+WATCH_LOCK = threading.Lock()
+# the inotify file descriptor and the thread reading the events (or the thread polling the files)
+INOTIFY_FD = None
+LIBC = None
+WATCHER = None
+RUNNING = False
+# how often the files are checked by the polling backend, in seconds
+POLLING_INTERVAL = 2
+# the events often come in bursts (ie. the host file and the final file), wait a little to handle them at once
+DEBOUNCE_DELAY = 0.5
+
+def get_watched_files():
+	"""
+	Returns the names of the files that trigger a check of the jobs when they appear in a job directory:
+	the stop file (the job has ended), the host file (the virtual machine has been created) and the final file (all the input files have been sent).
+	"""
+	return [config.JOB_STOP_FILE, config.HOST_FILE, config.get("final.file")]
+
+def start(use_inotify = True):
+	"""
+	Starts watching the job directories, with inotify if it's available, by polling the files otherwise.
+
+	Args:
+		use_inotify (bool, optional): False to use the polling backend even if inotify is available. Defaults to True.
+
+	Returns:
+		str: The name of the backend that has been started.
+	"""
+	global BACKEND, INOTIFY_FD, LIBC, WATCHER, RUNNING
+	stop()
+	RUNNING = True
+	if use_inotify:
+		try:
+			LIBC = ctypes.CDLL(ctypes.util.find_library("c"), use_errno = True)
+			INOTIFY_FD = LIBC.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+			if INOTIFY_FD < 0: raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+			BACKEND = "inotify"
+			WATCHER = threading.Thread(target=read_events, name="cumulus-watcher", daemon=True)
+		except (OSError, AttributeError) as e:
+			# inotify only exists on Linux
+			logger.warning(f"Inotify is not available, the job files will be polled every {POLLING_INTERVAL} seconds: {e}")
+			INOTIFY_FD = None
+	if INOTIFY_FD is None:
+		BACKEND = "polling"
+		WATCHER = threading.Thread(target=poll_files, name="cumulus-watcher", daemon=True)
+	WATCHER.start()
+	logger.info(f"The job directories are watched with {BACKEND}")
+	return BACKEND
+
+def stop():
+	"""
+	Stops watching the job directories.
+	"""
+	global BACKEND, INOTIFY_FD, WATCHER, RUNNING
+	RUNNING = False
+	if WATCHER is not None: WATCHER.join()
+	with WATCH_LOCK:
+		WATCHED.clear()
+		DIRECTORIES.clear()
+	if INOTIFY_FD is not None: os.close(INOTIFY_FD)
+	BACKEND, INOTIFY_FD, WATCHER = None, None, None
+
+def watch(job_dirs):
+	"""
+	Sets the job directories to watch, the directories that are not in the list are not watched anymore.
+	This is called at each check of the jobs, with the directories of the active jobs.
+
+	Args:
+		job_dirs (list[str]): The directories of the jobs to watch.
+	"""
+	if BACKEND is None: return
+	job_dirs = set(job_dirs)
+	with WATCH_LOCK:
+		for job_dir in [job_dir for job_dir in WATCHED if job_dir not in job_dirs]:
+			state = WATCHED.pop(job_dir)
+			if BACKEND == "inotify":
+				DIRECTORIES.pop(state, None)
+				LIBC.inotify_rm_watch(INOTIFY_FD, state)
+		for job_dir in [job_dir for job_dir in job_dirs if job_dir not in WATCHED]:
+			if BACKEND == "polling":
+				WATCHED[job_dir] = get_files_state(job_dir)
+				# the files may have been created before the watch
+				if any(mtime is not None for mtime in WATCHED[job_dir]): EVENT.set()
+				continue
+			# the directory may not be created yet, it will be watched at the next check
+			wd = LIBC.inotify_add_watch(INOTIFY_FD, job_dir.encode(), WATCH_MASK)
+			if wd < 0: continue
+			WATCHED[job_dir] = wd
+			DIRECTORIES[wd] = job_dir
+			# the files may have been created before the watch
+			if any(os.path.exists(f"{job_dir}/{file}") for file in get_watched_files()): EVENT.set()
+
+def wait(timeout):
+	"""
+	Waits until a watched file changes, or until the timeout.
+
+	Args:
+		timeout (float): The maximum time to wait, in seconds.
+
+	Returns:
+		bool: True if a watched file has changed, False if the timeout has been reached.
+	"""
+	changed = EVENT.wait(timeout)
+	if changed: time.sleep(DEBOUNCE_DELAY)
+	EVENT.clear()
+	return changed
+
+def read_events():
+	"""
+	Main loop of the inotify backend, it sets the event when a watched file is created or written.
+	"""
+	watched_files = get_watched_files()
+	while RUNNING:
+		# wake up regularly to know if the watcher has been stopped
+		if len(select.select([INOTIFY_FD], [], [], 1)[0]) == 0: continue
+		try:
+			data = os.read(INOTIFY_FD, 65536)
+		except BlockingIOError:
+			continue
+		offset = 0
+		while offset < len(data):
+			wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+			name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b"\0").decode(errors = "replace")
+			offset += EVENT_HEADER.size + length
+			# some events have been lost, every job has to be checked
+			if mask & IN_Q_OVERFLOW: EVENT.set()
+			elif mask & IN_IGNORED:
+				# the directory has been deleted
+				with WATCH_LOCK:
+					job_dir = DIRECTORIES.pop(wd, None)
+					if job_dir is not None: WATCHED.pop(job_dir, None)
+			elif name in watched_files:
+				logger.debug(f"File {name} has changed in {DIRECTORIES.get(wd)}")
+				EVENT.set()
+
+def get_files_state(job_dir):
+	"""
+	Returns the modification time of each watched file of a job directory (None if the file does not exist).
+	"""
+	state = []
+	for file in get_watched_files():
+		try:
+			state.append(os.stat(f"{job_dir}/{file}").st_mtime_ns)
+		except OSError:
+			state.append(None)
+	return state
+
+def poll_files():
+	"""
+	Main loop of the polling backend, it sets the event when a watched file has been created or modified since the last poll.
+	"""
+	while RUNNING:
+		with WATCH_LOCK: job_dirs = list(WATCHED)
+		for job_dir in job_dirs:
+			state = get_files_state(job_dir)
+			with WATCH_LOCK:
+				if job_dir not in WATCHED or WATCHED[job_dir] == state: continue
+				WATCHED[job_dir] = state
+			logger.debug(f"A watched file has changed in {job_dir}")
+			EVENT.set()
+		time.sleep(POLLING_INTERVAL)
@@ -0,0 +1,130 @@
+# Copyright or © or Copr. Alexandre BUREL for LSMBO / IPHC UMR7178 / CNRS (2025)
+# 
+# [a.burel@unistra.fr]
+# 
+# This software is the server for Cumulus, a client-server to operate jobs on a Cloud.
+# 
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use, 
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info". 
+# 
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability. 
+# 
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or 
+# data to be ensured and,  more generally, to use and operate it in the 
+# same conditions as regards security. 
+# 
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+import libs.cumulus_backends as backends
+import libs.cumulus_config as config
+import libs.cumulus_database as db
+import os
+import pytest
+import threading
+
+@pytest.fixture(params = ["sqlite", "memory"])
+def backend(request):
+    # the SQLite backend uses its own database, so that the other tests are not disturbed
+    db_path = config.get("database.file.path")
+    test_path = "./test/backends.db"
+    for file in [test_path, test_path + "-wal", test_path + "-shm"]:
+        if os.path.isfile(file): os.remove(file)
+    config.CONFIG["database.file.path"] = test_path
+    db.initialize_database()
+    yield backends.get_backend(request.param)
+    # the backfills of the new database must be over before it is deleted
+    if db.BACKFILLER is not None: db.BACKFILLER.join()
+    config.CONFIG["database.file.path"] = db_path
+    db.forget_workflows()
+    db.close_connections()
+    for file in [test_path, test_path + "-wal", test_path + "-shm"]:
+        if os.path.isfile(file): os.remove(file)
+
+def create_job(backend, owner = "test.user", description = "", start_after_id = None):
+    form = {"username": owner, "app_name": "diann_2.0", "strategy": "first_available", "description": description, "settings": "{\"key\": \"value\"}"}
+    if start_after_id is not None: form["start_after_id"] = start_after_id
+    return backend.create_job(form)[0]
+
+def test_get_backend():
+    assert isinstance(backends.get_backend(), backends.SQLiteBackend)
+    with pytest.raises(ValueError):
+        backends.get_backend("oracle")
+    # the interface cannot be used as it is, and the server always stores the jobs in SQLite
+    with pytest.raises(TypeError):
+        backends.JobBackend()
+    assert isinstance(backends.STORAGE, backends.SQLiteBackend)
+
+def test_jobs(backend):
+    job_id1 = create_job(backend)
+    job_id2 = create_job(backend)
+    job = backend.get_job(job_id1)
+    assert job.owner == "test.user"
+    assert job.status == "PENDING"
+    assert job.settings == {"key": "value"}
+    assert job.job_dir.endswith(f"/Job_{job_id1}_test.user_diann_2.0_{job.creation_date}")
+    assert backend.get_job(job_id2 + 1) == None
+    assert backend.get_value(job_id2 + 1, "status") == ""
+    # the lists per status follow the changes of status
+    backend.set_status(job_id1, "RUNNING")
+    assert backend.get_status(job_id1) == "RUNNING"
+    assert backend.get_jobs_per_status("PENDING") == [job_id2]
+    assert backend.get_jobs_per_status("RUNNING") == [job_id1]
+    assert [job.id for job in backend.get_job_records(["RUNNING", "PENDING"])] == [job_id1, job_id2]
+    assert [job.id for job in backend.get_jobs([job_id2, job_id1, job_id2 + 1])] == [job_id1, job_id2]
+    # the records are not shared with the backend
+    job.status = "DONE"
+    assert backend.get_job(job_id1).status == "RUNNING"
+
+def test_workflows(backend):
+    job_id1 = create_job(backend)
+    job_id2 = create_job(backend, start_after_id = job_id1)
+    job_id3 = create_job(backend, start_after_id = job_id2)
+    job_id4 = create_job(backend)
+    for job_id in [job_id1, job_id2, job_id3]:
+        assert backend.get_associated_jobs(job_id) == [job_id1, job_id2, job_id3]
+    assert backend.get_associated_jobs(job_id4) == [job_id4]
+    # the whole workflow is deleted
+    backend.delete_job(job_id2)
+    assert backend.get_jobs([job_id1, job_id2, job_id3, job_id4])[0].id == job_id4
+    assert backend.get_jobs_per_status("PENDING") == [job_id4]
+
+def test_search(backend):
+    job_id1 = create_job(backend, "alice", "proteome run")
+    job_id2 = create_job(backend, "bob", "proteome run")
+    job_id3 = create_job(backend, "bob", "other run")
+    backend.set_status(job_id3, "DONE")
+    assert backend.search("proteome") == [job_id2, job_id1]
+    assert backend.search("proteome", owner = "alice") == [job_id1]
+    assert backend.search("run bob") == [job_id3, job_id2]
+    assert backend.search("run", statuses = ["DONE"]) == [job_id3]
+    assert backend.search(app_name = "diann", number = 2) == [job_id3, job_id2]
+    assert backend.search("sage") == []
+
+def test_memory_backend_threads():
+    backend = backends.get_backend("memory")
+    # the jobs are created and updated by several threads at once
+    def run():
+        for i in range(50):
+            job_id = create_job(backend)
+            backend.set_status(job_id, "RUNNING" if job_id % 2 == 0 else "FAILED")
+    threads = [threading.Thread(target=run) for i in range(4)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    assert len(backend.get_jobs_per_status("RUNNING")) == 100
+    assert len(backend.get_jobs_per_status("FAILED")) == 100
+    assert backend.get_jobs_per_status("PENDING") == []
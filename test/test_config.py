@@ -31,6 +31,7 @@
 # knowledge of the CeCILL license and that you accept its terms.
 
 import libs.cumulus_config as config
+import pytest
 
 def test_load():
 	config.load("test/cumulus.conf")
@@ -38,6 +39,11 @@ def test_load():
 
 def test_get():
 	assert config.get("database.file.path") == "./test/cumulus.db"
+	# the optional keys have a default value
+	assert config.get("database.file.path", "cumulus.db") == "./test/cumulus.db"
+	assert config.get("liveness.check.threads", "8") == "8"
+	with pytest.raises(KeyError):
+		config.get("liveness.check.threads")
 
 def test_init():
 	config.init(False)
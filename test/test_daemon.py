@@ -0,0 +1,104 @@
+# Copyright or © or Copr. Alexandre BUREL for LSMBO / IPHC UMR7178 / CNRS (2025)
+# 
+# [a.burel@unistra.fr]
+# 
+# This software is the server for Cumulus, a client-server to operate jobs on a Cloud.
+# 
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use, 
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info". 
+# 
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability. 
+# 
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or 
+# data to be ensured and,  more generally, to use and operate it in the 
+# same conditions as regards security. 
+# 
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+import libs.cumulus_apps as apps
+import libs.cumulus_config as config
+import libs.cumulus_daemon as daemon
+import libs.cumulus_database as db
+import libs.cumulus_readiness as readiness
+import libs.cumulus_tasks as tasks
+import libs.cumulus_utils as utils
+import os
+import pytest
+
+@pytest.fixture
+def worker(monkeypatch):
+    """
+    Replaces the creation of the workers and the remote calls, returns the workers started and destroyed.
+    """
+    # a single thread to create the workers and start the jobs
+    monkeypatch.setattr(tasks, "PROVISIONING", tasks.TaskPool("test-provisioning", 1))
+    monkeypatch.setattr(tasks, "TEARDOWN", tasks.TaskPool("test-teardown", 1))
+    monkeypatch.setattr(daemon, "SPECULATIVE", {})
+    events = {"started": [], "destroyed": []}
+    monkeypatch.setattr(apps, "link_shared_files", lambda *args: None)
+    monkeypatch.setattr(apps, "generate_script_content", lambda job_id, job_dir, *args: (f"{job_dir}/script.sh", ""))
+    monkeypatch.setattr(apps, "get_files", lambda job_dir, *args: [f"{job_dir}/input.raw"])
+    monkeypatch.setattr(db, "take_warm_worker", lambda job_id: None)
+    monkeypatch.setattr(db, "delete_warm_worker", lambda name: None)
+    monkeypatch.setattr(utils, "create_worker", lambda job_id, job_dir, flavor: utils.write_host_file(job_dir, f"worker_job_{job_id}", "10.0.0.1", 4, 16, f"volume_job_{job_id}", None))
+    monkeypatch.setattr(utils, "add_to_stdalt", lambda *args: None)
+    monkeypatch.setattr(utils, "remote_script", lambda host, cmd: events["started"].append(host.name))
+    monkeypatch.setattr(utils, "delete_worker", lambda name, volume: events["destroyed"].append(name))
+    yield events
+    for job_id in list(readiness.WAITING): readiness.cancel(job_id)
+
+def start(tmp_path, job_id, ready):
+    job_dir = tmp_path / f"job_{job_id}"
+    job_dir.mkdir()
+    if ready:
+        (job_dir / apps.FINAL_FILE).write_text("")
+        (job_dir / "input.raw").write_text("raw")
+    tasks.PROVISIONING.submit("start_job", job_id, daemon.start_job, job_id, str(job_dir), "app", {}, "small", f"job {job_id}")
+    return job_dir
+
+def test_waiting_jobs_release_the_threads(worker, tmp_path):
+    # more jobs wait for their files than there are threads to create the workers
+    waiting = [start(tmp_path, job_id, False) for job_id in [1, 2, 3]]
+    job_dir = start(tmp_path, 4, True)
+    assert tasks.PROVISIONING.wait(5)
+    # the job whose files are ready is started, the other ones have their worker and wait without a thread
+    assert worker["started"] == ["worker_job_4"]
+    assert readiness.get_waiting() == {job_id: [f"{waiting[job_id - 1]}/{apps.FINAL_FILE}", f"{waiting[job_id - 1]}/input.raw"] for job_id in [1, 2, 3]}
+    assert all(os.path.exists(f"{job_dir}/{config.HOST_FILE}") for job_dir in waiting)
+    # the job is started when the daemon sees its files
+    (waiting[1] / apps.FINAL_FILE).write_text("")
+    (waiting[1] / "input.raw").write_text("raw")
+    readiness.refresh([1, 2, 3])
+    assert tasks.PROVISIONING.wait(5)
+    assert worker["started"] == ["worker_job_4", "worker_job_2"]
+    assert list(readiness.get_waiting()) == [1, 3]
+
+def test_release_speculative_worker(worker, tmp_path):
+    daemon.SPECULATIVE[1] = 0
+    job_dir = start(tmp_path, 1, False)
+    start(tmp_path, 2, False)
+    assert tasks.PROVISIONING.wait(5)
+    # the job has gone back to PENDING, its worker is destroyed and its host file removed before it can be scheduled again
+    readiness.refresh([2])
+    assert tasks.TEARDOWN.wait(5)
+    assert worker["destroyed"] == ["worker_job_1"]
+    assert not os.path.exists(f"{job_dir}/{config.HOST_FILE}")
+    assert daemon.SPECULATIVE == {}
+    # the worker of a job that is not speculative is destroyed when the job ends
+    readiness.cancel(2)
+    assert worker["destroyed"] == ["worker_job_1"]
+    assert worker["started"] == []
@@ -30,17 +30,24 @@
 # The fact that you are presently reading this means that you have had
 # knowledge of the CeCILL license and that you accept its terms.
 
+import libs.cumulus_apps as apps
 import libs.cumulus_config as config
 import libs.cumulus_database as db
 import json
 import os
+import pytest
 import re
+import sqlite3
+import threading
+import time
 
 def test_db_connect():
     # get the test database file path
     db_path = config.get("database.file.path")
-    # the database should not exist yet
-    if os.path.isfile(db_path): os.remove(db_path)
+    # the database should not exist yet (the connections of the previous tests point to the file)
+    db.close_connections()
+    for file in [db_path, db_path + "-wal", db_path + "-shm"]:
+        if os.path.isfile(file): os.remove(file)
     # connect to the database
     cnx, _ = db.connect()
     # the database should now exist
@@ -48,6 +55,30 @@ def test_db_connect():
     # close the database (the file will not be deleted)
     cnx.close()
 
+def test_connection_pool():
+    # the same thread always gets the same connection
+    cnx1, _ = db.connect()
+    cnx2, _ = db.connect()
+    assert cnx1 is cnx2
+    # another thread gets its own connection
+    other = []
+    thread = threading.Thread(target=lambda: other.append(db.connect()[0]))
+    thread.start()
+    thread.join()
+    assert other[0] is not cnx1
+    # a closed connection is replaced by a new one
+    cnx1.close()
+    cnx3, cursor = db.connect()
+    assert cnx3 is not cnx1
+    cursor.execute("SELECT 1")
+    assert cursor.fetchone()[0] == 1
+    # a discarded connection is closed and leaves the pool
+    db.discard_connection()
+    assert cnx3 not in db.POOL_CONNECTIONS.values()
+    with pytest.raises(sqlite3.ProgrammingError):
+        cnx3.execute("SELECT 1")
+    assert db.connect()[0] in db.POOL_CONNECTIONS.values()
+
 def test_initialize_database():
     db.initialize_database()
     cnx, cursor = db.connect()
@@ -57,7 +88,29 @@ def test_initialize_database():
     cnx.close()
     assert nb == 16  # check that the table has 16 columns
 
+def test_query_plans():
+    # the queries run by the daemons every few seconds must never scan the whole jobs table
+    queries = [
+        (db.SQL_JOBS_PER_STATUS, ("PENDING",)),
+        (db.SQL_WORKFLOW, (1,)),
+        (db.SQL_ENDED_JOBS_OLDER_THAN, (86400,)),
+        (db.SQL_FILE_IN_USE, ("file.mzML",)),
+        (db.SQL_RUNNING_STRATEGIES, ()),
+        (db.SQL_SNAPSHOT, ()),
+        (db.SQL_RUNTIME_ESTIMATES, ()),
+        (db.SQL_JOBS_ENDED_BETWEEN, (0, 100)),
+        (f"SELECT {db.JobRecord.COLUMNS} FROM jobs WHERE status IN (?, ?) ORDER BY id ASC", ("PENDING", "PREPARING")),
+        ("UPDATE jobs SET status = 'PAUSED' WHERE status = 'PREPARING'", ()),
+        # the job list reads the jobs backwards from the cursor, and stops when the page is full
+        (db.SQL_LIST_JOBS.format(table = "jobs", filters = "AND (status = 'PENDING' OR status = 'RUNNING') AND creation_date >= 0"), (db.MAX_JOB_ID, "%user%", "%", "%", 101))
+    ]
+    for sql, params in queries:
+        for detail in db.get_query_plan(sql, params):
+            assert re.search("^SCAN (TABLE )?jobs", detail) == None, f"{detail} in plan of: {sql}"
+
 def test_create_job():
+    # the apps are needed to record the input files of the jobs
+    apps.get_app_list("test/apps")
     # get settings as text
     settings = ""
     with open("test/jobs/job1.settings", 'r') as xml:
@@ -85,8 +138,14 @@ def test_get_associated_jobs():
     with open("test/jobs/job1.settings", 'r') as xml: settings = xml.read().replace("\n", "")
     job_id1 = 1
     job_id2, _ = db.create_job({"username": "test.user", "app_name": "alphadia_1.10.1", "strategy": "first_available", "description": "", "settings": settings, "start_after_id": job_id1 })
+    # the workflow is cached here
+    assert db.get_associated_jobs(job_id2) == [job_id1, job_id2]
+    # and the cache is updated when a job is added to the workflow
     job_id3, _ = db.create_job({"username": "test.user", "app_name": "sage_0.15.0-beta.1", "strategy": "first_available", "description": "", "settings": settings, "start_after_id": job_id2 })
     assert db.get_associated_jobs(1) == [job_id1, job_id2, job_id3]
+    # the workflow is the same from any of its jobs
+    assert db.get_associated_jobs(job_id3) == [job_id1, job_id2, job_id3]
+    assert db.get_workflow_parent_id(job_id3) == job_id1
 
 def test_get_value():
     assert db.get_value(1, "strategy") == "first_available"
@@ -95,6 +154,35 @@ def test_set_value():
     db.set_value(1, "strategy", "best_cpu")
     assert db.get_value(1, "strategy") == "best_cpu"
 
+def test_write_behind():
+    # the database is in WAL mode
+    _, cursor = db.connect()
+    cursor.execute("PRAGMA journal_mode")
+    assert cursor.fetchone()[0] == "wal"
+    # concurrent writes are all committed by the writer thread
+    threads = [threading.Thread(target=db.set_last_modified, args=(id, 1000 + id)) for id in range(1, 6)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    db.flush()
+    assert [db.get_last_modified(id) for id in range(1, 6)] == [1001, 1002, 1003, 1004, 1005]
+
+def test_write_failure():
+    # a failing task gets its error, the other tasks of the batch are committed
+    def fail(cursor): raise ValueError("failure")
+    db.write(fail, False)
+    with pytest.raises(ValueError):
+        db.write(fail)
+    # if the database cannot be opened, the callers get an error instead of waiting forever
+    db_path = config.get("database.file.path")
+    try:
+        config.CONFIG["database.file.path"] = "./test/does_not_exist/cumulus.db"
+        with pytest.raises(sqlite3.OperationalError):
+            db.write(lambda cursor: cursor.execute("SELECT 1"))
+    finally:
+        config.CONFIG["database.file.path"] = db_path
+    # and the writer is still alive
+    assert db.write(lambda cursor: cursor.execute("SELECT 1").fetchone()[0]) == 1
+
 def test_get_status():
     assert db.get_status(1) == "PENDING"
 
@@ -152,6 +240,18 @@ def test_check_job_existency():
 def test_get_job_to_string():
     assert db.get_job_to_string(1) == "Workflow job 1, owner:test.user, app:diann_2.0, status:FAILED, strategy:best_ram"
 
+def test_get_job():
+    job = db.get_job(1)
+    assert job.owner == "test.user"
+    assert job.status == "FAILED"
+    assert job.settings == db.get_settings(1)
+    assert str(job) == db.get_job_to_string(1)
+    assert db.get_job(99) is None
+
+def test_get_job_records():
+    assert [job.id for job in db.get_job_records(["PENDING", "FAILED"])] == [1, 2, 3, 4, 5, 6, 7]
+    assert [job.id for job in db.get_jobs([3, 2])] == [2, 3]
+
 # this function is commented because it gave inconsistent results when pytest is called repeatedly
 # def test_get_last_jobs():
 #     jobs = db.get_last_jobs(1)
@@ -166,6 +266,56 @@ def test_search_jobs():
     assert len(jobs) == 1
     assert jobs[0]["id"] == 1
 
+def test_get_jobs_page():
+    # read the seven jobs by pages of three
+    page = db.get_jobs_page(1, 3)
+    assert [job["id"] for job in page["jobs"]] == [7, 6, 5]
+    page = db.get_jobs_page(1, 3, page["cursor"])
+    assert [job["id"] for job in page["jobs"]] == [4, 3, 2]
+    page = db.get_jobs_page(1, 3, page["cursor"])
+    assert [job["id"] for job in page["jobs"]] == [1]
+    assert page["cursor"] is None
+    assert "strategy" in page["jobs"][0]
+    with pytest.raises(ValueError):
+        db.get_jobs_page(1, 3, "not a cursor")
+    # the page size must be at least 1
+    with pytest.raises(ValueError):
+        db.get_jobs_page(1, 0, "")
+    assert db.list_jobs_page(1, 0) == ([], None)
+    # the search can also be paginated
+    form = {"current_job_id": 1, "owner": "test.user", "app": "", "description": "", "number": "", "pending": "on", "date": "creation_date", "from": "", "to": "", "file": "", "page_size": "4"}
+    page = db.search_jobs(form)
+    assert [job["id"] for job in page["jobs"]] == [7, 6, 5, 4]
+    page = db.search_jobs(dict(form, cursor = page["cursor"]))
+    assert [job["id"] for job in page["jobs"]] == [3, 2]
+    assert page["cursor"] is None
+    for page_size in ["0", "-1", "two"]:
+        with pytest.raises(ValueError):
+            db.search_jobs(dict(form, page_size = page_size))
+
+def test_search_jobs_by_file():
+    form = {"current_job_id": 1, "owner": "", "app": "", "description": "", "number": "", "date": "creation_date", "from": "", "to": "", "file": "AT2378"}
+    # jobs 6 and 7 use apps that are not in the test apps, so their input files are unknown
+    assert [job["id"] for job in db.search_jobs(form)] == [5, 4, 3, 2, 1]
+    assert db.search_jobs(dict(form, file = "AT2394")) == []
+    # the raw files are converted to mzML, but they can still be searched with the name they were sent with
+    assert [job["id"] for job in db.search_jobs(dict(form, file = "AT2377PAP.raw"))] == [5, 4, 3, 2, 1]
+    assert [job["id"] for job in db.search_jobs(dict(form, file = "AT2377PAP.mzML"))] == [5, 4, 3, 2, 1]
+
+def test_search_jobs_fulltext():
+    form = {"current_job_id": 1, "owner": "", "app": "", "description": "", "number": "", "date": "creation_date", "from": "", "to": "", "file": "", "text": "alphadia"}
+    assert db.FTS_ENABLED
+    assert [job["id"] for job in db.search_jobs(form)] == [6]
+    # all the words must be found, in any of the fields
+    assert [job["id"] for job in db.search_jobs(dict(form, text = "user diann"))] == [5, 4, 3, 2, 1]
+    assert [job["id"] for job in db.search_jobs(dict(form, text = "sage 2.0"))] == []
+    assert [job["id"] for job in db.search_jobs(dict(form, text = "sage .1"))] == [7]
+    # the other filters still apply
+    assert [job["id"] for job in db.search_jobs(dict(form, text = "diann", failed = "on"))] == [1]
+    assert [job["id"] for job in db.search_jobs(dict(form, text = "diann", owner = "someone.else"))] == []
+    assert [job["id"] for job in db.search_jobs(dict(form, text = "diann", owner = "test"))] == [5, 4, 3, 2, 1]
+    assert [job["id"] for job in db.search_jobs(dict(form, text = "user", app = "sage"))] == [7]
+
 def test_get_jobs_per_status():
     assert db.get_jobs_per_status("PENDING") == [2, 3, 4, 5, 6, 7]
     assert db.get_jobs_per_status("FAILED") == [1]
@@ -178,6 +328,32 @@ def test_delete_job():
     db.delete_job(4)
     assert not db.check_job_existency(4)
 
+def test_get_changes():
+    # the first call returns every job still in the journal
+    changes = db.get_changes(0)
+    assert changes["reset"] == False
+    assert [job["id"] for job in changes["jobs"]] == [7, 6, 5, 3, 2, 1]
+    assert changes["deleted"] == [4]
+    # nothing has changed since then
+    seq = changes["seq"]
+    assert db.get_changes(seq) == {"seq": seq, "jobs": [], "deleted": [], "reset": False}
+    # only the status and dates are journaled
+    db.set_last_modified(2, 1234)
+    db.flush()
+    assert db.get_changes(seq)["jobs"] == []
+    db.set_status(2, "PENDING")
+    assert db.get_changes(seq)["jobs"] == []
+    db.set_status(3, "RUNNING")
+    changes = db.get_changes(seq, 3)
+    assert [job["id"] for job in changes["jobs"]] == [3]
+    assert changes["jobs"][0]["status"] == "RUNNING"
+    assert "settings" in changes["jobs"][0]
+    db.set_status(3, "PENDING")
+    # the clients must reload everything if they missed some events
+    assert db.delete_events_older_than(-1) > 0
+    assert db.get_changes(seq)["reset"] == True
+    assert db.get_changes(db.get_changes(0)["seq"])["reset"] == False
+
 def test_get_ended_jobs_older_than():
     db.set_fake_creation_date(1)
     assert len(db.get_ended_jobs_older_than(80000)) == 1
@@ -185,3 +361,261 @@ def test_get_ended_jobs_older_than():
 def test_is_file_in_use():
     assert db.is_file_in_use("./test/data/AT2378PAP.mzML") == True
     assert db.is_file_in_use("./test/data/AT2378PAP.raw") == False
+
+def test_archive_workflow():
+    form = {"username": "test.user", "app_name": "diann_2.0", "strategy": "first_available", "description": "archive", "settings": "{}"}
+    job_id1, _ = db.create_job(form)
+    job_id2, _ = db.create_job(dict(form, start_after_id = job_id1))
+    # a workflow that is not over cannot be archived
+    db.set_status(job_id1, "DONE")
+    assert db.archive_workflow(job_id1) == []
+    db.set_status(job_id2, "FAILED")
+    assert db.archive_workflow(job_id2) == [job_id1, job_id2]
+    # the archived jobs are not in the live table anymore, but they can still be read
+    assert job_id1 not in db.get_jobs_per_status("ARCHIVED_DONE")
+    assert db.get_job(job_id1).status == "ARCHIVED_DONE"
+    assert db.get_status(job_id2) == "ARCHIVED_FAILED"
+    assert db.check_job_existency(job_id2)
+    assert db.get_associated_jobs(job_id2) == [job_id1, job_id2]
+    # they are only listed if the archived jobs are requested
+    form = {"current_job_id": 1, "owner": "", "app": "", "description": "archive", "number": "", "date": "creation_date", "from": "", "to": "", "file": ""}
+    assert db.search_jobs(form) == []
+    assert [job["id"] for job in db.search_jobs(dict(form, archived = "on"))] == [job_id2, job_id1]
+    assert [job["id"] for job in db.search_jobs(dict(form, archived = "on", failed = "on"))] == [job_id2, job_id1]
+    # and they can still be deleted
+    db.delete_job(job_id1)
+    assert not db.check_job_existency(job_id2)
+
+def test_flavor_ledger():
+    form = {"username": "test.user", "app_name": "diann_2.0", "strategy": "m1.8xlarge-16xmem", "description": "ledger", "settings": "{}"}
+    job_ids = [db.create_job(form)[0] for i in range(6)]
+    reserved = db.get_reserved_weight()
+    # the jobs compete for 4 units of weight, only two of them can get a flavor of weight 2
+    threads = [threading.Thread(target=db.reserve_flavor, args=(job_id, "m1.8xlarge-16xmem", 2, reserved + 4)) for job_id in job_ids]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    preparing = [job_id for job_id in job_ids if db.get_status(job_id) == "PREPARING"]
+    assert len(preparing) == 2
+    assert db.get_reserved_weight() == reserved + 4
+    # a job cannot be reserved twice
+    assert db.reserve_flavor(preparing[0], "m1.8xlarge-16xmem", 2, reserved + 10) == False
+    # the reservation is kept while the job runs or is paused, and released when it ends
+    db.set_status(preparing[0], "PAUSED")
+    assert db.get_reserved_flavor(preparing[0]) == "m1.8xlarge-16xmem"
+    db.set_status(preparing[0], "RUNNING")
+    assert db.get_reserved_weight() == reserved + 4
+    db.set_status(preparing[0], "DONE")
+    assert db.get_reserved_flavor(preparing[0]) == None
+    assert db.get_reserved_weight() == reserved + 2
+    # the ledger is rebuilt from the active jobs when the database is initialized
+    db.write(lambda cursor: cursor.execute("DELETE FROM flavor_ledger"))
+    db.initialize_database()
+    assert db.get_reserved_flavor(preparing[1]) == "m1.8xlarge-16xmem"
+    # and a deleted job releases its reservation
+    for job_id in job_ids: db.delete_job(job_id)
+    assert db.get_reserved_weight() == reserved
+
+def test_warm_workers():
+    form = {"username": "test.user", "app_name": "diann_2.0", "strategy": "m1.4xlarge", "description": "warm", "settings": "{}"}
+    job_id1, _ = db.create_job(form)
+    job_id2, _ = db.create_job(form)
+    reserved = db.get_reserved_weight()
+    # the warm workers reserve their weight from the moment they are created
+    assert db.add_warm_worker("warm_1", "m1.4xlarge", 1, reserved + 2)
+    assert db.add_warm_worker("warm_2", "m1.8xlarge-16xmem", 2, reserved + 2) == False
+    assert db.get_reserved_weight() == reserved + 1
+    # a booting worker cannot be taken over, the job needs its own weight
+    assert db.reserve_flavor(job_id1, "m1.4xlarge", 1, reserved + 1) == False
+    db.set_warm_worker_ready("warm_1", "10.0.0.1", "volume_warm_1")
+    # a ready one is taken over with its weight
+    assert db.reserve_flavor(job_id1, "m1.4xlarge", 1, reserved + 1)
+    assert db.get_reserved_weight() == reserved + 1
+    assert db.get_warm_workers()[0]["job_id"] == job_id1
+    assert db.delete_warm_worker("warm_1", True) == False
+    assert db.take_warm_worker(job_id2) == None
+    assert db.take_warm_worker(job_id1) == {"name": "warm_1", "flavor": "m1.4xlarge", "address": "10.0.0.1", "volume": "volume_warm_1"}
+    # the worker is leased to the job until it is destroyed, its weight is reserved by the job
+    assert [(worker["status"], worker["job_id"]) for worker in db.get_warm_workers()] == [("LEASED", job_id1)]
+    assert db.get_reserved_weight() == reserved + 1
+    db.delete_warm_worker("warm_1")
+    # a worker taken over by a job that has stopped is idle again at the next start
+    db.add_warm_worker("warm_3", "m1.4xlarge", 1, reserved + 10)
+    db.set_warm_worker_ready("warm_3", "10.0.0.3", "volume_warm_3")
+    assert db.reserve_flavor(job_id2, "m1.4xlarge", 1, reserved + 10)
+    db.set_status(job_id2, "CANCELLED")
+    db.initialize_database()
+    assert db.get_warm_workers()[0]["job_id"] == None
+    assert db.delete_warm_worker("warm_3", True)
+    # a worker leased by a job that has stopped is kept, with its weight, until the warm pool destroys it
+    db.add_warm_worker("warm_4", "m1.4xlarge", 1, reserved + 10)
+    db.set_warm_worker_ready("warm_4", "10.0.0.4", "volume_warm_4")
+    db.set_status(job_id2, "PENDING")
+    assert db.reserve_flavor(job_id2, "m1.4xlarge", 1, reserved + 10)
+    assert db.take_warm_worker(job_id2)["name"] == "warm_4"
+    db.set_status(job_id2, "DONE")
+    db.initialize_database()
+    assert [(worker["status"], worker["job_id"]) for worker in db.get_warm_workers()] == [("ORPHANED", None)]
+    # job 1 still reserves its own weight
+    assert db.get_reserved_weight() == reserved + 2
+    assert db.delete_warm_worker("warm_4", True)
+    for job_id in [job_id1, job_id2]: db.delete_job(job_id)
+    assert db.get_reserved_weight() == reserved
+
+def test_release_worker():
+    form = {"username": "test.user", "app_name": "diann_2.0", "strategy": "m1.4xlarge", "description": "lease", "settings": "{}"}
+    job_id1, _ = db.create_job(form)
+    job_id2, _ = db.create_job(dict(form, start_after_id = job_id1))
+    job_id3, _ = db.create_job(dict(form, username = "other.user"))
+    reserved = db.get_reserved_weight()
+    assert db.reserve_flavor(job_id1, "m1.4xlarge", 1, reserved + 1)
+    # a lease older than the maximum lifetime is not handed over
+    assert db.release_worker(job_id1, "worker_job_1", "m1.4xlarge", 1, "10.0.0.1", "volume_job_1", "test.user", "diann_2.0", int(time.time()) - 100, 60) == False
+    # otherwise the weight of the job moves to the worker
+    assert db.release_worker(job_id1, "worker_job_1", "m1.4xlarge", 1, "10.0.0.1", "volume_job_1", "test.user", "diann_2.0", int(time.time()), 60)
+    db.set_status(job_id1, "DONE")
+    assert db.get_reserved_weight() == reserved + 1
+    worker = db.get_warm_workers()[0]
+    assert (worker["status"], worker["job_id"], worker["owner"], worker["previous_job_id"]) == ("READY", None, "test.user", job_id1)
+    # the jobs of other owners cannot take it over, they need their own weight
+    assert db.reserve_flavor(job_id3, "m1.4xlarge", 1, reserved + 1) == False
+    assert db.reserve_flavor(job_id2, "m1.4xlarge", 1, reserved + 1)
+    assert db.take_warm_worker(job_id2)["name"] == "worker_job_1"
+    # the lease goes on with the same start
+    assert db.release_worker(job_id2, "worker_job_1", "m1.4xlarge", 1, "10.0.0.1", "volume_job_1", "test.user", "diann_2.0", 0, 60)
+    assert db.get_warm_workers()[0]["previous_job_id"] == job_id2
+    assert db.delete_warm_worker("worker_job_1", True)
+    for job_id in [job_id1, job_id3]: db.delete_job(job_id)
+    assert db.get_reserved_weight() == reserved
+
+def test_apply_transitions():
+    form = {"username": "test.user", "app_name": "diann_2.0", "strategy": "first_available", "description": "transitions", "settings": "{}"}
+    job_id1, _ = db.create_job(form)
+    job_id2, _ = db.create_job(dict(form, start_after_id = job_id1))
+    job_id3, _ = db.create_job(form)
+    # the changes are committed together, the end date is set to the whole workflow
+    db.apply_transitions([(job_id2, "DONE", "end_date"), (job_id3, "RUNNING", "start_date")])
+    assert db.get_status(job_id2) == "DONE"
+    assert db.get_value(job_id1, "end_date") == db.get_value(job_id2, "end_date") > 0
+    assert db.get_status(job_id3) == "RUNNING"
+    assert db.get_value(job_id3, "start_date") > 0
+    assert db.get_value(job_id3, "end_date") == None
+    db.delete_job(job_id1)
+    db.delete_job(job_id3)
+
+def test_get_snapshot():
+    form = {"username": "test.user", "app_name": "diann_2.0", "strategy": "m1.8xlarge-16xmem", "description": "snapshot", "settings": "{}"}
+    job_id1, _ = db.create_job(form)
+    job_id2, _ = db.create_job(dict(form, start_after_id = job_id1))
+    db.set_status(job_id1, "DONE")
+    assert db.reserve_flavor(job_id2, "m1.8xlarge-16xmem", 2, 100)
+    # every active job is loaded with a single query, with the weight reserved
+    cnx, _ = db.connect()
+    queries = []
+    cnx.set_trace_callback(queries.append)
+    snapshot = db.get_snapshot()
+    cnx.set_trace_callback(None)
+    assert len(queries) == 1
+    assert snapshot.reserved_weight == db.get_reserved_weight()
+    assert snapshot.weights[job_id2] == 2
+    assert job_id2 in [job.id for job in snapshot.get_jobs(["PREPARING"])]
+    assert [job.id for job in snapshot.get_jobs(["PENDING", "PREPARING", "RUNNING", "PAUSED"])] == sorted(snapshot.jobs)
+    assert job_id1 not in snapshot.jobs
+    # the jobs of a workflow that are over are loaded when they are needed
+    assert [job.id for job in snapshot.get_workflow(job_id2)] == [job_id1, job_id2]
+    assert snapshot.jobs[job_id1].status == "DONE"
+    db.delete_job(job_id1)
+
+def test_get_runtime_estimates():
+    form = {"username": "test.user", "app_name": "estimated_app", "strategy": "m1.4xlarge", "description": "estimate", "settings": "{}"}
+    job_ids = [db.create_job(form)[0] for _ in range(3)]
+    # only the successful jobs are considered
+    for job_id, status, duration in zip(job_ids, ["DONE", "DONE", "FAILED"], [100, 300, 10]):
+        db.set_status(job_id, status)
+        db.set_value(job_id, "start_date", 1000)
+        db.set_value(job_id, "end_date", 1000 + duration)
+    assert db.get_runtime_estimates()["estimated_app"] == 200
+    for job_id in job_ids: db.delete_job(job_id)
+    assert "estimated_app" not in db.get_runtime_estimates()
+
+def test_maintain_database():
+    # the first maintenance allows the incremental vacuum and computes the statistics of the query planner
+    db.maintain_database()
+    assert db.write(lambda cursor: cursor.execute("PRAGMA auto_vacuum").fetchone()[0]) == 2
+    cnx, cursor = db.connect()
+    assert cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone()[0] == 1
+    # the space used by the deleted jobs is given back by the next one
+    form = {"username": "test.user", "app_name": "diann_2.0", "strategy": "first_available", "description": "maintenance", "settings": "{}"}
+    job_ids = [db.create_job(dict(form, description = str(i) * 100000))[0] for i in range(5)]
+    for job_id in job_ids: db.delete_job(job_id)
+    assert db.get_database_status()["free_pages"] > 0
+    report = db.maintain_database()
+    assert report["freed_pages"] > 0
+    assert report["checkpoint"][0] == 0
+    status = db.get_database_status()
+    assert status["free_pages"] == 0
+    assert status["last_maintenance"] == report
+    # the other writes go on after the maintenance
+    assert db.write(lambda cursor: cursor.execute("SELECT 1").fetchone()[0]) == 1
+
+def test_nested_write():
+    form = {"username": "test.user", "app_name": "diann_2.0", "strategy": "first_available", "description": "", "settings": "{}"}
+    job_id, _ = db.create_job(form)
+    def task(cursor):
+        cursor.execute("UPDATE jobs SET description = 'outer' WHERE id = ?", (job_id,))
+        # reading and writing from the writer thread must not roll back its transaction
+        value = db.get_value(job_id, "description")
+        db.set_value(job_id, "strategy", "nested")
+        return value
+    assert db.write(task) == "outer"
+    assert db.get_value(job_id, "description") == "outer"
+    assert db.get_value(job_id, "strategy") == "nested"
+    db.delete_job(job_id)
+
+def test_migrations():
+    # create a database as it was before the migrations existed
+    db_path = config.get("database.file.path")
+    legacy_path = "./test/legacy.db"
+    for file in [legacy_path, legacy_path + "-wal", legacy_path + "-shm"]:
+        if os.path.isfile(file): os.remove(file)
+    cnx = sqlite3.connect(legacy_path)
+    cnx.execute("CREATE TABLE jobs(id INTEGER PRIMARY KEY AUTOINCREMENT UNIQUE, owner TEXT NOT NULL, app_name TEXT NOT NULL, strategy TEXT NOT NULL, description TEXT NOT NULL, settings TEXT NOT NULL, status TEXT NOT NULL, host TEXT, creation_date INTEGER, start_date INTEGER, end_date INTEGER, stdout TEXT, stderr TEXT, job_dir TEXT)")
+    with open("test/jobs/job1.settings", 'r') as xml: settings = xml.read().replace("\n", "")
+    for i in range(5):
+        status = "ARCHIVED_DONE" if i < 2 else "DONE"
+        cnx.execute("INSERT INTO jobs VALUES (NULL, 'old.user', 'diann_2.0', 'first_available', 'legacy', ?, ?, '', 0, 0, 0, '', '', '')", (settings, status))
+    cnx.commit()
+    cnx.close()
+    try:
+        config.CONFIG["database.file.path"] = legacy_path
+        # the backfills are run by small chunks
+        db.BACKFILL_CHUNK_SIZE = 2
+        db.initialize_database()
+        db.BACKFILLER.join()
+        cnx, cursor = db.connect()
+        assert db.get_schema_version(cursor) == db.MIGRATIONS[-1][0]
+        assert cursor.execute("SELECT COUNT(*) FROM pragma_table_info('jobs') WHERE name IN ('start_after_id', 'workflow_name', 'last_modified')").fetchone()[0] == 3
+        assert cursor.execute("SELECT COUNT(*) FROM backfills").fetchone()[0] == 0
+        # the archived jobs have been moved, the input files of every job have been recorded
+        assert db.get_jobs_per_status("DONE") == [3, 4, 5]
+        assert db.get_status(1) == "ARCHIVED_DONE"
+        assert cursor.execute("SELECT COUNT(DISTINCT job_id) FROM job_inputs").fetchone()[0] == 5
+        assert [job["id"] for job in db.search_jobs({"current_job_id": 1, "owner": "", "app": "", "description": "", "number": "", "date": "creation_date", "from": "", "to": "", "file": "", "text": "legacy"})] == [5, 4, 3]
+        # a backfill that has been interrupted continues where it stopped
+        db.write(lambda cursor: cursor.execute("DELETE FROM job_inputs"))
+        db.write(lambda cursor: db.add_backfill(cursor, "job_inputs"))
+        assert db.write(lambda cursor: db.run_backfill_chunk(cursor, "job_inputs")) == True
+        # jobs 1 and 2 are in the archive table now, so the first chunk is made of jobs 3 and 4
+        assert cursor.execute("SELECT last_id FROM backfills WHERE name = 'job_inputs'").fetchone()[0] == 4
+        assert cursor.execute("SELECT COUNT(DISTINCT job_id) FROM job_inputs").fetchone()[0] == 2
+        db.run_backfills()
+        assert cursor.execute("SELECT COUNT(DISTINCT job_id) FROM job_inputs").fetchone()[0] == 3
+        assert cursor.execute("SELECT COUNT(*) FROM backfills").fetchone()[0] == 0
+        # nothing is done at the next start
+        db.initialize_database()
+        assert db.BACKFILLER is None or not db.BACKFILLER.is_alive()
+    finally:
+        db.BACKFILL_CHUNK_SIZE = 500
+        config.CONFIG["database.file.path"] = db_path
+        db.initialize_database()
+        for file in [legacy_path, legacy_path + "-wal", legacy_path + "-shm"]:
+            if os.path.isfile(file): os.remove(file)
@@ -0,0 +1,98 @@
+# Copyright or © or Copr. Alexandre BUREL for LSMBO / IPHC UMR7178 / CNRS (2025)
+# 
+# [a.burel@unistra.fr]
+# 
+# This software is the server for Cumulus, a client-server to operate jobs on a Cloud.
+# 
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use, 
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info". 
+# 
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability. 
+# 
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or 
+# data to be ensured and,  more generally, to use and operate it in the 
+# same conditions as regards security. 
+# 
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+import libs.cumulus_config as config
+import libs.cumulus_database as db
+import libs.cumulus_fairshare as fairshare
+import libs.cumulus_scheduler as scheduler
+import pytest
+from types import SimpleNamespace
+
+NOW = 1000000
+
+@pytest.fixture(autouse = True)
+def flavors(monkeypatch):
+    monkeypatch.setattr(config, "FLAVORS", {"small": {"weight": 1}, "medium": {"weight": 2}})
+    monkeypatch.setattr(config, "FLAVORS_MAX_WEIGHT", 6)
+    monkeypatch.setattr(fairshare, "HALF_LIFE", 1000)
+    monkeypatch.setattr(fairshare, "USAGE", {})
+    monkeypatch.setattr(fairshare, "USAGE_DATE", None)
+
+def job(id, owner, status = "PENDING", strategy = "small", start_date = None):
+    return SimpleNamespace(id = id, owner = owner, strategy = strategy, app_name = "app", status = status, start_date = start_date)
+
+def test_update_usage(monkeypatch):
+    periods = []
+    def get_jobs_ended_between(start, end):
+        periods.append((start, end))
+        # a medium job of 100 seconds that has ended one half-life ago
+        return [("alice", "medium", NOW - 1160, NOW - 1060)] if len(periods) == 1 else []
+    monkeypatch.setattr(db, "get_jobs_ended_between", get_jobs_ended_between)
+    fairshare.update_usage(NOW)
+    assert periods == [(NOW - 60 - 10000, NOW - 60)]
+    assert fairshare.USAGE == {"alice": 100}
+    # the next update only reads the jobs that have ended since, and decays the usage
+    fairshare.update_usage(NOW + 1000)
+    assert periods[1] == (NOW - 60, NOW + 940)
+    assert fairshare.USAGE == {"alice": 50}
+    # the active jobs count up to now
+    snapshot = db.JobSnapshot([job(1, "bob", "RUNNING", "medium", NOW + 1000)], 2, {1: 2})
+    assert fairshare.get_usage(snapshot, NOW + 1010) == {"alice": pytest.approx(50 * 0.5 ** (70 / 1000)), "bob": 20}
+
+def test_order():
+    fairshare.USAGE = {"alice": 150}
+    fairshare.USAGE_DATE = NOW
+    jobs = [job(1, "alice"), job(2, "alice"), job(3, "bob"), job(4, "bob"), job(5, "bob")]
+    snapshot = db.JobSnapshot(jobs, 0, {})
+    # each job adds its expected usage to its owner
+    ordered = fairshare.order(jobs, snapshot, lambda app_name: 100, NOW)
+    assert [job.id for job in ordered] == [3, 4, 1, 5, 2]
+
+def test_caps_and_shares(monkeypatch):
+    monkeypatch.setattr(db, "get_jobs_ended_between", lambda start, end: [])
+    monkeypatch.setitem(config.CONFIG, "fairshare.enabled", "true")
+    monkeypatch.setitem(config.CONFIG, "fairshare.max.weight", "3")
+    monkeypatch.setitem(config.CONFIG, "fairshare.max.weight.bob", "0")
+    jobs = [job(2, "alice", strategy = "medium"), job(3, "alice"), job(4, "bob", strategy = "medium"), job(5, "bob", strategy = "medium")]
+    snapshot = db.JobSnapshot([job(1, "alice", "RUNNING", "small", NOW - 100)] + jobs, 1, {1: 1})
+    monkeypatch.setattr(scheduler, "ESTIMATES", {"app": 100})
+    monkeypatch.setattr(scheduler, "ESTIMATES_DATE", float("inf"))
+    decisions = scheduler.schedule(jobs, snapshot, "fifo", NOW)
+    # bob has not used anything yet, then the jobs are interleaved by usage
+    assert [decision.job_id for decision in decisions] == [4, 2, 5, 3]
+    # alice is limited to a weight of 3, bob has no limit but the weight is all taken
+    assert [decision.job_id for decision in decisions if decision.start] == [4, 2]
+    assert [decision.reason for decision in decisions if decision.job_id == 3] == ["Owner alice already reserves 3 of the 3 weight allowed"]
+    shares = fairshare.get_shares(snapshot, NOW)
+    assert shares[0] == {"owner": "alice", "usage": 100, "share": 1.0, "weight": 1, "cap": 3, "pending": 2}
+    assert shares[1]["owner"] == "bob"
+    assert shares[1]["cap"] == 0
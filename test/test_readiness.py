@@ -0,0 +1,76 @@
+# Copyright or © or Copr. Alexandre BUREL for LSMBO / IPHC UMR7178 / CNRS (2025)
+# 
+# [a.burel@unistra.fr]
+# 
+# This software is the server for Cumulus, a client-server to operate jobs on a Cloud.
+# 
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use, 
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info". 
+# 
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability. 
+# 
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or 
+# data to be ensured and,  more generally, to use and operate it in the 
+# same conditions as regards security. 
+# 
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+import libs.cumulus_readiness as readiness
+
+def watch(job_id, files, events):
+    readiness.watch(job_id, files, lambda: events.append((job_id, True)), lambda: events.append((job_id, False)))
+
+def test_watch(tmp_path):
+    existing = str(tmp_path / "existing.raw")
+    converted = str(tmp_path / "converted.mzML")
+    with open(existing, "w") as f: f.write("raw")
+    events = []
+    # nothing to wait for
+    watch(1, [existing], events)
+    assert events == [(1, True)]
+    watch(1, [existing, converted], events)
+    assert readiness.get_waiting() == {1: [converted]}
+    # the file exists but it's still being written
+    readiness.set_busy(converted)
+    with open(converted, "w") as f: f.write("mzML")
+    readiness.refresh([1])
+    assert readiness.get_waiting() == {1: [converted]}
+    assert events == [(1, True)]
+    readiness.set_ready(converted)
+    assert events == [(1, True), (1, True)]
+    assert readiness.get_waiting() == {}
+
+def test_refresh_and_cancel(tmp_path):
+    final_file = str(tmp_path / "final.file")
+    events = []
+    watch(2, [final_file], events)
+    watch(3, [final_file], events)
+    readiness.refresh([2, 3])
+    assert readiness.get_waiting() == {2: [final_file], 3: [final_file]}
+    # a file written by another process is found when the daemon checks again
+    with open(final_file, "w") as f: f.write("")
+    readiness.cancel(3)
+    readiness.refresh([2])
+    assert events == [(3, False), (2, True)]
+    # the jobs that are not active anymore stop waiting
+    watch(4, [str(tmp_path / "missing.raw")], events)
+    readiness.refresh([2])
+    assert events == [(3, False), (2, True), (4, False)]
+    # a job is only notified once
+    readiness.cancel(4)
+    assert events == [(3, False), (2, True), (4, False)]
+    assert readiness.get_waiting() == {}
@@ -0,0 +1,148 @@
+# Copyright or © or Copr. Alexandre BUREL for LSMBO / IPHC UMR7178 / CNRS (2025)
+# 
+# [a.burel@unistra.fr]
+# 
+# This software is the server for Cumulus, a client-server to operate jobs on a Cloud.
+# 
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use, 
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info". 
+# 
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability. 
+# 
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or 
+# data to be ensured and,  more generally, to use and operate it in the 
+# same conditions as regards security. 
+# 
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+import libs.cumulus_config as config
+import libs.cumulus_database as db
+import libs.cumulus_scheduler as scheduler
+import libs.cumulus_warmpool as warmpool
+import pytest
+import time
+from types import SimpleNamespace
+
+NOW = 1000000
+
+@pytest.fixture(autouse = True)
+def flavors(monkeypatch):
+    monkeypatch.setattr(config, "FLAVORS", {"small": {"weight": 1}, "medium": {"weight": 2}, "large": {"weight": 4}})
+    monkeypatch.setattr(config, "FLAVORS_MAX_WEIGHT", 6)
+    # the jobs are given to the policies oldest first (see test_fairshare)
+    monkeypatch.setitem(config.CONFIG, "fairshare.enabled", "false")
+    # the durations are not read from the database
+    monkeypatch.setattr(scheduler, "ESTIMATES", {"short": 100, "long": 1000})
+    monkeypatch.setattr(scheduler, "ESTIMATES_DATE", time.monotonic())
+
+def job(id, strategy, app_name, status = "PENDING", start_date = None, owner = "test.user"):
+    return SimpleNamespace(id = id, strategy = strategy, app_name = app_name, status = status, start_date = start_date, owner = owner)
+
+def get_snapshot(jobs):
+    # two medium jobs are running, they are expected to end in 900 and 1800 seconds
+    running = [job(1, "medium", "long", "RUNNING", NOW - 100), job(2, "medium", "long", "RUNNING", NOW + 800)]
+    return db.JobSnapshot(running + jobs, 4, {1: 2, 2: 2})
+
+def get_started(decisions):
+    return [decision.job_id for decision in decisions if decision.start]
+
+def test_get_policy():
+    assert scheduler.get_policy("easy")[1] == scheduler.schedule_easy_backfill
+    with pytest.raises(ValueError):
+        scheduler.get_policy("random")
+
+def test_fifo():
+    jobs = [job(3, "large", "long"), job(4, "medium", "long"), job(5, "small", "short")]
+    decisions = scheduler.schedule(jobs, get_snapshot(jobs), "fifo", NOW)
+    # the large job waits, the next jobs take the free weight
+    assert get_started(decisions) == [4]
+    assert "larger than the free weight" in decisions[0].reason
+
+def test_easy_backfill():
+    jobs = [job(3, "large", "long"), job(4, "medium", "long"), job(5, "small", "short"), job(6, "unknown", "long")]
+    decisions = scheduler.schedule(jobs, get_snapshot(jobs), "easy", NOW)
+    # the large job is reserved when the first running job ends, only the short job ends before
+    assert get_started(decisions) == [5]
+    assert decisions[0].reason.endswith("reserved in 900 seconds")
+    assert decisions[1].reason == "Starting it would delay the reserved job"
+    assert decisions[2].reason.startswith("Backfilled")
+    # an unknown flavor is replaced by the default one
+    assert decisions[3].flavor == "small"
+    assert not decisions[3].start
+    # the decisions are kept with their reason
+    state = scheduler.get_decisions()
+    assert [decision["job_id"] for decision in state["decisions"]] == [3, 4, 5, 6]
+    assert state["decisions"][2]["policy"] == "easy"
+
+def test_best_fit():
+    jobs = [job(3, "small", "short"), job(4, "medium", "long")]
+    decisions = scheduler.schedule(jobs, get_snapshot(jobs), "bestfit", NOW)
+    # the medium job fills the free weight, even if the small one is older
+    assert get_started(decisions) == [4]
+    assert get_started(scheduler.schedule(jobs, get_snapshot(jobs), "fifo", NOW)) == [3]
+
+def test_warm_workers(monkeypatch):
+    monkeypatch.setattr(config, "FLAVORS_MAX_WEIGHT", 7)
+    jobs = [job(3, "medium", "long"), job(4, "small", "short")]
+    warm_workers = [{"flavor": "medium", "weight": 2, "status": "READY", "job_id": None, "owner": None}, {"flavor": "small", "weight": 1, "status": "BOOTING", "job_id": None, "owner": None}]
+    # the idle medium worker gives its weight to the medium job, the booting one keeps its weight
+    decisions = scheduler.schedule(jobs, get_snapshot(jobs), "fifo", NOW, warm_workers)
+    assert get_started(decisions) == [3]
+    assert decisions[1].reason == "Weight 1 is larger than the free weight (0)"
+    # a worker handed over by a job is kept for the jobs of the same owner
+    jobs = [job(3, "medium", "long", owner = "other.user")]
+    warm_workers = [{"flavor": "medium", "weight": 2, "status": "READY", "job_id": None, "owner": "test.user"}]
+    monkeypatch.setattr(config, "FLAVORS_MAX_WEIGHT", 6)
+    assert get_started(scheduler.schedule(jobs, get_snapshot(jobs), "fifo", NOW, warm_workers)) == []
+    jobs = [job(3, "medium", "long")]
+    assert get_started(scheduler.schedule(jobs, get_snapshot(jobs), "fifo", NOW, warm_workers)) == [3]
+
+def test_hand_over(monkeypatch, tmp_path):
+    monkeypatch.setattr(warmpool, "LEASE_LIFETIME", 3600)
+    monkeypatch.setattr(db, "get_reserved_flavor", lambda job_id: "medium")
+    monkeypatch.setattr(db, "release_worker", lambda *args: True)
+    (tmp_path / config.HOST_FILE).write_text("name:worker_job_1\naddress:10.0.0.1\ncpu:4\nram:16\nvolume:volume_job_1\n")
+    jobs = [job(3, "medium", "long"), job(4, "medium", "long")]
+    for pending in jobs: pending.start_after_id = None
+    snapshot = get_snapshot(jobs)
+    # job 1 is done, its worker is handed over to job 3
+    ended = snapshot.jobs[1]
+    ended.status = "DONE"
+    ended.job_dir = str(tmp_path)
+    assert warmpool.hand_over(ended, snapshot)
+    assert (snapshot.reserved_weight, snapshot.weights) == (2, {2: 2})
+    # its weight is only counted once, by the idle worker that job 3 takes over, so job 4 can start too
+    warm_workers = [{"flavor": "medium", "weight": 2, "status": "READY", "job_id": None, "owner": "test.user"}]
+    assert get_started(scheduler.schedule(jobs, snapshot, "fifo", NOW, warm_workers)) == [3, 4]
+
+def test_speculate(monkeypatch):
+    ready = [job(3, "small", "short")]
+    uploading = [job(4, "large", "long"), job(5, "small", "long"), job(6, "small", "long")]
+    snapshot = get_snapshot(ready + uploading)
+    decisions = scheduler.schedule(ready, snapshot, "fifo", NOW)
+    # the speculative provisioning is disabled by default
+    assert scheduler.speculate(uploading, snapshot, decisions) == []
+    monkeypatch.setitem(config.CONFIG, "speculative.provisioning", "true")
+    # the weight left by the ready job is given to the uploading jobs that fit, oldest first
+    snapshot.reserved_weight += 1
+    assert get_started(scheduler.speculate(uploading, snapshot, decisions)) == [5]
+    # the idle warm workers keep their weight
+    assert scheduler.speculate(uploading, snapshot, decisions, [{"flavor": "medium", "weight": 1, "status": "READY", "job_id": None, "owner": None}]) == []
+    # nothing is created in advance while a ready job waits
+    decisions[0].start = False
+    assert scheduler.speculate(uploading, snapshot, decisions) == []
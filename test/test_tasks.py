@@ -0,0 +1,109 @@
+# Copyright or © or Copr. Alexandre BUREL for LSMBO / IPHC UMR7178 / CNRS (2025)
+# 
+# [a.burel@unistra.fr]
+# 
+# This software is the server for Cumulus, a client-server to operate jobs on a Cloud.
+# 
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use, 
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info". 
+# 
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability. 
+# 
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or 
+# data to be ensured and,  more generally, to use and operate it in the 
+# same conditions as regards security. 
+# 
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+import libs.cumulus_tasks as tasks
+import threading
+import time
+
+def test_bounded_pool():
+    pool = tasks.TaskPool("test", 2)
+    lock = threading.Lock()
+    running = [0, 0] # current, maximum
+    def work():
+        with lock:
+            running[0] += 1
+            running[1] = max(running[1], running[0])
+        time.sleep(0.05)
+        with lock: running[0] -= 1
+    for job_id in range(6): pool.submit("work", job_id, work)
+    assert pool.wait(5)
+    # never more than two tasks at the same time, and no more threads than that
+    assert running[1] == 2
+    assert len(pool.workers) == 2
+    state = pool.get_tasks()
+    assert len(state["finished"]) == 6
+    assert all(task["status"] == tasks.DONE and task["duration"] >= 0.05 for task in state["finished"])
+
+def test_queue_and_cancel():
+    pool = tasks.TaskPool("test", 1)
+    event = threading.Event()
+    done = []
+    first = pool.submit("block", 1, event.wait, 5)
+    # the other tasks wait while the only thread is busy
+    while first.status != tasks.RUNNING: time.sleep(0.01)
+    pool.submit("work", 3, done.append, 3, priority = 1)
+    pool.submit("work", 2, done.append, 2)
+    # the same task is not queued twice
+    task = pool.submit("work", 2, done.append, 2)
+    assert [task.job_id for task in pool.get_queue()] == [2, 3]
+    assert pool.submit("work", 2, done.append, 2) is task
+    # only the queued tasks are cancelled
+    assert pool.cancel(2) == [task]
+    assert pool.cancel(1) == []
+    state = pool.get_tasks()
+    assert [task["job_id"] for task in state["queued"]] == [3]
+    assert state["finished"][0]["status"] == tasks.CANCELLED
+    event.set()
+    assert pool.wait(5)
+    assert done == [3]
+
+def test_failed_task():
+    pool = tasks.TaskPool("test", 1)
+    task = pool.submit("fail", 1, lambda: 1 / 0)
+    assert pool.wait(5)
+    assert task.status == tasks.FAILED
+    assert "division" in task.error
+    # the worker survives the failure
+    assert pool.submit("work", 1, int).key == ("work", 1)
+    assert pool.wait(5)
+    assert pool.get_tasks()["finished"][0]["status"] == tasks.DONE
+
+def test_priority_and_result():
+    pool = tasks.TaskPool("test", 1)
+    event = threading.Event()
+    done = []
+    first = pool.submit("block", 0, event.wait, 5)
+    while first.status != tasks.RUNNING: time.sleep(0.01)
+    # the tasks are identified by their file, a second job asking for the same file only moves it forward
+    pool.submit("convert", 1, done.append, "a.raw", key = "a.raw", priority = 300)
+    pool.submit("convert", 2, done.append, "b.raw", key = "b.raw", priority = 200)
+    task = pool.submit("convert", 3, done.append, "a.raw", key = "a.raw", priority = 100)
+    assert task.job_id == 1
+    assert pool.is_active("a.raw")
+    assert [task.key for task in pool.get_queue()] == ["a.raw", "b.raw"]
+    event.set()
+    assert pool.wait(5)
+    assert done == ["a.raw", "b.raw"]
+    assert not pool.is_active("a.raw")
+    # the value returned by the function is kept with the timing of the task
+    assert first.result == True
+    assert pool.get_tasks()["finished"][-1]["result"] == True
@@ -134,4 +134,5 @@ def test_get_zombie_jobs():
 def test_get_unused_shared_files_older_than():
     assert len(utils.get_unused_shared_files_older_than(86400)) == 5
     # remove the test database
-    os.remove("test/cumulus.db")
\ No newline at end of file
+    for file in ["test/cumulus.db", "test/cumulus.db-wal", "test/cumulus.db-shm"]:
+        if os.path.isfile(file): os.remove(file)
\ No newline at end of file
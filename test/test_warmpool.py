@@ -0,0 +1,141 @@
+# Copyright or © or Copr. Alexandre BUREL for LSMBO / IPHC UMR7178 / CNRS (2025)
+# 
+# [a.burel@unistra.fr]
+# 
+# This software is the server for Cumulus, a client-server to operate jobs on a Cloud.
+# 
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use, 
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info". 
+# 
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability. 
+# 
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or 
+# data to be ensured and,  more generally, to use and operate it in the 
+# same conditions as regards security. 
+# 
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+import libs.cumulus_config as config
+import libs.cumulus_database as db
+import libs.cumulus_scheduler as scheduler
+import libs.cumulus_tasks as tasks
+import libs.cumulus_warmpool as warmpool
+import pytest
+from types import SimpleNamespace
+
+NOW = 1000000
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(config, "FLAVORS", {"small": {"weight": 1}, "medium": {"weight": 2}})
+    monkeypatch.setattr(config, "FLAVORS_MAX_WEIGHT", 6)
+    monkeypatch.setitem(config.CONFIG, "warmpool.size", "small:2, medium:1, unknown:1")
+    monkeypatch.setattr(scheduler, "DECISIONS", {})
+    # the warm workers are kept in memory, and nothing is really created or destroyed
+    workers = []
+    submitted = []
+    def add_warm_worker(name, flavor, weight, max_weight):
+        if sum(worker["weight"] for worker in workers) + weight > max_weight: return False
+        workers.append({"name": name, "flavor": flavor, "weight": weight, "status": "BOOTING", "volume": None, "created_at": NOW, "ready_at": None, "job_id": None, "owner": None})
+        return True
+    def delete_warm_worker(name, only_if_idle = False):
+        workers[:] = [worker for worker in workers if worker["name"] != name]
+        return True
+    monkeypatch.setattr(db, "get_warm_workers", lambda: [dict(worker) for worker in workers])
+    monkeypatch.setattr(db, "add_warm_worker", add_warm_worker)
+    monkeypatch.setattr(db, "delete_warm_worker", delete_warm_worker)
+    monkeypatch.setattr(tasks.PROVISIONING, "submit", lambda name, job_id, function, *args, key = None: submitted.append((name, args)))
+    monkeypatch.setattr(tasks.TEARDOWN, "submit", lambda name, job_id, function, *args, key = None: submitted.append((name, args)))
+    return workers, submitted
+
+def test_get_sizes(pool):
+    assert warmpool.get_sizes() == {"small": 2, "medium": 1}
+
+def test_maintain(pool):
+    workers, submitted = pool
+    # the missing workers are created
+    warmpool.maintain(NOW)
+    assert [(worker["flavor"], worker["status"]) for worker in workers] == [("small", "BOOTING"), ("small", "BOOTING"), ("medium", "BOOTING")]
+    assert [name for name, args in submitted] == ["create_warm_worker"] * 3
+    for worker in workers:
+        worker["status"] = "READY"
+        worker["ready_at"] = NOW
+    # an idle worker is evicted after the TTL, and replaced
+    workers[0]["ready_at"] = NOW - warmpool.TTL - 1
+    evicted = workers[0]["name"]
+    submitted.clear()
+    warmpool.maintain(NOW)
+    assert [name for name, args in submitted] == ["destroy_warm_worker", "create_warm_worker"]
+    assert submitted[0][1] == (evicted, None)
+    assert submitted[1][1][1] == "small"
+    assert evicted not in [worker["name"] for worker in workers]
+    assert len(set(worker["name"] for worker in workers)) == 3
+    # the jobs waiting for their weight are served first, the worker still booting is kept
+    scheduler.DECISIONS[10] = scheduler.Decision(10, "medium", 2, False, "Weight 2 is larger than the free weight (1)")
+    submitted.clear()
+    warmpool.maintain(NOW)
+    assert [name for name, args in submitted] == ["destroy_warm_worker"]
+    assert sorted(worker["flavor"] for worker in workers) == ["medium", "small"]
+    assert [worker["status"] for worker in workers if worker["flavor"] == "small"] == ["BOOTING"]
+
+def test_hand_over(pool, monkeypatch, tmp_path):
+    workers, submitted = pool
+    monkeypatch.setattr(warmpool, "LEASE_LIFETIME", 3600)
+    monkeypatch.setattr(db, "get_reserved_flavor", lambda job_id: "small")
+    released = []
+    monkeypatch.setattr(db, "release_worker", lambda *args: released.append(args) or True)
+    (tmp_path / config.HOST_FILE).write_text("name:worker_job_1\naddress:10.0.0.1\ncpu:4\nram:16\nvolume:volume_job_1\n")
+    ended = SimpleNamespace(id = 1, owner = "test.user", app_name = "diann_2.0", status = "DONE", job_dir = str(tmp_path), start_date = NOW)
+    jobs = [SimpleNamespace(id = id, owner = owner, app_name = app_name, strategy = strategy, status = "PENDING", start_after_id = start_after_id)
+        for id, owner, app_name, strategy, start_after_id in [(2, "other.user", "diann_2.0", "small", None), (3, "test.user", "alphadia", "small", None), (4, "test.user", "diann_2.0", "medium", None), (5, "test.user", "alphadia", "small", 1)]]
+    snapshot = db.JobSnapshot(jobs, 0)
+    # the next job of the workflow comes first, then the other jobs of the owner with the same flavor
+    assert warmpool.get_next_job(ended, "small", snapshot).id == 5
+    assert warmpool.get_next_job(ended, "small", db.JobSnapshot(jobs[:3], 0)).id == 3
+    assert warmpool.get_next_job(ended, "medium", db.JobSnapshot(jobs[:2], 0)) == None
+    assert warmpool.hand_over(ended, snapshot)
+    assert released == [(1, "worker_job_1", "small", 1, "10.0.0.1", "volume_job_1", "test.user", "diann_2.0", NOW, 3600)]
+    # the workers of the failed jobs are destroyed
+    ended.status = "FAILED"
+    assert warmpool.hand_over(ended, snapshot) == False
+    # and so are all the workers when the leases are disabled
+    ended.status = "DONE"
+    monkeypatch.setattr(warmpool, "LEASE_LIFETIME", 0)
+    assert warmpool.hand_over(ended, snapshot) == False
+    assert len(released) == 1
+
+def test_maintain_leases(pool, monkeypatch):
+    workers, submitted = pool
+    monkeypatch.setitem(config.CONFIG, "warmpool.size", "")
+    monkeypatch.setattr(warmpool, "LEASE_LIFETIME", 3600)
+    monkeypatch.setattr(warmpool, "LEASE_IDLE", 600)
+    for name, created_at, ready_at in [("worker_job_1", NOW - 100, NOW - 50), ("worker_job_2", NOW - 100, NOW - 700), ("worker_job_3", NOW - 4000, NOW - 50)]:
+        workers.append({"name": name, "flavor": "small", "weight": 1, "status": "READY", "volume": f"volume_{name[7:]}", "created_at": created_at, "ready_at": ready_at, "job_id": None, "owner": "test.user"})
+    # the workers handed over are not part of the pool, they are destroyed when they stay idle or when their lease ends
+    warmpool.maintain(NOW)
+    assert submitted == [("destroy_warm_worker", ("worker_job_2", "volume_job_2")), ("destroy_warm_worker", ("worker_job_3", "volume_job_3"))]
+    assert [worker["name"] for worker in workers] == ["worker_job_1"]
+
+def test_destroy_stale_workers(pool):
+    workers, submitted = pool
+    for name, status in [("worker_warm_1", "BOOTING"), ("worker_warm_2", "READY"), ("worker_job_3", "ORPHANED")]:
+        workers.append({"name": name, "flavor": "small", "weight": 1, "status": status, "volume": f"volume_{name}", "created_at": NOW, "ready_at": NOW, "job_id": None, "owner": None})
+    # the workers that were booting, and the ones left by a stopped job, are destroyed at startup
+    warmpool.destroy_stale_workers()
+    assert submitted == [("destroy_warm_worker", ("worker_warm_1", "volume_worker_warm_1")), ("destroy_warm_worker", ("worker_job_3", "volume_worker_job_3"))]
+    assert [worker["name"] for worker in workers] == ["worker_warm_2"]
@@ -0,0 +1,68 @@
+# Copyright or © or Copr. Alexandre BUREL for LSMBO / IPHC UMR7178 / CNRS (2025)
+# 
+# [a.burel@unistra.fr]
+# 
+# This software is the server for Cumulus, a client-server to operate jobs on a Cloud.
+# 
+# This software is governed by the CeCILL license under French law and
+# abiding by the rules of distribution of free software.  You can  use, 
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# "http://www.cecill.info". 
+# 
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability. 
+# 
+# In this respect, the user's attention is drawn to the risks associated
+# with loading,  using,  modifying and/or developing or reproducing the
+# software by the user in light of its specific status of free software,
+# that may mean  that it is complicated to manipulate,  and  that  also
+# therefore means  that it is reserved for developers  and  experienced
+# professionals having in-depth computer knowledge. Users are therefore
+# encouraged to load and test the software's suitability as regards their
+# requirements in conditions enabling the security of their systems and/or 
+# data to be ensured and,  more generally, to use and operate it in the 
+# same conditions as regards security. 
+# 
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+import libs.cumulus_config as config
+import libs.cumulus_watcher as watcher
+import pytest
+import time
+
+@pytest.mark.parametrize("use_inotify", [True, False])
+def test_watch(tmp_path, monkeypatch, use_inotify):
+    monkeypatch.setattr(watcher, "POLLING_INTERVAL", 0.1)
+    monkeypatch.setattr(watcher, "DEBOUNCE_DELAY", 0)
+    assert watcher.start(use_inotify) == ("inotify" if use_inotify else "polling")
+    try:
+        job_dir = tmp_path / "Job_1"
+        job_dir.mkdir()
+        watcher.watch([str(job_dir), str(tmp_path / "not_created_yet")])
+        assert watcher.wait(0.3) == False
+        # the other files of the job do not trigger a check
+        (job_dir / config.JOB_ALIVE_FILE).touch()
+        assert watcher.wait(0.3) == False
+        # the end of the job is seen immediately
+        start = time.time()
+        (job_dir / config.JOB_STOP_FILE).touch()
+        assert watcher.wait(5) == True
+        assert time.time() - start < 2
+        # the same for the final file
+        (job_dir / config.get("final.file")).write_text("done")
+        assert watcher.wait(5) == True
+        # the jobs that are not active anymore are not watched
+        watcher.watch([])
+        (job_dir / config.HOST_FILE).touch()
+        assert watcher.wait(0.3) == False
+        # a job that is watched after its files have been created is checked at once
+        watcher.watch([str(job_dir)])
+        assert watcher.wait(1) == True
+    finally:
+        watcher.stop()
+    assert watcher.BACKEND == None